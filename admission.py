@@ -0,0 +1,209 @@
+"""
+Admission control for the AI endpoints.
+
+Every AI request must pass three gates before any work is done:
+
+1. a per-student token bucket (so one student can't spend everyone's quota)
+2. a global token bucket (so the whole site stays inside the upstream quota)
+3. a bounded number of concurrently running AI requests. Up to
+   `max_queue` requests may wait at most `max_queue_wait` seconds for a
+   slot. When the queue is full, they are shed at once.
+
+Token buckets live in a pluggable backend. MemoryRateLimitBackend is per
+process. SQLiteRateLimitBackend keeps buckets in one SQLite file so the
+limits hold across worker processes, and is the local stand-in for a
+shared limiter service. The concurrency gate is per process, like the
+LLM gateway.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryRateLimitBackend:
+    """In-process token buckets; idle buckets beyond max_keys are dropped oldest first"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'buckets': len(self._buckets)}
+
+
+class SQLiteRateLimitBackend:
+    """Token buckets shared by every worker process through one SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (key, tokens, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def stats(self):
+        buckets = self._conn().execute('SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+        return {'backend': 'sqlite', 'buckets': buckets}
+
+
+class Admission:
+    """Outcome of admit(). If shed is set, the request must not do any work.
+
+    An admitted request holds a concurrency slot until release() (or the
+    end of a `with` block).
+    """
+
+    __slots__ = ('shed', 'retry_after', '_release')
+
+    def __init__(self, shed=None, retry_after=0.0, release=None):
+        self.shed = shed
+        self.retry_after = retry_after
+        self._release = release
+
+    def release(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Rate limits plus a bounded, time-limited wait for a concurrency slot"""
+
+    def __init__(self, backend, student_rate=20 / 60.0, student_burst=5, global_rate=20.0,
+                 global_burst=40, max_concurrent=16, max_queue=32, max_queue_wait=2.0):
+        self.backend = backend
+        self.student_rate = student_rate
+        self.student_burst = student_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self.admitted = 0
+        self.shed = {}
+
+    def _shed(self, reason, retry_after=0.0):
+        with self._lock:
+            self.shed[reason] = self.shed.get(reason, 0) + 1
+        return Admission(shed=reason, retry_after=retry_after)
+
+    def _take(self, key, rate, burst):
+        try:
+            return self.backend.take(key, rate, burst)
+        except sqlite3.Error as e:
+            # A limiter that can't be reached must not take the AI endpoints down
+            print(f"Rate limit backend error: {e}")
+            return True, 0.0
+
+    def admit(self, student_id):
+        """Admit one AI request for a student, or say why it was shed"""
+        if self.student_rate:
+            allowed, retry_after = self._take(f"student:{student_id}", self.student_rate, self.student_burst)
+            if not allowed:
+                return self._shed('student_rate', retry_after)
+        if self.global_rate:
+            allowed, retry_after = self._take('global', self.global_rate, self.global_burst)
+            if not allowed:
+                return self._shed('global_rate', retry_after)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                full = self._waiting >= self.max_queue
+                if not full:
+                    self._waiting += 1
+            if full:
+                return self._shed('queue_full')
+            try:
+                acquired = self._slots.acquire(timeout=self.max_queue_wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                return self._shed('queue_timeout')
+
+        with self._lock:
+            self._running += 1
+            self.admitted += 1
+        return Admission(release=self._release)
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+        self._slots.release()
+
+    def stats(self):
+        stats = self.backend.stats()
+        with self._lock:
+            stats.update({
+                'running': self._running,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+            })
+        return stats
@@ -1,19 +1,53 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import sqlite3
 import os
+import sys
 import requests
-from datetime import datetime
+from datetime import datetime, timezone
 import json
+import hashlib
+import math
 import random
-import base64
-from PIL import Image
-import io
+import time
+import atexit
+import queue
+import threading
+from collections import OrderedDict, deque
 from werkzeug.utils import secure_filename
+from upstream import (BACKGROUND, CircuitBreaker, LLMGateway, QuotaTracker, RetryBudget, SingleFlight,
+                      StreamFinished, StreamTruncated, UpstreamClient, UpstreamPolicy)
+from response_cache import (MemoryCacheBackend, ResponseCache, SQLiteCacheBackend, is_context_dependent,
+                            looks_like_follow_up, make_cache_key)
+from neardup import MinHashLSH
+from bm25 import BM25Index
+from image_pool import ImagePool, ImagePoolSaturated
+from admission import Admission, AdmissionController, MemoryRateLimitBackend, SQLiteRateLimitBackend
+from context_builder import IMAGE_TOKENS, ContextBuilder, estimate_tokens, truncate_to_tokens
+from upstream_replay import RecordingClient, ReplayClient, TrafficRecorder
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, NULL_SPAN, MetricsRegistry
+from model_router import ModelRouter, load_routes
+from subject_classifier import DEFAULT_VOCABULARY, SubjectClassifier, load_vocabulary, merge_vocabulary
+from system_prompts import FULL_SYSTEM_PROMPT, SystemPromptLibrary
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 CORS(app)  # Enable CORS for all routes
 
+@app.before_request
+def _start_request_timer():
+    if get_metrics() is not None:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    started = g.pop('request_started', None)
+    registry = get_metrics()
+    if started is not None and registry is not None:
+        registry.observe('tutorly_http_request_seconds', time.perf_counter() - started,
+                         endpoint=request.endpoint or 'unmatched', method=request.method,
+                         status=str(response.status_code))
+    return response
+
 # Configure upload settings
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
@@ -30,60 +64,16 @@ if not os.path.exists(UPLOAD_FOLDER):
 DATABASE = 'tutorly.db'
 
 # Tutorly System Prompt
-TUTORLY_SYSTEM_PROMPT = """You are Tutorly, an expert AI homework tutor designed to help K-12 and college students learn effectively. Your mission is to guide students to understanding rather than simply providing answers.
-
-## Core Teaching Principles:
-- **Guide, don't solve**: Break down problems into steps and let students work through them
-- **Encourage critical thinking**: Ask follow-up questions to deepen understanding
-- **Build confidence**: Use positive, encouraging language and celebrate progress
-- **Adapt to level**: Adjust explanations based on the student's apparent grade level
-- **Connect concepts**: Help students see how topics relate to real-world applications
-
-## Response Structure:
-1. **Acknowledge the question** with enthusiasm
-2. **Break down the concept** into digestible steps
-3. **Provide guided examples** with clear explanations
-4. **Encourage practice** with similar problems
-5. **Invite follow-up questions** to ensure understanding
-
-## Subject Expertise:
-- **Mathematics**: Algebra, Geometry, Calculus, Statistics, Problem-solving strategies
-- **Sciences**: Biology, Chemistry, Physics, Environmental Science, Lab techniques
-- **History**: World history, American history, Historical analysis, Timeline connections
-- **Literature**: Reading comprehension, Writing techniques, Literary analysis, Grammar
-- **General**: Study skills, Research methods, Critical thinking, Test preparation
-
-## Tone and Style:
-- Friendly and approachable, like a patient teacher
-- Use analogies and real-world examples
-- Include relevant emojis sparingly for engagement (1-2 per response)
-- Vary response length based on question complexity
-- Always end with an invitation for more questions
-
-## Safety Guidelines:
-- Never provide direct answers to homework without explanation
-- Encourage academic integrity and original thinking
-- Redirect inappropriate questions back to educational content
-- Maintain appropriate boundaries as an educational assistant
-
-## Response Format:
-- Use **bold text** for important concepts and headers
-- Use bullet points (-) for lists and key points
-- Include step-by-step breakdowns when applicable
-- Provide concrete examples and analogies
-- Use clear paragraph breaks for readability
-- End with encouraging questions to continue learning
-
-## Important Rules:
-- NEVER give direct answers to homework problems
-- ALWAYS provide step-by-step guidance
-- ALWAYS encourage the student to think through the problem
-- Keep responses educational and age-appropriate
-- If asked about non-academic topics, politely redirect to educational content
-
-Remember: Your goal is to make learning enjoyable and help students develop genuine understanding that will serve them beyond just completing their current assignment.
-
-Respond to the student's question following these guidelines:"""
+# The one-piece prompt; requests normally carry the core plus their subject's section (see system_prompts.py)
+TUTORLY_SYSTEM_PROMPT = FULL_SYSTEM_PROMPT
+
+# Prompt for the background conversation summarizer
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a tutoring conversation between a student and Tutorly, an AI homework tutor. Update the current summary with the new turns.
+
+Keep: the subjects and problems worked on, what the student now understands, where they struggled, questions still open, and any preferences they stated (level, pace, language).
+Drop: greetings, encouragement and worked solutions already completed.
+
+Write plain sentences in the third person, at most {max_words} words. Reply with the updated summary only."""
 
 # Mock responses for fallback when Gemini is not available
 MOCK_RESPONSES = {
@@ -105,6 +95,12 @@ MOCK_RESPONSES = {
         "**Excellent literary thinking!** 📖\n\n**Let's unpack this together:**\n\n**Context Understanding:** What's the background or setting?\n**Textual Evidence:** What specific details support our ideas?\n**Personal Connection:** How does this relate to broader themes?\n**Writing Skills:** How can we express our thoughts clearly?\n\nRemember, there's often more than one valid interpretation! What's your initial thought about this? 💭"
     ],
     
+    'history': [
+        "**Great history question!** 🏛️\n\n**Let's investigate the past together:**\n\n**When and Where:**\n- What period and place are we talking about?\n- What was happening around that time?\n\n**Causes and Consequences:**\n- What led up to this event?\n- How did it change things afterwards?\n\n**Different Perspectives:**\n- Who was involved, and how might each side have seen it?\n\nWhat do you already know about this period? Let's build the timeline from there! 📜",
+        
+        "**Excellent historical thinking!** 🗺️\n\n**Let's piece this together like a historian:**\n\n**Context:** What was the world like at the time?\n**Evidence:** What sources tell us about it, and can we trust them?\n**Cause and Effect:** Why did it happen, and what followed?\n**Connections:** How does it still shape the present?\n\nHistory is a story we reconstruct from clues! Which part would you like to dig into first? 🔍"
+    ],
+    
     'general': [
         "**Great question!** 🎯\n\n**Let's work through this systematically:**\n\n**Step 1: Break it Down**\n- What are the key components of this problem?\n- What do we already understand?\n\n**Step 2: Find Connections**\n- How does this relate to things you've learned before?\n- What strategies have worked for similar problems?\n\n**Step 3: Build Understanding**\n- Let's work through this together, step by step\n- I'll guide you, but you'll do the thinking!\n\nWhat part feels most challenging right now? I'm here to help you build confidence! 💪",
         
@@ -112,16 +108,502 @@ MOCK_RESPONSES = {
     ]
 }
 
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to its pool when closed.
+
+    With a metrics registry attached, the time of every execute and
+    commit is recorded in tutorly_db_query_seconds.
+    """
+    pool = None
+    metrics = None
+
+    def execute(self, sql, parameters=()):
+        if self.metrics is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.metrics.observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.metrics is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.metrics.observe_query(sql, time.perf_counter() - start)
+
+    def commit(self):
+        if self.metrics is None:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            self.metrics.observe_query('COMMIT', time.perf_counter() - start)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+class ConnectionPool:
+    """Pool of tuned SQLite connections shared by all request threads.
+
+    Connections are opened with check_same_thread=False and handed to one
+    thread at a time. Up to `size` idle connections are kept; any extra
+    connection opened under a burst is really closed when released.
+    """
+
+    def __init__(self, database, size=8, journal_mode='WAL', synchronous='NORMAL',
+                 busy_timeout_ms=5000, cached_statements=128, mmap_size=256 * 1024 * 1024, metrics=None):
+        self.database = database
+        self.metrics = metrics
+        self.size = size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.mmap_size = mmap_size
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000.0,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.pool = self if self.size > 0 else None
+        conn.metrics = self.metrics
+        return conn
+
+    def acquire(self):
+        """Take an idle connection, opening a new one if none is free"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction"""
+        if conn.in_transaction:
+            conn.rollback()
+        if not self._closed:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        sqlite3.Connection.close(conn)
+
+    def close_all(self):
+        """Close every idle connection and stop pooling new releases"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            sqlite3.Connection.close(conn)
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Get the process-wide connection pool, configured from the environment"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool.database != DATABASE:
+            if _db_pool is not None:
+                _db_pool.close_all()
+            _db_pool = ConnectionPool(
+                DATABASE,
+                size=int(os.environ.get('DB_POOL_SIZE', 8)),
+                journal_mode=os.environ.get('DB_JOURNAL_MODE', 'WAL'),
+                synchronous=os.environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+                busy_timeout_ms=int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000)),
+                cached_statements=int(os.environ.get('DB_STATEMENT_CACHE', 128)),
+                mmap_size=int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+                metrics=get_metrics()
+            )
+        return _db_pool
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """Get the process-wide metrics registry, or None if METRICS is 'off'"""
+    global _metrics
+    if os.environ.get('METRICS', 'on').lower() == 'off':
+        return None
+    if _metrics is not None:
+        # Lock-free fast path: this runs several times per request
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+            _metrics.describe('tutorly_http_request_seconds',
+                              'Time until the response headers are ready, by endpoint and status')
+            _metrics.describe('tutorly_stage_seconds', 'Time spent in each stage of the AI request path')
+            _metrics.describe('tutorly_db_query_seconds', 'SQLite execute time by statement kind and table')
+            _metrics.describe('tutorly_route_seconds', 'Upstream generation time by model route')
+            _metrics.add_collector(component_stats)
+        return _metrics
+
+def stage(name):
+    """Time one stage of a hot path into tutorly_stage_seconds (a no-op when METRICS is 'off')"""
+    registry = get_metrics()
+    return registry.span('tutorly_stage_seconds', stage=name) if registry is not None else NULL_SPAN
+
 def get_db_connection():
-    """Get database connection with row factory for easier data access"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a pooled database connection with row factory for easier data access.
 
-def init_database():
-    """Initialize the database with required tables"""
-    conn = get_db_connection()
-    
+    Callers keep using conn.close(); it hands the connection back to the pool.
+    """
+    return get_db_pool().acquire()
+
+class _WriteTicket:
+    """A group of chat rows that must be committed together"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+
+_FLUSH = object()
+_STOP = object()
+
+class ChatWriter:
+    """Single background writer that batches chat_messages inserts.
+
+    Requests submit rows and the writer thread commits them in batches of up
+    to `max_batch` rows. In 'async' mode it waits up to `max_delay_ms` for a
+    batch to fill and submit() returns at once. In 'sync' mode it commits
+    whatever is queued right away and submit() blocks until that commit has
+    happened (group commit). Readers call wait_for(student_id) first, so a
+    student always sees their own queued messages.
+    """
+
+    def __init__(self, database, max_batch=100, max_delay_ms=20, durability='sync', synchronous='NORMAL',
+                 metrics=None, write_timeout=35.0):
+        self.database = database
+        self.write_timeout = write_timeout
+        self.error = None
+        self.synchronous = synchronous
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.durability = durability
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """Queue (student_id, sender, message) rows for insertion.
+
+        Raises sqlite3.OperationalError if the writer thread has died, or in
+        sync mode if the rows aren't committed within write_timeout seconds.
+        """
+        if not self._thread.is_alive():
+            raise sqlite3.OperationalError(f"chat writer is not running: {self.error}")
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        ticket = _WriteTicket([(sid, sender, text, timestamp) for sid, sender, text in rows])
+        with self._cond:
+            for sid, _, _, _ in ticket.rows:
+                self._pending[sid] = self._pending.get(sid, 0) + 1
+        self._queue.put(ticket)
+        if self.durability == 'sync':
+            if not ticket.done.wait(self.write_timeout):
+                raise sqlite3.OperationalError(f"chat write not committed within {self.write_timeout}s")
+            if ticket.error is not None:
+                raise ticket.error
+        return ticket
+
+    def wait_for(self, student_id, timeout=5.0):
+        """Block until every queued row for this student has been committed"""
+        with self._cond:
+            if not self._pending.get(student_id):
+                return True
+        self._queue.put(_FLUSH)
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(student_id), timeout)
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far has been committed"""
+        self._queue.put(_FLUSH)
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self):
+        """Flush remaining rows and stop the writer thread"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5.0)
+
+    def _collect(self, first):
+        batch = [first]
+        size = len(first.rows)
+        deadline = time.monotonic() + self.max_delay
+        stop = False
+        while size < self.max_batch:
+            try:
+                if self.durability == 'sync':
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _FLUSH:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+            size += len(item.rows)
+        return batch, stop
+
+    def _commit(self, conn, batch):
+        error = None
+        try:
+            conn.executemany(
+                'INSERT INTO chat_messages (student_id, sender, message, timestamp) VALUES (?, ?, ?, ?)',
+                [row for ticket in batch for row in ticket.rows]
+            )
+            conn.commit()
+        except Exception as e:
+            print(f"Chat writer error: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            error = e
+        self._finish(batch, error)
+
+    def _finish(self, batch, error):
+        """Mark tickets committed (or failed with error) and wake their waiters"""
+        with self._cond:
+            for ticket in batch:
+                for sid, _, _, _ in ticket.rows:
+                    self._pending[sid] -= 1
+                    if not self._pending[sid]:
+                        del self._pending[sid]
+            self._cond.notify_all()
+        for ticket in batch:
+            ticket.error = error
+            ticket.done.set()
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            # Fail whatever is queued rather than leave its submitters waiting
+            print(f"Chat writer stopped: {e}")
+            self.error = e
+            failed = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, _WriteTicket):
+                    failed.append(item)
+            self._finish(failed, sqlite3.OperationalError(f"chat writer stopped: {e}"))
+
+    def _loop(self):
+        conn = sqlite3.connect(self.database, timeout=30, check_same_thread=False, factory=PooledConnection)
+        conn.metrics = self.metrics
+        conn.execute('PRAGMA busy_timeout = 30000')
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _FLUSH:
+                continue
+            if item is _STOP:
+                break
+            batch, stop = self._collect(item)
+            self._commit(conn, batch)
+        # Drain anything submitted before stop() so nothing queued is lost
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _WriteTicket):
+                leftovers.append(item)
+        if leftovers:
+            self._commit(conn, leftovers)
+        conn.close()
+
+_chat_writer = None
+_chat_writer_lock = threading.Lock()
+
+def get_chat_writer():
+    """Get the process-wide chat writer, configured from the environment"""
+    global _chat_writer
+    with _chat_writer_lock:
+        if _chat_writer is None or _chat_writer.database != DATABASE:
+            if _chat_writer is not None:
+                _chat_writer.stop()
+            _chat_writer = ChatWriter(
+                DATABASE,
+                max_batch=int(os.environ.get('CHAT_WRITE_BATCH', 100)),
+                max_delay_ms=int(os.environ.get('CHAT_WRITE_DELAY_MS', 20)),
+                durability=os.environ.get('CHAT_WRITE_MODE', 'sync').lower(),
+                synchronous=os.environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+                metrics=get_metrics(),
+                write_timeout=float(os.environ.get('CHAT_WRITE_TIMEOUT', 35))
+            )
+        return _chat_writer
+
+@atexit.register
+def _stop_chat_writer():
+    if _chat_writer is not None:
+        _chat_writer.stop()
+
+class ConversationCache:
+    """LRU cache of each active student's last few chat turns, oldest first.
+
+    Each entry also holds the student's rolling summary and how many of the
+    cached turns are newer than it, so building a request's context needs
+    no database reads on a hit. Saved messages are appended write-through,
+    but only for students already cached; a student who isn't cached is
+    loaded from the database on the next read. Saves, fills and
+    invalidations for the same student are serialized on a striped lock so
+    a fill can't race a concurrent save.
+    """
+
+    STRIPES = 64
+
+    def __init__(self, database, turns=20, max_students=10000):
+        self.database = database
+        self.turns = turns
+        self.max_students = max_students
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._student_locks = [threading.Lock() for _ in range(self.STRIPES)]
+
+    def lock_for(self, student_id):
+        """Lock serializing saves and fills for one student"""
+        return self._student_locks[hash(student_id) % self.STRIPES]
+
+    def get(self, student_id):
+        """Return (turns, summary, unsummarized turns) for a student, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(student_id)
+            turns, summary, unsummarized = entry
+            return list(turns), summary, unsummarized
+
+    def fill(self, student_id, turns, summary=None, unsummarized=0):
+        """Cache turns and the summary read from the database"""
+        with self._lock:
+            self._entries[student_id] = [deque(turns, maxlen=self.turns), summary, unsummarized]
+            self._entries.move_to_end(student_id)
+            while len(self._entries) > self.max_students:
+                self._entries.popitem(last=False)
+
+    def append(self, student_id, turns):
+        """Write-through for newly saved messages"""
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is not None:
+                entry[0].extend(turns)
+                entry[2] += len(turns)
+                self._entries.move_to_end(student_id)
+
+    def invalidate(self, student_id):
+        """Drop a student's entry, e.g. after their summary was rewritten"""
+        with self._lock:
+            self._entries.pop(student_id, None)
+
+_conversation_cache = None
+_conversation_cache_lock = threading.Lock()
+
+def get_conversation_cache():
+    """Get the process-wide conversation cache, configured from the environment"""
+    global _conversation_cache
+    with _conversation_cache_lock:
+        if _conversation_cache is None or _conversation_cache.database != DATABASE:
+            _conversation_cache = ConversationCache(
+                DATABASE,
+                turns=int(os.environ.get('CONTEXT_CACHE_TURNS', 20)),
+                max_students=int(os.environ.get('CONTEXT_CACHE_STUDENTS', 10000))
+            )
+        return _conversation_cache
+
+def _load_conversation(student_id):
+    """Return (recent turns, summary, unsummarized turns) for a student, from the cache if possible"""
+    cache = get_conversation_cache()
+    entry = cache.get(student_id)
+    if entry is not None:
+        return entry
+
+    with cache.lock_for(student_id):
+        entry = cache.get(student_id)
+        if entry is not None:
+            return entry
+        get_chat_writer().wait_for(student_id)
+        conn = get_db_connection()
+        rows = conn.execute(
+            'SELECT id, sender, message FROM chat_messages WHERE student_id = ? ORDER BY id DESC LIMIT ?',
+            (student_id, cache.turns)
+        ).fetchall()
+        row = conn.execute(
+            'SELECT summary, summarized_through FROM conversation_summaries WHERE student_id = ?',
+            (student_id,)
+        ).fetchone()
+        conn.close()
+        history = [{'sender': r['sender'], 'message': r['message']} for r in reversed(rows)]
+        summary, unsummarized = None, 0
+        if row is not None:
+            # Only the cached turns are ever sent, so counting the newer ones among them is enough
+            summary = row['summary']
+            unsummarized = sum(1 for r in rows if r['id'] > row['summarized_through'])
+        cache.fill(student_id, history, summary, unsummarized)
+    return history, summary, unsummarized
+
+def save_chat_messages(student_id, rows):
+    """Persist (sender, message) rows for a student and update the conversation cache"""
+    cache = get_conversation_cache()
+    with cache.lock_for(student_id):
+        get_chat_writer().submit([(student_id, sender, text) for sender, text in rows])
+        cache.append(student_id, [{'sender': sender, 'message': text} for sender, text in rows])
+    summarizer = get_conversation_summarizer()
+    if summarizer is not None:
+        summarizer.notify(student_id, len(rows))
+
+def get_conversation_context(student_id):
+    """Return (summary, recent turns) to send with a student's next AI request.
+
+    With a rolling summary, only the turns it doesn't cover yet are sent
+    verbatim, so the prompt stays roughly the same size however long the
+    session runs.
+    """
+    history, summary, unsummarized = _load_conversation(student_id)
+    if summary is None or get_conversation_summarizer() is None:
+        return None, history
+    return summary, history[-unsummarized:] if unsummarized else []
+
+def _table_columns(conn, table):
+    """Return the column names of a table"""
+    return {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _migration_base_tables(conn):
+    """v1: core tables plus the role/teacher_id columns on users"""
     # Users table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -132,18 +614,19 @@ def init_database():
         )
     ''')
 
-    # Add optional columns for roles/teachers if they don't exist
-    try:
+    # Optional columns for roles/teachers (older databases may lack them)
+    columns = _table_columns(conn, 'users')
+    if 'role' not in columns:
         # role column: 'student' or 'teacher'
         conn.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'student'")
-    except Exception:
-        pass
-    try:
-        # teacher_id column for teacher accounts
-        conn.execute("ALTER TABLE users ADD COLUMN teacher_id TEXT UNIQUE")
-    except Exception:
-        pass
-    
+    if 'teacher_id' not in columns:
+        # teacher_id column for teacher accounts; SQLite cannot ADD a UNIQUE
+        # column, so uniqueness is enforced by an index instead
+        conn.execute("ALTER TABLE users ADD COLUMN teacher_id TEXT")
+    conn.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_teacher_id ON users (teacher_id)'
+    )
+
     # Assignments table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS assignments (
@@ -159,7 +642,7 @@ def init_database():
             FOREIGN KEY (student_id) REFERENCES users (student_id)
         )
     ''')
-    
+
     # Chat messages table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS chat_messages (
@@ -184,7 +667,7 @@ def init_database():
             FOREIGN KEY (student_id) REFERENCES users (student_id)
         )
     ''')
-    
+
     # Subject performance table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS subject_performance (
@@ -197,34 +680,143 @@ def init_database():
             FOREIGN KEY (student_id) REFERENCES users (student_id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+def _migration_hot_path_indexes(conn):
+    """v2: indexes matched to the per-student queries in the routes below"""
+    # get_assignments: WHERE student_id = ? ORDER BY due_date DESC
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_assignments_student_due ON assignments (student_id, due_date)'
+    )
+    # get_progress: GROUP BY status / GROUP BY subject with AVG(score)
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_assignments_student_status ON assignments (student_id, status)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_assignments_student_subject ON assignments (student_id, subject, score)'
+    )
+    # Chat history and AI context: WHERE student_id = ? ORDER BY timestamp
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_student_ts ON chat_messages (student_id, timestamp)'
+    )
+    # get_student_performance: covering index for SELECT subject, date, score ... ORDER BY date
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_subject_performance_student_date '
+        'ON subject_performance (student_id, date, subject, score)'
+    )
+
+def _migration_chat_keyset_index(conn):
+    """v3: chat reads page and order by id, so index (student_id, id) instead of timestamp"""
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_student_id ON chat_messages (student_id, id)'
+    )
+    conn.execute('DROP INDEX IF EXISTS idx_chat_messages_student_ts')
+
+def _migration_context_cache_handles(conn):
+    """v4: Gemini cached-content handles shared by every worker process"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gemini_cached_contents (
+            cache_key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_conversation_summaries(conn):
+    """v5: rolling per-student conversation summaries"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            student_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Schema migrations, applied in order; PRAGMA user_version records the last one run.
+# Append new steps here instead of editing old ones.
+MIGRATIONS = [
+    (1, _migration_base_tables),
+    (2, _migration_hot_path_indexes),
+    (3, _migration_chat_keyset_index),
+    (4, _migration_context_cache_handles),
+    (5, _migration_conversation_summaries),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def init_database():
+    """Bring the database schema up to SCHEMA_VERSION"""
+    conn = get_db_connection()
+    try:
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+        # Take the write lock, then re-check in case another worker migrated first
+        conn.execute('BEGIN IMMEDIATE')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target, migrate in MIGRATIONS:
+            if target > version:
+                migrate(conn)
+                conn.execute(f'PRAGMA user_version = {target}')
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+_subject_classifier = None
+_subject_classifier_lock = threading.Lock()
+
+def get_subject_classifier():
+    """Get the shared subject classifier; SUBJECT_VOCABULARY names a JSON file of extra terms/subjects"""
+    global _subject_classifier
+    if _subject_classifier is not None:
+        return _subject_classifier
+    with _subject_classifier_lock:
+        if _subject_classifier is None:
+            vocabulary_path = os.environ.get('SUBJECT_VOCABULARY')
+            extra = load_vocabulary(vocabulary_path) if vocabulary_path else None
+            _subject_classifier = SubjectClassifier(merge_vocabulary(DEFAULT_VOCABULARY, extra))
+        return _subject_classifier
 
 def detect_subject(message):
-    """Detect the subject based on keywords in the message"""
-    message_lower = message.lower()
-    
-    # Math keywords
-    math_keywords = ['math', 'algebra', 'geometry', 'calculus', 'equation', 'solve', 'calculate', 'formula', 'graph', 'derivative', 'integral', 'statistics', 'probability', 'triangle', 'circle', 'polynomial']
-    
-    # Science keywords
-    science_keywords = ['science', 'biology', 'chemistry', 'physics', 'molecule', 'atom', 'cell', 'experiment', 'hypothesis', 'chemical', 'force', 'energy', 'DNA', 'evolution', 'photosynthesis']
-    
-    # English keywords
-    english_keywords = ['english', 'literature', 'essay', 'grammar', 'writing', 'poem', 'story', 'character', 'theme', 'analysis', 'paragraph', 'sentence', 'novel', 'author']
-    
-    if any(keyword in message_lower for keyword in math_keywords):
-        return 'math'
-    elif any(keyword in message_lower for keyword in science_keywords):
-        return 'science'
-    elif any(keyword in message_lower for keyword in english_keywords):
-        return 'english'
-    else:
-        return 'general'
+    """Detect the subject from weighted keywords in the message ('general' if none stand out)"""
+    return get_subject_classifier().classify(message)
+
+def conversation_subject(message, conversation_history=None):
+    """Subject of a message; a follow-up with no subject terms ("why?") takes its conversation's"""
+    subject = detect_subject(message)
+    if subject == 'general' and conversation_history:
+        recent = [turn['message'] for turn in conversation_history[-4:] if turn['sender'] == 'user']
+        if recent:
+            subject = detect_subject(' '.join(recent))
+    return subject
+
+_system_prompts = None
+_system_prompts_lock = threading.Lock()
+
+def get_system_prompts():
+    """Get the precomputed system prompt variants; SYSTEM_PROMPT_MODULES=off sends the full prompt"""
+    global _system_prompts
+    with _system_prompts_lock:
+        if _system_prompts is None:
+            _system_prompts = SystemPromptLibrary(
+                modular=os.environ.get('SYSTEM_PROMPT_MODULES', 'on').lower() != 'off'
+            )
+        return _system_prompts
 
 def get_fallback_response(message):
-    """Get a fallback response when Gemini API is not available"""
+    """Get a fallback response when Gemini API is not available.
+
+    The closest past explanation from the retrieval index comes first;
+    without one, a canned answer for the message's subject.
+    """
+    retrieval = get_retrieval_fallback()
+    if retrieval is not None:
+        answer = retrieval.lookup(message)
+        if answer is not None:
+            return answer
     subject = detect_subject(message)
     responses = MOCK_RESPONSES.get(subject, MOCK_RESPONSES['general'])
     return random.choice(responses)
@@ -235,72 +827,874 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def process_image(image_file):
-    """Process uploaded image and convert to base64 for Gemini API"""
+    """Process uploaded image and convert to base64 for Gemini API.
+
+    The decode, resize and encode run on the image pool's worker
+    processes; raises ImagePoolSaturated when the pool is full or a worker
+    takes longer than IMAGE_MAX_SECONDS.
+    """
     try:
-        # Open and process the image
-        img = Image.open(image_file)
-        
-        # Convert to RGB if necessary (for PNG with transparency, etc.)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # Resize image if it's too large (max 1024x1024 for better API performance)
-        max_size = (1024, 1024)
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return img_base64
+        data = image_file.read()
+        img_base64, timings = get_image_pool().prepare(data)
+    except ImagePoolSaturated:
+        raise
     except Exception as e:
         print(f"Error processing image: {e}")
         return None
+    registry = get_metrics()
+    if registry is not None:
+        for name, seconds in timings.items():
+            registry.observe('tutorly_stage_seconds', seconds, stage=f'process_image.{name}')
+    return img_base64
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+def get_image_pool():
+    """Get the process-wide image processing pool; IMAGE_WORKERS=0 processes images inline"""
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            _image_pool = ImagePool(
+                workers=int(os.environ.get('IMAGE_WORKERS', min(4, os.cpu_count() or 1))),
+                max_queue=int(os.environ.get('IMAGE_QUEUE', 8)),
+                max_wait=float(os.environ.get('IMAGE_MAX_WAIT', 5)),
+                max_seconds=float(os.environ.get('IMAGE_MAX_SECONDS', 30))
+            )
+            atexit.register(_image_pool.shutdown)
+        return _image_pool
+
+_upstream_client = None
+_upstream_client_lock = threading.Lock()
+
+def get_upstream_client():
+    """Get the process-wide keep-alive client used for all Gemini calls.
+
+    GEMINI_REPLAY answers every call from a recording instead;
+    GEMINI_RECORD records the real calls to a file.
+    """
+    global _upstream_client
+    with _upstream_client_lock:
+        if _upstream_client is None:
+            replay_path = os.environ.get('GEMINI_REPLAY')
+            if replay_path:
+                _upstream_client = ReplayClient(replay_path,
+                                                speed=float(os.environ.get('GEMINI_REPLAY_SPEED', 1.0)))
+                return _upstream_client
+            _upstream_client = UpstreamClient(
+                pool_size=int(os.environ.get('GEMINI_POOL_SIZE', 10)),
+                keep_alive=os.environ.get('GEMINI_KEEP_ALIVE', 'True').lower() == 'true',
+                connect_timeout=float(os.environ.get('GEMINI_CONNECT_TIMEOUT', 5)),
+                read_timeout=float(os.environ.get('GEMINI_READ_TIMEOUT', 30))
+            )
+            record_path = os.environ.get('GEMINI_RECORD')
+            if record_path:
+                _upstream_client = RecordingClient(_upstream_client, TrafficRecorder(record_path))
+                atexit.register(_upstream_client.recorder.close)
+        return _upstream_client
+
+_llm_gateway = None
+
+def get_llm_gateway():
+    """Get the process-wide LLM gateway, or None if GEMINI_GATEWAY_CONCURRENCY is 0"""
+    global _llm_gateway
+    with _upstream_client_lock:
+        concurrency = int(os.environ.get('GEMINI_GATEWAY_CONCURRENCY', 8))
+        if _llm_gateway is None and concurrency > 0:
+            connect_timeout = float(os.environ.get('GEMINI_CONNECT_TIMEOUT', 5))
+            read_timeout = float(os.environ.get('GEMINI_READ_TIMEOUT', 30))
+            rpm = int(os.environ.get('GEMINI_QUOTA_RPM', 0))
+            tpm = int(os.environ.get('GEMINI_QUOTA_TPM', 0))
+            quota = None
+            if rpm or tpm:
+                quota = QuotaTracker(
+                    requests_per_minute=rpm,
+                    tokens_per_minute=tpm,
+                    background_share=float(os.environ.get('GEMINI_QUOTA_BACKGROUND_SHARE', 0.8))
+                )
+            background_concurrency = os.environ.get('GEMINI_GATEWAY_BACKGROUND_CONCURRENCY')
+            _llm_gateway = LLMGateway(
+                max_concurrency=concurrency,
+                max_queue=int(os.environ.get('GEMINI_GATEWAY_QUEUE', 16)),
+                max_wait=float(os.environ.get('GEMINI_GATEWAY_MAX_WAIT', connect_timeout + read_timeout)),
+                background_queue=int(os.environ.get('GEMINI_GATEWAY_BACKGROUND_QUEUE', 64)),
+                background_concurrency=int(background_concurrency) if background_concurrency else None,
+                quota=quota
+            )
+        return _llm_gateway
+
+_upstream_policy = None
+
+def get_upstream_policy():
+    """Get the process-wide circuit breaker / retry / hedging policy for Gemini calls"""
+    global _upstream_policy
+    with _upstream_client_lock:
+        if _upstream_policy is None:
+            _upstream_policy = UpstreamPolicy(
+                breaker=CircuitBreaker(
+                    failure_rate=float(os.environ.get('GEMINI_BREAKER_FAILURE_RATE', 0.5)),
+                    min_requests=int(os.environ.get('GEMINI_BREAKER_MIN_REQUESTS', 10)),
+                    window=float(os.environ.get('GEMINI_BREAKER_WINDOW', 30)),
+                    open_seconds=float(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', 15))
+                ),
+                budget=RetryBudget(ratio=float(os.environ.get('GEMINI_RETRY_BUDGET_RATIO', 0.1))),
+                max_attempts=int(os.environ.get('GEMINI_RETRY_MAX_ATTEMPTS', 3)),
+                hedge=os.environ.get('GEMINI_HEDGE', 'off').lower() == 'on',
+                hedge_min_delay=float(os.environ.get('GEMINI_HEDGE_MIN_DELAY_MS', 50)) / 1000.0
+            )
+        return _upstream_policy
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+def get_admission_controller():
+    """Get the AI endpoint admission controller, or None if RATE_LIMIT_BACKEND is 'off'"""
+    global _admission_controller
+    with _admission_controller_lock:
+        backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+        if _admission_controller is None and backend != 'off':
+            if backend == 'sqlite':
+                store = SQLiteRateLimitBackend(os.environ.get('RATE_LIMIT_PATH', 'tutorly_limits.db'))
+            else:
+                store = MemoryRateLimitBackend()
+            _admission_controller = AdmissionController(
+                store,
+                student_rate=float(os.environ.get('RATE_LIMIT_STUDENT_PER_MINUTE', 20)) / 60.0,
+                student_burst=float(os.environ.get('RATE_LIMIT_STUDENT_BURST', 5)),
+                global_rate=float(os.environ.get('RATE_LIMIT_GLOBAL_PER_SECOND', 20)),
+                global_burst=float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 40)),
+                max_concurrent=int(os.environ.get('AI_MAX_CONCURRENT', 16)),
+                max_queue=int(os.environ.get('AI_MAX_QUEUE', 32)),
+                max_queue_wait=float(os.environ.get('AI_MAX_QUEUE_MS', 2000)) / 1000.0
+            )
+        return _admission_controller
+
+def admit_ai_request(student_id):
+    """Run a student's AI request through admission control"""
+    controller = get_admission_controller()
+    return controller.admit(student_id) if controller else Admission()
+
+_single_flight = None
+
+def get_single_flight():
+    """Get the process-wide request coalescer, or None if SINGLE_FLIGHT is 'off'"""
+    global _single_flight
+    with _upstream_client_lock:
+        if os.environ.get('SINGLE_FLIGHT', 'on').lower() == 'off':
+            return None
+        if _single_flight is None:
+            # Long enough for the leader to queue on the gateway and then make its call
+            request_timeout = (float(os.environ.get('GEMINI_CONNECT_TIMEOUT', 5))
+                               + float(os.environ.get('GEMINI_READ_TIMEOUT', 30)))
+            gateway_wait = float(os.environ.get('GEMINI_GATEWAY_MAX_WAIT', request_timeout))
+            _single_flight = SingleFlight(
+                max_wait=float(os.environ.get('SINGLE_FLIGHT_MAX_WAIT', gateway_wait + request_timeout))
+            )
+        return _single_flight
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Get the process-wide tutoring response cache, or None if RESPONSE_CACHE_BACKEND is 'off'"""
+    global _response_cache
+    with _response_cache_lock:
+        backend = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory').lower()
+        if _response_cache is None and backend != 'off':
+            max_bytes = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+            ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+            if backend == 'sqlite':
+                store = SQLiteCacheBackend(os.environ.get('RESPONSE_CACHE_PATH', 'tutorly_cache.db'),
+                                           max_bytes=max_bytes, ttl=ttl)
+            else:
+                store = MemoryCacheBackend(max_bytes=max_bytes, ttl=ttl)
+            _response_cache = ResponseCache(
+                store,
+                history_turns=int(os.environ.get('RESPONSE_CACHE_HISTORY_TURNS', 0))
+            )
+        return _response_cache
+
+class SimilarAnswerIndex:
+    """Near-duplicate lookup of past AI answers, built from chat_messages.
+
+    Each indexed entry is a student question that was immediately followed
+    by the AI reply, keyed by the reply's message id. New pairs are picked
+    up incrementally (id > last indexed id) on a background thread at most
+    every `refresh_seconds`, so lookups never wait for indexing.
+    """
+
+    def __init__(self, database, capacity=100000, threshold=0.85, refresh_seconds=10):
+        self.database = database
+        self.threshold = threshold
+        self.refresh_seconds = refresh_seconds
+        self.index = MinHashLSH(capacity=capacity)
+        self._last_id = 0
+        self._last_refresh = 0.0
+        self._refreshing = threading.Lock()
+        self._skip_answers = {text for texts in MOCK_RESPONSES.values() for text in texts}
+        self.hits = 0
+        self.misses = 0
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_refresh < self.refresh_seconds:
+            return
+        if self._refreshing.acquire(blocking=False):
+            self._last_refresh = time.monotonic()
+            threading.Thread(target=self._refresh, name='similar-answers', daemon=True).start()
+
+    def _refresh(self, batch_size=5000):
+        try:
+            conn = get_db_connection()
+            try:
+                while True:
+                    rows = conn.execute(
+                        '''SELECT u.id, u.message AS question, a.id AS answer_id, a.message AS answer
+                           FROM chat_messages u
+                           JOIN chat_messages a
+                             ON a.id = u.id + 1 AND a.student_id = u.student_id AND a.sender = 'ai'
+                           WHERE u.sender = 'user' AND u.id > ?
+                           ORDER BY u.id LIMIT ?''',
+                        (self._last_id, batch_size)
+                    ).fetchall()
+                    for row in rows:
+                        question = row['question']
+                        if (row['answer'] in self._skip_answers or question.endswith('[Image uploaded]')
+                                or looks_like_follow_up(question)):
+                            continue
+                        self.index.add(row['answer_id'], question)
+                    if rows:
+                        self._last_id = rows[-1]['id']
+                    if len(rows) < batch_size:
+                        break
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Similar answer index refresh error: {e}")
+        finally:
+            self._refreshing.release()
+
+    def lookup(self, message):
+        """Return a past AI answer to a near-identical question, or None"""
+        self._maybe_refresh()
+        match = self.index.query(message, self.threshold)
+        answer = None
+        if match:
+            conn = get_db_connection()
+            row = conn.execute('SELECT message FROM chat_messages WHERE id = ?', (match[0],)).fetchone()
+            conn.close()
+            answer = row['message'] if row else None
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def stats(self):
+        return {'entries': len(self.index), 'capacity': self.index.capacity,
+                'threshold': self.threshold, 'hits': self.hits, 'misses': self.misses}
+
+_similar_answers = None
+_similar_answers_lock = threading.Lock()
+
+def get_similar_answer_index():
+    """Get the near-duplicate answer index, or None if SIMILAR_ANSWERS is 'off'"""
+    global _similar_answers
+    with _similar_answers_lock:
+        if os.environ.get('SIMILAR_ANSWERS', 'on').lower() == 'off':
+            return None
+        if _similar_answers is None or _similar_answers.database != DATABASE:
+            _similar_answers = SimilarAnswerIndex(
+                DATABASE,
+                capacity=int(os.environ.get('SIMILAR_ANSWER_CAPACITY', 100000)),
+                threshold=float(os.environ.get('SIMILAR_ANSWER_THRESHOLD', 0.85)),
+                refresh_seconds=float(os.environ.get('SIMILAR_ANSWER_REFRESH_SECONDS', 10))
+            )
+        return _similar_answers
+
+class RetrievalFallback:
+    """Offline tutor: BM25 search over past AI explanations in chat_messages.
+
+    Each document is a student question, counted twice so it outweighs the
+    reply, plus the AI reply that immediately followed it. Fallbacks, image
+    turns, follow-ups like "why?" and replies shorter than
+    `min_answer_chars` are left out. New pairs are indexed on a background
+    thread at most every `refresh_seconds`. Once `merge_every` are pending,
+    they are merged into the on-disk index (`path`), which every worker
+    process memory-maps at startup. A lookup only answers if the best
+    match scores at least `min_score` and covers `min_coverage` of the
+    question's IDF weight.
+    """
+
+    PREFIX = ("I can't reach my full tutoring service right now, but here is how I explained "
+              "a similar question before:\n\n")
+
+    def __init__(self, database, path, min_score=4.0, min_coverage=0.6, min_answer_chars=200,
+                 merge_every=1000, refresh_seconds=10):
+        self.database = database
+        self.path = path
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.min_answer_chars = min_answer_chars
+        self.merge_every = merge_every
+        self.refresh_seconds = refresh_seconds
+        self.index = BM25Index(path)
+        try:
+            self.index.load()
+        except (OSError, ValueError) as e:
+            print(f"Retrieval index unreadable, rebuilding: {e}")
+        self._last_refresh = 0.0
+        self._refreshing = threading.Lock()
+        self._skip_answers = {text for texts in MOCK_RESPONSES.values() for text in texts}
+        self.hits = 0
+        self.misses = 0
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_refresh < self.refresh_seconds:
+            return
+        if self._refreshing.acquire(blocking=False):
+            self._last_refresh = time.monotonic()
+            threading.Thread(target=self._refresh, name='retrieval-index', daemon=True).start()
+
+    def _refresh(self, batch_size=5000):
+        try:
+            if self.index.stale():
+                # Another worker merged a newer index; map it instead of re-reading its rows
+                self.index.load()
+            conn = get_db_connection()
+            try:
+                while True:
+                    rows = conn.execute(
+                        '''SELECT u.id, u.message AS question, a.id AS answer_id, a.message AS answer
+                           FROM chat_messages u
+                           JOIN chat_messages a
+                             ON a.id = u.id + 1 AND a.student_id = u.student_id AND a.sender = 'ai'
+                           WHERE u.sender = 'user' AND u.id > ?
+                           ORDER BY u.id LIMIT ?''',
+                        (self.index.last_id, batch_size)
+                    ).fetchall()
+                    for row in rows:
+                        question, answer = row['question'], row['answer']
+                        if (len(answer) < self.min_answer_chars or answer in self._skip_answers
+                                or answer.startswith(self.PREFIX) or question.endswith('[Image uploaded]')
+                                or looks_like_follow_up(question)):
+                            self.index.last_id = row['id']
+                            continue
+                        self.index.add(row['answer_id'], f"{question}\n{question}\n{answer}", last_id=row['id'])
+                    if len(rows) < batch_size:
+                        break
+            finally:
+                conn.close()
+            if self.index.pending >= self.merge_every or (self.index.pending and not os.path.exists(self.path)):
+                self.index.save()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Retrieval index refresh error: {e}")
+        finally:
+            self._refreshing.release()
+
+    def lookup(self, message):
+        """A past AI explanation relevant to the message, introduced as such, or None"""
+        self._maybe_refresh()
+        answer = None
+        for answer_id, score, coverage in self.index.search(message, limit=1, min_coverage=self.min_coverage):
+            if score >= self.min_score and coverage >= self.min_coverage:
+                conn = get_db_connection()
+                row = conn.execute('SELECT message FROM chat_messages WHERE id = ?', (answer_id,)).fetchone()
+                conn.close()
+                answer = self.PREFIX + row['message'] if row else None
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def stats(self):
+        return dict(self.index.stats(), min_score=self.min_score, min_coverage=self.min_coverage,
+                    hits=self.hits, misses=self.misses)
+
+_retrieval_fallback = None
+_retrieval_fallback_lock = threading.Lock()
+
+def get_retrieval_fallback():
+    """Get the BM25 retrieval fallback, or None if RETRIEVAL_FALLBACK is 'off'"""
+    global _retrieval_fallback
+    with _retrieval_fallback_lock:
+        if os.environ.get('RETRIEVAL_FALLBACK', 'on').lower() == 'off':
+            return None
+        if _retrieval_fallback is None or _retrieval_fallback.database != DATABASE:
+            _retrieval_fallback = RetrievalFallback(
+                DATABASE,
+                os.environ.get('RETRIEVAL_INDEX_PATH', f"{DATABASE}.bm25"),
+                min_score=float(os.environ.get('RETRIEVAL_MIN_SCORE', 4.0)),
+                min_coverage=float(os.environ.get('RETRIEVAL_MIN_COVERAGE', 0.6)),
+                merge_every=int(os.environ.get('RETRIEVAL_MERGE_EVERY', 1000)),
+                refresh_seconds=float(os.environ.get('RETRIEVAL_REFRESH_SECONDS', 10))
+            )
+        return _retrieval_fallback
+
+class SystemPromptCache:
+    """Server-side cached-content handles for the static system prompt.
+
+    The first request to need a handle creates it through the
+    cachedContents API and records it in the gemini_cached_contents table,
+    so every worker process reuses the same handle. Handles are refreshed
+    (their TTL extended) once less than `refresh_margin` seconds remain.
+    If caching is unavailable (the endpoint errors, or the prompt is below
+    the model's minimum cacheable size), handle() returns None for
+    `retry_after` seconds and callers send the prompt inline.
+    """
+
+    def __init__(self, ttl=3600, refresh_margin=300, retry_after=600):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self._memo = {}
+        # Per cache key: a model without context caching doesn't turn it off for the others
+        self._unavailable_until = {}
+        # Keys whose handle one request is loading, extending or creating right now
+        self._resolving = set()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.refreshed = 0
+        self.invalidated = 0
+        self.failures = 0
+
+    @staticmethod
+    def cache_key(model, system_prompt):
+        return hashlib.sha256(f"{model}\n{system_prompt}".encode('utf-8')).hexdigest()
+
+    def handle(self, client, api_root, api_key, model, system_prompt):
+        """Return a cachedContents name for the prompt, or None to send it inline.
+
+        Only one request per key loads, extends or creates a handle, and it
+        does so outside the lock. Meanwhile the others use the current
+        handle if it hasn't expired yet, and send the prompt inline if it has.
+        """
+        key = self.cache_key(model, system_prompt)
+        now = time.time()
+        memo = self._memo.get(key)
+        if memo and memo[1] - now > self.refresh_margin:
+            return memo[0]
+        if now < self._unavailable_until.get(key, 0.0):
+            return None
+
+        with self._lock:
+            if key in self._resolving:
+                return memo[0] if memo and memo[1] > now else None
+            self._resolving.add(key)
+        try:
+            return self._resolve(client, api_root, api_key, model, system_prompt, key)
+        finally:
+            with self._lock:
+                self._resolving.discard(key)
+
+    def _resolve(self, client, api_root, api_key, model, system_prompt, key):
+        """Load, extend or create the handle for a key; DB and network round trips, no lock held"""
+        now = time.time()
+        memo = self._memo.get(key) or self._load(key)
+        if memo and memo[1] - now > self.refresh_margin:
+            with self._lock:
+                self._memo[key] = memo
+            return memo[0]
+        if memo and memo[1] > now and self._extend(client, api_root, api_key, memo[0]):
+            memo = (memo[0], now + self.ttl)
+            with self._lock:
+                self.refreshed += 1
+        else:
+            memo = self._create(client, api_root, api_key, model, system_prompt)
+            with self._lock:
+                if memo is None:
+                    self.failures += 1
+                    self._unavailable_until[key] = now + self.retry_after
+                    return None
+                self.created += 1
+        self._store(key, memo)
+        with self._lock:
+            self._memo[key] = memo
+        return memo[0]
+
+    def invalidate(self, name):
+        """Forget a handle the upstream no longer accepts"""
+        with self._lock:
+            for key, memo in list(self._memo.items()):
+                if memo[0] == name:
+                    del self._memo[key]
+            self.invalidated += 1
+        conn = get_db_connection()
+        conn.execute('DELETE FROM gemini_cached_contents WHERE name = ?', (name,))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'handles': len(self._memo),
+                'created': self.created,
+                'refreshed': self.refreshed,
+                'invalidated': self.invalidated,
+                'failures': self.failures,
+                'resolving': len(self._resolving),
+                'unavailable': sum(until > time.time() for until in self._unavailable_until.values()),
+            }
+
+    def _load(self, key):
+        conn = get_db_connection()
+        row = conn.execute(
+            'SELECT name, expires_at FROM gemini_cached_contents WHERE cache_key = ?', (key,)
+        ).fetchone()
+        conn.close()
+        return (row['name'], row['expires_at']) if row else None
+
+    def _store(self, key, memo):
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO gemini_cached_contents (cache_key, name, expires_at) VALUES (?, ?, ?)',
+            (key, memo[0], memo[1])
+        )
+        conn.commit()
+        conn.close()
+
+    def _create(self, client, api_root, api_key, model, system_prompt):
+        try:
+            response = client.post(
+                f"{api_root}/cachedContents?key={api_key}",
+                headers={"Content-Type": "application/json"},
+                json={
+                    "model": model,
+                    "systemInstruction": {"parts": [{"text": system_prompt}]},
+                    "ttl": f"{int(self.ttl)}s"
+                }
+            )
+            if response.status_code == 200:
+                return (response.json()['name'], time.time() + self.ttl)
+            print(f"Gemini context cache unavailable: {response.status_code} - {response.text}")
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Gemini context cache error: {e}")
+        return None
+
+    def _extend(self, client, api_root, api_key, name):
+        try:
+            response = client.request(
+                'PATCH',
+                f"{api_root}/{name}?updateMask=ttl&key={api_key}",
+                headers={"Content-Type": "application/json"},
+                json={"ttl": f"{int(self.ttl)}s"}
+            )
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            print(f"Gemini context cache refresh error: {e}")
+            return False
+
+_system_prompt_cache = None
+_system_prompt_cache_lock = threading.Lock()
+
+def get_system_prompt_cache():
+    """Get the shared system prompt cache, or None if GEMINI_CONTEXT_CACHE is 'off'"""
+    global _system_prompt_cache
+    with _system_prompt_cache_lock:
+        if os.environ.get('GEMINI_CONTEXT_CACHE', 'on').lower() == 'off':
+            return None
+        if _system_prompt_cache is None:
+            _system_prompt_cache = SystemPromptCache(
+                ttl=int(os.environ.get('GEMINI_CONTEXT_CACHE_TTL', 3600)),
+                refresh_margin=int(os.environ.get('GEMINI_CONTEXT_CACHE_REFRESH_MARGIN', 300))
+            )
+        return _system_prompt_cache
+
+_context_builder = None
+_context_builder_lock = threading.Lock()
+
+def get_context_builder():
+    """Get the shared token-budget context builder, configured from the environment"""
+    global _context_builder
+    with _context_builder_lock:
+        if _context_builder is None:
+            _context_builder = ContextBuilder(
+                budget_tokens=int(os.environ.get('CONTEXT_BUDGET_TOKENS', 2000)),
+                max_message_tokens=int(os.environ.get('CONTEXT_MAX_MESSAGE_TOKENS', 400))
+            )
+        return _context_builder
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+def get_model_router():
+    """Get the shared model router, or None if MODEL_ROUTING is 'off'"""
+    global _model_router
+    with _model_router_lock:
+        if os.environ.get('MODEL_ROUTING', 'on').lower() == 'off':
+            return None
+        if _model_router is None:
+            # MODEL_ROUTES names a JSON routing table that overrides or extends the defaults
+            routes_path = os.environ.get('MODEL_ROUTES')
+            _model_router = ModelRouter(
+                detect_subject,
+                default_model=os.environ.get('GEMINI_MODEL', GeminiService.DEFAULT_MODEL),
+                fast_model=os.environ.get('GEMINI_FAST_MODEL', GeminiService.DEFAULT_FAST_MODEL),
+                routes=load_routes(routes_path) if routes_path else None,
+                metrics=get_metrics()
+            )
+        return _model_router
+
+_SUMMARIZER_STOP = object()
+
+class ConversationSummarizer:
+    """Keeps a compact running summary of each student's conversation.
+
+    save_chat_messages() counts new turns per student; after every
+    `every_turns` of them the student is queued for a background thread
+    that folds the new turns into the stored summary with one upstream
+    call. The newest `keep_turns` messages are left out so they're always
+    sent verbatim. At most `max_batch` unsummarized messages are read per
+    refresh; anything older than that is not summarized. Work happens off
+    the request path, and a failed refresh leaves the old summary in place.
+    """
+
+    def __init__(self, database, every_turns=10, keep_turns=6, max_summary_tokens=300,
+                 max_batch=100, max_students=10000):
+        self.database = database
+        self.every_turns = every_turns
+        self.keep_turns = keep_turns
+        self.max_summary_tokens = max_summary_tokens
+        self.max_batch = max_batch
+        self.max_students = max_students
+        self._counts = OrderedDict()
+        self._queued = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.summaries = 0
+        self.skipped = 0
+        self.failures = 0
+        self._thread = threading.Thread(target=self._run, name='conversation-summarizer', daemon=True)
+        self._thread.start()
+
+    def notify(self, student_id, turns):
+        """Record newly saved turns; queues a refresh every `every_turns` turns"""
+        with self._lock:
+            count = self._counts.pop(student_id, 0) + turns
+            if count < self.every_turns:
+                self._counts[student_id] = count
+                while len(self._counts) > self.max_students:
+                    self._counts.popitem(last=False)
+                return
+            if student_id in self._queued:
+                return
+            self._queued.add(student_id)
+        self._queue.put(student_id)
+
+    def summarize(self, student_id):
+        """Fold a student's unsummarized turns into their summary; returns True if updated"""
+        get_chat_writer().wait_for(student_id)
+        conn = get_db_connection()
+        row = conn.execute(
+            'SELECT summary, summarized_through FROM conversation_summaries WHERE student_id = ?',
+            (student_id,)
+        ).fetchone()
+        rows = conn.execute(
+            'SELECT id, sender, message FROM chat_messages WHERE student_id = ? AND id > ? '
+            'ORDER BY id DESC LIMIT ?',
+            (student_id, row['summarized_through'] if row else 0, self.max_batch + self.keep_turns)
+        ).fetchall()
+        conn.close()
+
+        turns = [dict(r) for r in reversed(rows)]
+        if self.keep_turns:
+            turns = turns[:-self.keep_turns]
+        if len(turns) < self.every_turns:
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        gemini = GeminiService(os.environ.get('GEMINI_API_KEY'), student_id=student_id)
+        summary = gemini.summarize(row['summary'] if row else None, turns, self.max_summary_tokens)
+        if summary is None:
+            with self._lock:
+                self.failures += 1
+            return False
+
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO conversation_summaries (student_id, summary, summarized_through, updated_at) '
+            'VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+            (student_id, summary, turns[-1]['id'])
+        )
+        conn.commit()
+        conn.close()
+        # The cached entry's summary and unsummarized count are now stale
+        cache = get_conversation_cache()
+        with cache.lock_for(student_id):
+            cache.invalidate(student_id)
+        with self._lock:
+            self.summaries += 1
+        return True
+
+    def flush(self):
+        """Block until every queued refresh has run"""
+        self._queue.join()
+
+    def stop(self):
+        self._queue.put(_SUMMARIZER_STOP)
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        while True:
+            student_id = self._queue.get()
+            if student_id is _SUMMARIZER_STOP:
+                self._queue.task_done()
+                return
+            with self._lock:
+                self._queued.discard(student_id)
+            try:
+                self.summarize(student_id)
+            except Exception as e:
+                print(f"Conversation summarizer error: {e}")
+                with self._lock:
+                    self.failures += 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {'every_turns': self.every_turns, 'keep_turns': self.keep_turns,
+                    'queued': self._queue.qsize(), 'summaries': self.summaries,
+                    'skipped': self.skipped, 'failures': self.failures}
+
+_conversation_summarizer = None
+_conversation_summarizer_lock = threading.Lock()
+
+def get_conversation_summarizer():
+    """Get the background summarizer, or None if CONVERSATION_SUMMARIES is 'off'"""
+    global _conversation_summarizer
+    with _conversation_summarizer_lock:
+        if os.environ.get('CONVERSATION_SUMMARIES', 'on').lower() == 'off':
+            return None
+        if _conversation_summarizer is None or _conversation_summarizer.database != DATABASE:
+            if _conversation_summarizer is not None:
+                _conversation_summarizer.stop()
+            _conversation_summarizer = ConversationSummarizer(
+                DATABASE,
+                every_turns=int(os.environ.get('SUMMARY_EVERY_TURNS', 10)),
+                keep_turns=int(os.environ.get('SUMMARY_KEEP_TURNS', 6)),
+                max_summary_tokens=int(os.environ.get('SUMMARY_MAX_TOKENS', 300))
+            )
+        return _conversation_summarizer
+
+@atexit.register
+def _stop_conversation_summarizer():
+    if _conversation_summarizer is not None:
+        _conversation_summarizer.stop()
 
 # Gemini AI Service
 class GeminiService:
-    def __init__(self, api_key):
+    GENERATION_CONFIG = {
+        "temperature": 0.7,
+        "topK": 40,
+        "topP": 0.95,
+        "maxOutputTokens": 2048,
+        "stopSequences": ["Student:", "Tutorly:"]
+    }
+    # Typical reply length, used to estimate a call's share of the tokens/min quota
+    EXPECTED_OUTPUT_TOKENS = 400
+    DEFAULT_API_ROOT = "https://generativelanguage.googleapis.com/v1beta"
+    DEFAULT_MODEL = "gemini-2.0-flash-exp"
+    # Served on the `quick` route: short look-up questions with a small output budget
+    DEFAULT_FAST_MODEL = "gemini-2.0-flash-lite"
+
+    def __init__(self, api_key, client=None, gateway=None, cache=None, similar_answers=None,
+                 prompt_cache=None, context_builder=None, policy=None, single_flight=None,
+                 router=None, prompts=None, student_id=None):
         self.api_key = api_key
-        # Updated to use Gemini 2.5 Flash
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent"
-    
-    def generate_response(self, message, conversation_history=None):
-        """Generate AI response using Gemini 2.5 Flash API"""
-        if not self.api_key:
-            return get_fallback_response(message)
-        
-        # Build context with system prompt and conversation history
-        context_parts = [TUTORLY_SYSTEM_PROMPT]
-        
-        if conversation_history:
-            context_parts.append("\n\n## Previous Conversation:")
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                role = "Student" if msg['sender'] == 'user' else "Tutorly"
-                context_parts.append(f"{role}: {msg['message']}")
-        
-        context_parts.append(f"\n\nStudent: {message}")
-        context_parts.append("\nTutorly:")
-        
-        full_context = "\n".join(context_parts)
+        self.student_id = student_id
+        self.client = client or get_upstream_client()
+        self.policy = policy or get_upstream_policy()
+        self.single_flight = single_flight or get_single_flight()
+        self.gateway = gateway or get_llm_gateway()
+        self.cache = cache or get_response_cache()
+        self.similar_answers = similar_answers or get_similar_answer_index()
+        self.prompt_cache = prompt_cache or get_system_prompt_cache()
+        self.context_builder = context_builder or get_context_builder()
+        self.router = router or get_model_router()
+        self.prompts = prompts or get_system_prompts()
+        self.route = None
+        self.last_context = None
+        self.generation_config = dict(self.GENERATION_CONFIG)
+        self.system_prompt = TUTORLY_SYSTEM_PROMPT
+        # GEMINI_BASE_URL points every call at another API root, e.g. mock_gemini.py
+        api_root = os.environ.get('GEMINI_BASE_URL', self.DEFAULT_API_ROOT).rstrip('/')
+        model = os.environ.get('GEMINI_MODEL', self.DEFAULT_MODEL)
+        self.base_url = f"{api_root}/models/{model}:generateContent"
+
+    @property
+    def stream_url(self):
+        """Server-Sent Events variant of the generateContent endpoint"""
+        return self.base_url.replace(':generateContent', ':streamGenerateContent')
+
+    @property
+    def api_root(self):
+        """API version root, e.g. https://.../v1beta"""
+        return self.base_url.split('/models/', 1)[0]
+
+    @property
+    def model(self):
+        """Model resource name, e.g. models/gemini-2.0-flash-exp"""
+        return 'models/' + self.base_url.split('/models/', 1)[1].split(':', 1)[0]
+
+    def _prepare(self, message, conversation_history=None, image=False):
+        """Pick the system prompt, model and generation config for this message"""
+        subject = conversation_subject(message, conversation_history)
+        self.system_prompt = self.prompts.prompt_for(subject)
+        self._apply_route(message, conversation_history, image, subject)
+
+    def _apply_route(self, message, conversation_history=None, image=False, subject=None):
+        """Pick the model and generation config for this message (no-op when routing is off)"""
+        if self.router is None:
+            return
+        self.route = self.router.route(message, conversation_history, image=image, subject=subject)
+        self.generation_config = dict(self.GENERATION_CONFIG, **self.route.generation_config)
+        self.base_url = f"{self.api_root}/models/{self.route.model}:generateContent"
+
+    def _record_route(self, started, usage=None, finish_reason=None, text=''):
+        """Count a finished upstream call against the current route"""
+        if self.route is None:
+            return
+        usage = usage or {}
+        prompt_tokens = self.last_context.prompt_tokens if self.last_context else 0
+        self.router.record(self.route, time.perf_counter() - started,
+                           prompt_tokens=usage.get('promptTokenCount', prompt_tokens),
+                           output_tokens=usage.get('candidatesTokenCount', estimate_tokens(text)),
+                           capped=finish_reason == 'MAX_TOKENS')
+
+    def _build_payload(self, message, conversation_history=None, image_base64=None, summary=None):
+        """Build the generateContent request body shared by every call path"""
+        # The system prompt travels in systemInstruction; contents carry the conversation
+        with stage('gemini.prompt_build'):
+            context = self.context_builder.build(message, conversation_history, image=bool(image_base64),
+                                                 summary=summary)
+        self.last_context = context
+        full_context = context.text
+        # Counted here, not when the prompt is picked: cache hits and coalesced requests send nothing
+        self.prompts.record(self.system_prompt)
+
+        parts = [{"text": full_context}]
+        if image_base64:
+            parts.append({
+                "inline_data": {
+                    "mime_type": "image/jpeg",
+                    "data": image_base64
+                }
+            })
         
-        payload = {
+        return {
+            "systemInstruction": {
+                "parts": [{"text": self.system_prompt}]
+            },
             "contents": [
                 {
-                    "parts": [
-                        {
-                            "text": full_context
-                        }
-                    ]
+                    "role": "user",
+                    "parts": parts
                 }
             ],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048,
-                "stopSequences": ["Student:", "Tutorly:"]
-            },
+            "generationConfig": self.generation_config,
             "safetySettings": [
                 {
                     "category": "HARM_CATEGORY_HARASSMENT",
@@ -320,113 +1714,272 @@ class GeminiService:
                 }
             ]
         }
+    
+    def _post(self, url, payload, cache_prompt=True, **kwargs):
+        """POST to Gemini, referencing the cached system prompt when a handle is available.
+
+        If the upstream rejects the handle (expired or deleted), it is
+        invalidated and the request is retried once with the prompt inline.
+        Pass cache_prompt=False for payloads with a different system prompt.
+        """
+        handle = None
+        if cache_prompt and self.prompt_cache is not None:
+            handle = self.prompt_cache.handle(self.client, self.api_root, self.api_key,
+                                              self.model, self.system_prompt)
+        if handle:
+            cached_payload = {k: v for k, v in payload.items() if k != 'systemInstruction'}
+            cached_payload['cachedContent'] = handle
+            response = self._send(url, cached_payload, **kwargs)
+            if response.status_code not in (400, 403, 404):
+                return response
+            response.close()
+            self.prompt_cache.invalidate(handle)
+        return self._send(url, payload, **kwargs)
+
+    def _send(self, url, body, **kwargs):
+        """One upstream POST through the circuit breaker, retry budget and hedging"""
+        def send():
+            return self.client.post(url, headers={"Content-Type": "application/json"}, json=body, **kwargs)
+        # For a stream, this is the time until the reply headers arrive
+        with stage('gemini.upstream'):
+            if self.policy is None:
+                return send()
+            # A streamed reply can't be raced against a second copy
+            return self.policy.call(send, hedge=not kwargs.get('stream'))
+
+    def _cache_key(self, message, conversation_history):
+        if self.cache is None:
+            return None
+        return self.cache.key_for(message, conversation_history, self.generation_config)
+
+    def _quota_cost(self, message, conversation_history=None, summary=None, image=False):
+        """Estimated tokens a call will use, for the gateway's tokens/min quota"""
+        context = estimate_tokens(message) + estimate_tokens(summary)
+        context += sum(estimate_tokens(turn['message']) for turn in conversation_history or [])
+        output = min(self.EXPECTED_OUTPUT_TOKENS, self.generation_config.get('maxOutputTokens') or 0)
+        return (estimate_tokens(self.system_prompt) + min(context, self.context_builder.budget_tokens)
+                + (IMAGE_TOKENS if image else 0) + output)
+
+    def _flight_key(self, message, conversation_history, summary, cache_key):
+        """Key under which identical concurrent requests share one upstream call, or None.
+
+        A cacheable request uses its cache key, since the cache shares that
+        answer anyway. Otherwise only requests that would send the same
+        prompt are coalesced: the same message, conversation history,
+        summary and system prompt variant.
+        """
+        if self.single_flight is None:
+            return None
+        if cache_key:
+            return cache_key
+        if is_context_dependent(message, conversation_history):
+            return None
+        return make_cache_key(message, conversation_history, self.generation_config,
+                              summary=summary, system_prompt=self.system_prompt)
+
+    def _cached_answer(self, message, conversation_history, cache_key):
+        """Exact cache first, then a past answer to a near-identical question"""
+        if cache_key:
+            with stage('gemini.cache_lookup'):
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        if self.similar_answers and not is_context_dependent(message, conversation_history):
+            with stage('gemini.similar_lookup'):
+                answer = self.similar_answers.lookup(message)
+            if answer is not None:
+                if cache_key:
+                    self.cache.set(cache_key, answer)
+                return answer
+        return None
+
+    def generate_response(self, message, conversation_history=None, summary=None):
+        """Generate AI response using Gemini 2.5 Flash API"""
+        if not self.api_key:
+            return get_fallback_response(message)
+
+        self._prepare(message, conversation_history)
+        cache_key = self._cache_key(message, conversation_history)
+        cached = self._cached_answer(message, conversation_history, cache_key)
+        if cached is not None:
+            return cached
+
+        def call_upstream():
+            if self.gateway is None:
+                return self._generate_response(message, conversation_history, summary)
+            return self.gateway.call(self._generate_response, message, conversation_history, summary,
+                                     fallback=lambda: None, flow=self.student_id,
+                                     cost=self._quota_cost(message, conversation_history, summary))
+
+        flight_key = self._flight_key(message, conversation_history, summary, cache_key)
+        if flight_key:
+            text = self.single_flight.do(flight_key, call_upstream, fallback=lambda: None)
+        else:
+            text = call_upstream()
+        if text is None:
+            return get_fallback_response(message)
+        if cache_key:
+            self.cache.set(cache_key, text)
+        return text
+
+    def _generate_response(self, message, conversation_history=None, summary=None):
+        """Blocking upstream call; runs on the LLM gateway. Returns None on failure."""
+        payload = self._build_payload(message, conversation_history, summary=summary)
         
         try:
-            response = requests.post(
-                f"{self.base_url}?key={self.api_key}",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=30
-            )
+            started = time.perf_counter()
+            response = self._post(f"{self.base_url}?key={self.api_key}", payload)
             
             if response.status_code == 200:
                 data = response.json()
                 if 'candidates' in data and len(data['candidates']) > 0:
-                    return data['candidates'][0]['content']['parts'][0]['text'].strip()
+                    text = data['candidates'][0]['content']['parts'][0]['text'].strip()
+                    self._record_route(started, data.get('usageMetadata'),
+                                       data['candidates'][0].get('finishReason'), text)
+                    return text
                 else:
-                    return get_fallback_response(message)
+                    return None
             else:
                 print(f"Gemini API Error: {response.status_code} - {response.text}")
-                return get_fallback_response(message)
+                return None
                 
         except requests.exceptions.Timeout:
             print("Gemini API timeout")
-            return get_fallback_response(message)
+            return None
         except requests.exceptions.RequestException as e:
             print(f"Gemini API network error: {e}")
-            return get_fallback_response(message)
+            return None
         except (KeyError, IndexError) as e:
             print(f"Gemini API response parsing error: {e}")
-            return get_fallback_response(message)
+            return None
         except Exception as e:
             print(f"Gemini API unexpected error: {e}")
-            return get_fallback_response(message)
+            return None
+
+    def stream_response(self, message, conversation_history=None, summary=None):
+        """Yield AI response text chunks as Gemini generates them.
+
+        Uses the streamGenerateContent endpoint with alt=sse. A cached reply
+        is yielded as a single chunk. If the call fails before any text has
+        arrived, the fallback response is yielded as a single chunk instead.
+        If it breaks off after text has been yielded, StreamTruncated is
+        raised and nothing is cached.
+        """
+        if not self.api_key:
+            yield get_fallback_response(message)
+            return
+
+        self._prepare(message, conversation_history)
+        cache_key = self._cache_key(message, conversation_history)
+        cached = self._cached_answer(message, conversation_history, cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        def stream_upstream():
+            if self.gateway is None:
+                return self._stream_response(message, conversation_history, summary)
+            return self.gateway.stream(self._stream_response, message, conversation_history, summary,
+                                       flow=self.student_id,
+                                       cost=self._quota_cost(message, conversation_history, summary))
+
+        flight_key = self._flight_key(message, conversation_history, summary, cache_key)
+        if flight_key:
+            chunks = self.single_flight.stream('stream:' + flight_key, stream_upstream)
+        else:
+            chunks = stream_upstream()
+        produced, finish_reason = [], None
+        for chunk in chunks:
+            if isinstance(chunk, StreamFinished):
+                finish_reason = chunk.reason
+                continue
+            produced.append(chunk)
+            yield chunk
 
-    def generate_response_with_image(self, message, image_base64, conversation_history=None):
+        if not produced:
+            yield get_fallback_response(message)
+        elif cache_key and finish_reason == 'STOP':
+            # Only a reply Gemini finished on its own; not one cut off by maxOutputTokens
+            self.cache.set(cache_key, ''.join(produced).strip())
+
+    def _stream_response(self, message, conversation_history=None, summary=None):
+        """Streaming upstream call; runs on the LLM gateway.
+
+        Yields text chunks, then one StreamFinished with Gemini's
+        finishReason. Yields nothing if the call fails before any text
+        arrives, and raises StreamTruncated if it fails after some has.
+        """
+        payload = self._build_payload(message, conversation_history, summary=summary)
+        produced = []
+        try:
+            started = time.perf_counter()
+            response = self._post(f"{self.stream_url}?alt=sse&key={self.api_key}", payload, stream=True)
+            with response:
+                if response.status_code != 200:
+                    print(f"Gemini API Error: {response.status_code} - {response.text}")
+                    return
+                usage, finish_reason = None, None
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = json.loads(line[5:].strip())
+                    usage = data.get('usageMetadata', usage)
+                    for candidate in data.get('candidates', [])[:1]:
+                        finish_reason = candidate.get('finishReason', finish_reason)
+                        for part in candidate.get('content', {}).get('parts', []):
+                            if part.get('text'):
+                                produced.append(part['text'])
+                                yield part['text']
+                self._record_route(started, usage, finish_reason, ''.join(produced))
+        except requests.exceptions.Timeout as e:
+            print("Gemini API timeout")
+            error = e
+        except requests.exceptions.RequestException as e:
+            print(f"Gemini API network error: {e}")
+            error = e
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"Gemini API response parsing error: {e}")
+            error = e
+        else:
+            if produced and finish_reason is None:
+                raise StreamTruncated("stream ended without a finishReason")
+            if produced:
+                yield StreamFinished(finish_reason)
+            return
+        if produced:
+            raise StreamTruncated(str(error)) from error
+
+    def generate_response_with_image(self, message, image_base64, conversation_history=None,
+                                    summary=None):
         """Generate AI response using Gemini 2.5 Flash API with image input"""
         if not self.api_key:
             return get_fallback_response(message)
-        
-        # Build context with system prompt and conversation history
-        context_parts = [TUTORLY_SYSTEM_PROMPT]
-        
-        if conversation_history:
-            context_parts.append("\n\n## Previous Conversation:")
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                role = "Student" if msg['sender'] == 'user' else "Tutorly"
-                context_parts.append(f"{role}: {msg['message']}")
-        
-        context_parts.append(f"\n\nStudent: {message}")
-        context_parts.append("\nTutorly:")
-        
-        full_context = "\n".join(context_parts)
-        
+        self._prepare(message, conversation_history, image=True)
+        if self.gateway is None:
+            return self._generate_response_with_image(message, image_base64, conversation_history, summary)
+        return self.gateway.call(
+            self._generate_response_with_image, message, image_base64, conversation_history, summary,
+            flow=self.student_id, cost=self._quota_cost(message, conversation_history, summary, image=True),
+            fallback=lambda: "I can see your image, but the response is taking too long. Could you try again or describe the problem in text?"
+        )
+
+    def _generate_response_with_image(self, message, image_base64, conversation_history=None,
+                                     summary=None):
+        """Blocking upstream call with image input; runs on the LLM gateway"""
         # Payload with both text and image
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": full_context
-                        },
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_base64
-                            }
-                        }
-                    ]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 2048,
-                "stopSequences": ["Student:", "Tutorly:"]
-            },
-            "safetySettings": [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
-        }
+        payload = self._build_payload(message, conversation_history, image_base64, summary)
         
         try:
-            response = requests.post(
-                f"{self.base_url}?key={self.api_key}",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=30
-            )
+            started = time.perf_counter()
+            response = self._post(f"{self.base_url}?key={self.api_key}", payload)
             
             if response.status_code == 200:
                 data = response.json()
                 if 'candidates' in data and len(data['candidates']) > 0:
-                    return data['candidates'][0]['content']['parts'][0]['text'].strip()
+                    text = data['candidates'][0]['content']['parts'][0]['text'].strip()
+                    self._record_route(started, data.get('usageMetadata'),
+                                       data['candidates'][0].get('finishReason'), text)
+                    return text
                 else:
                     return "I can see your image! However, I'm having trouble analyzing it right now. Could you describe what you'd like help with?"
             else:
@@ -446,6 +1999,48 @@ class GeminiService:
             print(f"Gemini API unexpected error: {e}")
             return "I can see your image, but something unexpected happened. Could you try again or describe the problem in text?"
 
+    def summarize(self, previous_summary, turns, max_tokens=300):
+        """Fold chat turns into a running conversation summary; returns None on failure.
+
+        Runs as background work on the LLM gateway, behind every waiting
+        interactive request. It may wait up to a few minutes for a slot.
+        """
+        if not self.api_key:
+            return None
+        if self.gateway is None:
+            return self._summarize(previous_summary, turns, max_tokens)
+        cost = (sum(estimate_tokens(turn['message']) for turn in turns) + estimate_tokens(previous_summary)
+                + max_tokens)
+        return self.gateway.call(self._summarize, previous_summary, turns, max_tokens,
+                                 fallback=lambda: None, priority=BACKGROUND, flow=self.student_id,
+                                 cost=cost, max_wait=300)
+
+    def _summarize(self, previous_summary, turns, max_tokens):
+        lines = ["## Current Summary:", previous_summary or "(none yet)", "", "## New Turns:"]
+        for turn in turns:
+            role = "Student" if turn['sender'] == 'user' else "Tutorly"
+            text = truncate_to_tokens(turn['message'], self.context_builder.max_message_tokens)
+            lines.append(f"{role}: {text}")
+        payload = {
+            "systemInstruction": {
+                "parts": [{"text": SUMMARY_SYSTEM_PROMPT.format(max_words=max_tokens * 3 // 4)}]
+            },
+            "contents": [{"role": "user", "parts": [{"text": "\n".join(lines)}]}],
+            "generationConfig": {"temperature": 0.2, "maxOutputTokens": max_tokens}
+        }
+        try:
+            response = self._post(f"{self.base_url}?key={self.api_key}", payload, cache_prompt=False)
+            if response.status_code != 200:
+                print(f"Gemini summary error: {response.status_code} - {response.text}")
+                return None
+            text = response.json()['candidates'][0]['content']['parts'][0]['text'].strip()
+            return text or None
+        except requests.exceptions.RequestException as e:
+            print(f"Gemini summary network error: {e}")
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"Gemini summary parsing error: {e}")
+        return None
+
 # Authentication Routes
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -475,9 +2070,6 @@ def login():
     else:
         # Create new user
         conn.execute(
-
-            'INSERT INTO users (student_id, name) VALUES (?, ?)',
-            (student_id, name),
             'INSERT INTO users (student_id, name, role) VALUES (?, ?, ?)',
             (student_id, name, 'student')
         )
@@ -692,21 +2284,58 @@ def delete_assignment(assignment_id):
         return jsonify({'error': 'Assignment not found'}), 404
 
 # Chat Routes
+CHAT_PAGE_DEFAULT = 50
+CHAT_PAGE_MAX = 200
+
 @app.route('/api/chat/<student_id>', methods=['GET'])
 def get_chat_history(student_id):
-    """Get chat history for a student"""
+    """Get one page of chat history for a student, oldest first.
+
+    Pages are keyset-paginated on the message id: pass `before=<id>` for
+    older messages or `after=<id>` for newer ones. With neither, the most
+    recent `limit` messages are returned. The X-Chat-Has-More header says
+    whether more messages exist in the requested direction.
+    """
+    try:
+        before = int(request.args['before']) if 'before' in request.args else None
+        after = int(request.args['after']) if 'after' in request.args else None
+        limit = int(request.args.get('limit', CHAT_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({'error': 'before, after and limit must be integers'}), 400
+    if before is not None and after is not None:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
+    limit = max(1, min(limit, CHAT_PAGE_MAX))
+
+    get_chat_writer().wait_for(student_id)
     conn = get_db_connection()
-    messages = conn.execute(
-        'SELECT * FROM chat_messages WHERE student_id = ? ORDER BY timestamp ASC',
-        (student_id,)
-    ).fetchall()
+    if after is not None:
+        messages = conn.execute(
+            '''SELECT id, sender, message, timestamp FROM chat_messages
+               WHERE student_id = ? AND id > ? ORDER BY id ASC LIMIT ?''',
+            (student_id, after, limit + 1)
+        ).fetchall()
+    else:
+        # Tail-first: walk the (student_id, id) index backwards, then flip
+        messages = conn.execute(
+            '''SELECT id, sender, message, timestamp FROM chat_messages
+               WHERE student_id = ? AND id < ? ORDER BY id DESC LIMIT ?''',
+            (student_id, before if before is not None else sys.maxsize, limit + 1)
+        ).fetchall()
     conn.close()
-    
-    return jsonify([{
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+
+    response = jsonify([{
+        'id': msg['id'],
         'sender': msg['sender'],
         'text': msg['message'],
         'timestamp': msg['timestamp']
     } for msg in messages])
+    response.headers['X-Chat-Has-More'] = 'true' if has_more else 'false'
+    return response
 
 @app.route('/api/chat/<student_id>', methods=['POST'])
 def save_chat_message(student_id):
@@ -716,13 +2345,7 @@ def save_chat_message(student_id):
     if 'sender' not in data or 'text' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
     
-    conn = get_db_connection()
-    conn.execute(
-        'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
-        (student_id, data['sender'], data['text'])
-    )
-    conn.commit()
-    conn.close()
+    save_chat_messages(student_id, [(data['sender'], data['text'])])
     
     return jsonify({
         'sender': data['sender'],
@@ -741,42 +2364,139 @@ def chat_with_ai(student_id):
     
     if not message:
         return jsonify({'error': 'Message is required'}), 400
-    
-    # Get conversation history for context
-    conn = get_db_connection()
-    history = conn.execute(
-        'SELECT sender, message FROM chat_messages WHERE student_id = ? ORDER BY timestamp DESC LIMIT 10',
-        (student_id,)
-    ).fetchall()
-    conn.close()
-    
-    # Generate AI response
-    gemini = GeminiService(api_key)
-    ai_response = gemini.generate_response(message, [dict(h) for h in history])
-    
-    # Save both user message and AI response
-    conn = get_db_connection()
-    
-    # Save user message
-    conn.execute(
-        'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
-        (student_id, 'user', message)
-    )
-    
-    # Save AI response
-    conn.execute(
-        'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
-        (student_id, 'ai', ai_response)
-    )
-    
-    conn.commit()
-    conn.close()
+
+    with stage('chat.admission'):
+        admission = admit_ai_request(student_id)
+    if admission.shed:
+        return _shed_response(admission, message)
+
+    with admission:
+        # Get the conversation summary and recent history for context (oldest first)
+        with stage('chat.history'):
+            summary, history = get_conversation_context(student_id)
+
+        # Generate AI response
+        with stage('chat.generate'):
+            gemini = GeminiService(api_key, student_id=student_id)
+            ai_response = gemini.generate_response(message, history, summary)
+
+        # Save both user message and AI response through the batched writer
+        with stage('chat.save'):
+            save_chat_messages(student_id, [
+                ('user', message),
+                ('ai', ai_response)
+            ])
     
     return jsonify({
         'response': ai_response,
+        'promptTokens': gemini.last_context.prompt_tokens if gemini.last_context else None,
         'timestamp': datetime.now().isoformat()
     })
 
+def _sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _shed_response(admission, message):
+    """Immediate subject fallback for a request shed by admission control; nothing is saved"""
+    response = jsonify({
+        'response': get_fallback_response(message),
+        'shed': admission.shed,
+        'timestamp': datetime.now().isoformat()
+    })
+    if admission.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(admission.retry_after))
+    return response
+
+# Streaming Gemini AI Chat Route
+@app.route('/api/chat/<student_id>/ai/stream', methods=['POST'])
+def chat_with_ai_stream(student_id):
+    """Stream the AI response from Gemini as Server-Sent Events.
+
+    Emits `chunk` events ({text}) as tokens arrive, then one `done` event
+    with the full response and the measured time-to-first-token. Both
+    messages are saved once the stream has completed. If the reply breaks
+    off, an `error` event replaces `done` and only the student's message
+    is saved, as it is when the client disconnects.
+    """
+    data = request.get_json()
+    message = data.get('message')
+    # Load API key from environment (configured via .env)
+    api_key = os.environ.get('GEMINI_API_KEY')
+    
+    if not message:
+        return jsonify({'error': 'Message is required'}), 400
+
+    started = time.perf_counter()
+    with stage('stream.admission'):
+        admission = admit_ai_request(student_id)
+    if admission.shed:
+        fallback = get_fallback_response(message)
+        body = _sse_event('chunk', {'text': fallback}) + _sse_event('done', {
+            'response': fallback,
+            'shed': admission.shed,
+            'timestamp': datetime.now().isoformat()
+        })
+        return Response(body, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    try:
+        with stage('stream.history'):
+            summary, history = get_conversation_context(student_id)
+        gemini = GeminiService(api_key, student_id=student_id)
+    except BaseException:
+        # No response will be built to release the slot on close
+        admission.release()
+        raise
+
+    def generate():
+        chunks = []
+        first_token_ms = None
+        completed = False
+        try:
+            with stage('stream.generate'):
+                generating = time.perf_counter()
+                for chunk in gemini.stream_response(message, history, summary):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        registry = get_metrics()
+                        if registry is not None:
+                            registry.observe('tutorly_stage_seconds', time.perf_counter() - generating,
+                                             stage='stream.first_token')
+                    chunks.append(chunk)
+                    yield _sse_event('chunk', {'text': chunk})
+            completed = True
+        except StreamTruncated as e:
+            print(f"Gemini stream truncated: {e}")
+        finally:
+            # Also runs when the client disconnects mid-stream, so the student's turn is kept;
+            # a reply that didn't complete is never saved
+            ai_response = ''.join(chunks).strip()
+            with stage('stream.save'):
+                save_chat_messages(student_id, [('user', message), ('ai', ai_response)] if completed
+                                   else [('user', message)])
+
+        if not completed:
+            yield _sse_event('error', {
+                'error': 'The response was interrupted. Please try again.',
+                'timestamp': datetime.now().isoformat()
+            })
+            return
+        yield _sse_event('done', {
+            'response': ai_response,
+            'ttftMs': round(first_token_ms, 1),
+            'totalMs': round((time.perf_counter() - started) * 1000, 1),
+            'promptTokens': gemini.last_context.prompt_tokens if gemini.last_context else None,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # The admission slot is held until the stream has been sent (or abandoned)
+    response.call_on_close(admission.release)
+    return response
+
 # Image Upload and Chat Route
 @app.route('/api/chat/<student_id>/ai/image', methods=['POST'])
 def chat_with_ai_image(student_id):
@@ -796,44 +2516,41 @@ def chat_with_ai_image(student_id):
     if not allowed_file(image_file.filename):
         return jsonify({'error': 'Invalid file type. Please upload an image file (PNG, JPG, JPEG, GIF, BMP, WEBP)'}), 400
     
-    # Process the image
-    image_base64 = process_image(image_file)
-    if not image_base64:
-        return jsonify({'error': 'Failed to process image'}), 400
-    
-    # Get conversation history for context
-    conn = get_db_connection()
-    history = conn.execute(
-        'SELECT sender, message FROM chat_messages WHERE student_id = ? ORDER BY timestamp DESC LIMIT 10',
-        (student_id,)
-    ).fetchall()
-    conn.close()
-    
-    # Generate AI response with image
-    gemini = GeminiService(api_key)
-    ai_response = gemini.generate_response_with_image(message, image_base64, [dict(h) for h in history])
-    
-    # Save both user message and AI response
-    conn = get_db_connection()
-    
-    # Save user message (with indication that it included an image)
-    user_message_text = f"{message} [Image uploaded]"
-    conn.execute(
-        'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
-        (student_id, 'user', user_message_text)
-    )
-    
-    # Save AI response
-    conn.execute(
-        'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
-        (student_id, 'ai', ai_response)
-    )
-    
-    conn.commit()
-    conn.close()
+    with stage('image.admission'):
+        admission = admit_ai_request(student_id)
+    if admission.shed:
+        return _shed_response(admission, message)
+
+    with admission:
+        # Process the image
+        with stage('image.process'):
+            try:
+                image_base64 = process_image(image_file)
+            except ImagePoolSaturated:
+                return _shed_response(Admission(shed='image_pool', retry_after=1.0), message)
+        if not image_base64:
+            return jsonify({'error': 'Failed to process image'}), 400
+
+        # Get the conversation summary and recent history for context (oldest first)
+        with stage('image.history'):
+            summary, history = get_conversation_context(student_id)
+
+        # Generate AI response with image
+        with stage('image.generate'):
+            gemini = GeminiService(api_key, student_id=student_id)
+            ai_response = gemini.generate_response_with_image(message, image_base64, history, summary)
+
+        # Save both user message (with indication that it included an image) and AI response
+        user_message_text = f"{message} [Image uploaded]"
+        with stage('image.save'):
+            save_chat_messages(student_id, [
+                ('user', user_message_text),
+                ('ai', ai_response)
+            ])
     
     return jsonify({
         'response': ai_response,
+        'promptTokens': gemini.last_context.prompt_tokens if gemini.last_context else None,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -841,6 +2558,7 @@ def chat_with_ai_image(student_id):
 @app.route('/api/progress/<student_id>', methods=['GET'])
 def get_progress(student_id):
     """Get learning progress analytics"""
+    get_chat_writer().wait_for(student_id)
     conn = get_db_connection()
     
     # Assignment statistics
@@ -909,9 +2627,45 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'Tutorly API is running',
+        **component_stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+def _stats(component):
+    return component.stats() if component is not None else None
+
+def component_stats():
+    """Counters of every shared component, for /api/health and /api/metrics.
+
+    Reads the module globals instead of calling the get_*() factories, so a
+    health probe or metrics scrape reports only components that already
+    exist and never starts one (None for the rest).
+    """
+    return {
+        'upstream': _stats(_upstream_client),
+        'resilience': _stats(_upstream_policy),
+        'singleFlight': _stats(_single_flight),
+        'admission': _stats(_admission_controller),
+        'gateway': _stats(_llm_gateway),
+        'responseCache': _stats(_response_cache),
+        'similarAnswers': _stats(_similar_answers),
+        'retrievalFallback': _stats(_retrieval_fallback),
+        'imagePool': _stats(_image_pool),
+        'contextCache': _stats(_system_prompt_cache),
+        'contextBuilder': _stats(_context_builder),
+        'systemPrompt': _stats(_system_prompts),
+        'routing': _stats(_model_router),
+        'summaries': _stats(_conversation_summarizer),
+    }
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Stage, query and request latency histograms plus component counters, in Prometheus text format"""
+    registry = get_metrics()
+    if registry is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 # Route to serve the main HTML file
 @app.route('/')
 def index():
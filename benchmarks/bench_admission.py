@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: admission control for the AI endpoints.
+
+A script-happy student fires BENCH_SPAM requests from 8 threads while
+BENCH_STUDENTS ordinary students each ask one question. The run is done
+with RATE_LIMIT_BACKEND=off and then with the memory backend, and
+compares upstream calls, the ordinary students' latency and how many of
+them got a real answer. Finally, it checks that the SQLite backend
+enforces one student's burst across several worker processes.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['SINGLE_FLIGHT'] = 'off'
+os.environ['GEMINI_CONTEXT_CACHE'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+os.environ['GEMINI_API_KEY'] = 'bench'
+os.environ.setdefault('GEMINI_GATEWAY_CONCURRENCY', '8')
+os.environ.setdefault('AI_MAX_CONCURRENT', '8')
+os.environ.setdefault('AI_MAX_QUEUE', '8')
+os.environ.setdefault('AI_MAX_QUEUE_MS', '500')
+
+import app as tutorly
+from admission import SQLiteRateLimitBackend
+from mock_gemini import MockGeminiServer
+
+SPAM = int(os.environ.get('BENCH_SPAM', 300))
+STUDENTS = int(os.environ.get('BENCH_STUDENTS', 20))
+
+def run(server, label):
+    client = tutorly.app.test_client()
+    before = server.requests
+    spam_left = [SPAM]
+    lock = threading.Lock()
+
+    def spammer():
+        while True:
+            with lock:
+                if not spam_left[0]:
+                    return
+                spam_left[0] -= 1
+            client.post('/api/chat/spammer/ai', json={'message': f'spam {spam_left[0]}'})
+
+    results = []
+
+    def student(i):
+        time.sleep(0.2 + i * 0.05)
+        start = time.perf_counter()
+        body = client.post(f'/api/chat/student-{i}/ai', json={'message': f'Explain fractions, part {i}'}).get_json()
+        results.append(((time.perf_counter() - start) * 1000, body['response'] == server.reply))
+
+    threads = [threading.Thread(target=spammer) for _ in range(8)]
+    threads += [threading.Thread(target=student, args=(i,)) for i in range(STUDENTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies = sorted(r[0] for r in results)
+    answered = sum(r[1] for r in results)
+    print(f"{label:<10} upstream calls {server.requests - before:>4}   students answered {answered:>3}/{STUDENTS}"
+          f"   student p50 {latencies[len(latencies) // 2]:>7.1f}ms  max {latencies[-1]:>7.1f}ms")
+
+def take_burst(path, results):
+    backend = SQLiteRateLimitBackend(path)
+    results.put(sum(backend.take('student:shared', 1 / 60.0, 5)[0] for _ in range(10)))
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_ms=200).start()
+    original_init = tutorly.GeminiService.__init__
+
+    def init(self, api_key, *args, **kwargs):
+        original_init(self, api_key, *args, **kwargs)
+        self.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+    tutorly.GeminiService.__init__ = init
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        for backend in ('off', 'memory'):
+            os.environ['RATE_LIMIT_BACKEND'] = backend
+            tutorly._admission_controller = None
+            run(server, backend)
+            if tutorly.get_admission_controller():
+                print(f"           admission {tutorly.get_admission_controller().stats()}")
+
+        path = os.path.join(tmp, 'limits.db')
+        SQLiteRateLimitBackend(path)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=take_burst, args=(path, results)) for _ in range(4)]
+        for w in workers:
+            w.start()
+        admitted = sum(results.get() for _ in workers)
+        for w in workers:
+            w.join()
+        print(f"sqlite backend: 4 processes x 10 requests, burst 5 -> {admitted} admitted")
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
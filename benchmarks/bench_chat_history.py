@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark: GET /api/chat/<student_id> latency for a short vs. a very long chat log.
+
+With keyset pagination the cost of a page should not depend on how many
+messages the student has in total.
+"""
+import os
+import sys
+import sqlite3
+import statistics
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+
+SIZES = [100, 100000]
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 300))
+
+def seed(sizes):
+    conn = sqlite3.connect(tutorly.DATABASE)
+    for size in sizes:
+        conn.executemany(
+            'INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)',
+            ((f'S{size}', 'user' if i % 2 == 0 else 'ai', f'message {i} ' * 10) for i in range(size))
+        )
+    conn.commit()
+    conn.close()
+
+def time_route(client, url):
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        seed(SIZES)
+        client = tutorly.app.test_client()
+
+        print(f"{'messages':>9}  {'page':<8} {'p50 ms':>8} {'p95 ms':>8}")
+        for size in SIZES:
+            middle = client.get(f'/api/chat/S{size}?limit=1').get_json()[0]['id'] - size // 2
+            for label, query in [('tail', ''), ('before', f'?before={middle}')]:
+                p50, p95 = time_route(client, f'/api/chat/S{size}{query}')
+                print(f"{size:>9}  {label:<8} {p50:>8.3f} {p95:>8.3f}")
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: prompt size and latency, fixed "last 10 messages" vs. the
+token-budget context builder.
+
+Replays synthetic conversations through GeminiService against the mock
+upstream. The mock adds BENCH_MS_PER_KB of delay per KB of request
+contents, standing in for model prefill time. Some conversations contain
+a pasted essay, and others are many one-line turns.
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['GEMINI_CONTEXT_CACHE'] = 'off'
+
+import app as tutorly
+from context_builder import ContextBuilder
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 200))
+MS_PER_KB = float(os.environ.get('BENCH_MS_PER_KB', 2))
+BUDGET = int(os.environ.get('CONTEXT_BUDGET_TOKENS', 2000))
+MAX_MESSAGE = int(os.environ.get('CONTEXT_MAX_MESSAGE_TOKENS', 400))
+
+rng = random.Random(7)
+WORDS = ['photosynthesis', 'energy', 'light', 'cell', 'the', 'and', 'of', 'equation',
+         'reaction', 'plant', 'because', 'water', 'carbon', 'dioxide', 'glucose']
+
+def sentence(n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+def make_history():
+    kind = rng.random()
+    turns = []
+    if kind < 0.3:
+        # A pasted essay somewhere in the last few turns
+        turns.append({'sender': 'user', 'message': ' '.join(sentence(20) for _ in range(300))})
+        turns.append({'sender': 'ai', 'message': sentence(60)})
+    count = 20 if kind > 0.6 else 8
+    for i in range(count):
+        sender = 'user' if i % 2 == 0 else 'ai'
+        turns.append({'sender': sender, 'message': sentence(3 if kind > 0.6 else 40)})
+    return turns[-20:]
+
+def run(server, builder, label, histories):
+    sizes, latencies, tokens = [], [], []
+    for history in histories:
+        service = tutorly.GeminiService('bench', context_builder=builder)
+        service.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+        start = time.perf_counter()
+        service.generate_response('Can you explain the light reactions in more detail?', history)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(json.dumps(server.last_payload['contents'])))
+        tokens.append(service.last_context.prompt_tokens)
+    latencies.sort()
+    print(f"{label:<22} {statistics.mean(sizes) / 1024:>7.1f} KB {max(sizes) / 1024:>8.1f} KB "
+          f"{statistics.mean(tokens):>8.0f} {statistics.median(latencies):>8.1f}ms "
+          f"{latencies[int(len(latencies) * 0.95)]:>8.1f}ms")
+
+def main():
+    histories = [make_history() for _ in range(ROUNDS)]
+    server = MockGeminiServer(('127.0.0.1', 0), latency_per_kb_ms=MS_PER_KB).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        print(f"{ROUNDS} turns, mock prefill {MS_PER_KB:g} ms/KB")
+        print(f"{'context':<22} {'avg body':>10} {'max body':>11} {'~tokens':>8} {'p50':>10} {'p95':>10}")
+        # The old behaviour: the last 10 messages, whatever their length
+        run(server, ContextBuilder(budget_tokens=10 ** 9, max_message_tokens=10 ** 9),
+            'last 10 messages', [h[-10:] for h in histories])
+        builder = ContextBuilder(budget_tokens=BUDGET, max_message_tokens=MAX_MESSAGE)
+        run(server, builder, f'budget {BUDGET} tokens', histories)
+        print(f"builder: {builder.stats()}")
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
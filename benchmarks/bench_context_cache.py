@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Offline check: Gemini context caching of the system prompt.
+
+Against the mock upstream, measures the request body sent per tutoring turn
+with the system prompt inline vs. referenced through a cachedContents
+handle, and checks the fallback paths:
+  - the handle disappears upstream (expiry): the request is retried inline
+    and a new handle is created on the next turn
+  - caching is unavailable (creation rejected): prompts go inline
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['MODEL_ROUTING'] = 'off'
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 50))
+
+def make_service(server, prompt_cache, model='mock'):
+    service = tutorly.GeminiService('bench', prompt_cache=prompt_cache)
+    service.base_url = f"{server.base_url}/v1beta/models/{model}:generateContent"
+    return service
+
+def run(service, server, label):
+    sizes = []
+    for i in range(ROUNDS):
+        reply = service.generate_response(f"Explain topic number {i}")
+        assert reply == server.reply, reply
+        if ':generateContent' in server.last_path:
+            sizes.append(len(json.dumps(server.last_payload)))
+    print(f"{label:<14} {statistics.mean(sizes):>8.0f} B/request  "
+          f"upstream requests {server.requests}")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+
+        server = MockGeminiServer(('127.0.0.1', 0)).start()
+        run(make_service(server, tutorly.SystemPromptCache()), server, 'cached')
+        assert len(server.cached_contents) == 1
+
+        server.requests = 0
+        inline = MockGeminiServer(('127.0.0.1', 0), context_cache=False).start()
+        unavailable = tutorly.SystemPromptCache()
+        run(make_service(inline, unavailable, model='mock-inline'), inline, 'inline')
+        # One rejected create, then inline without retrying creation
+        assert inline.requests == ROUNDS + 1, inline.requests
+        assert unavailable.stats()['unavailable']
+
+        # Expire the handle upstream; the next turn retries inline. A fresh
+        # SystemPromptCache picks up the handle recorded by the first run.
+        prompt_cache = tutorly.SystemPromptCache()
+        service = make_service(server, prompt_cache)
+        service.generate_response("What is osmosis?")
+        assert len(server.cached_contents) == 1
+        server.cached_contents.clear()
+        server.requests = 0
+        assert service.generate_response("What is diffusion?") == server.reply
+        assert 'systemInstruction' in server.last_payload
+        assert server.requests == 2, server.requests
+        service.generate_response("What is a cell?")
+        assert 'cachedContent' in server.last_payload
+        print(f"expiry recovery ok: {prompt_cache.stats()}")
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+        server.shutdown()
+        inline.shutdown()
+
+if __name__ == '__main__':
+    main()
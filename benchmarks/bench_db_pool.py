@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: requests/sec for read routes with pooled vs. per-query SQLite connections
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+
+THREADS = int(os.environ.get('BENCH_THREADS', 8))
+DURATION = float(os.environ.get('BENCH_SECONDS', 3))
+ROUTES = ['/api/assignments/S1', '/api/progress/S1', '/api/performance/S1']
+
+def legacy_get_db_connection():
+    """The original behavior: a fresh, untuned connection per call"""
+    conn = sqlite3.connect(tutorly.DATABASE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def seed():
+    conn = sqlite3.connect(tutorly.DATABASE)
+    conn.execute("INSERT INTO users (student_id, name) VALUES ('S1', 'Bench')")
+    conn.executemany(
+        'INSERT INTO assignments (student_id, title, subject, due_date, status) VALUES (?, ?, ?, ?, ?)',
+        [('S1', f'Task {i}', ['Math', 'Science'][i % 2], f'2025-01-{i % 28 + 1:02d}', 'Pending') for i in range(200)]
+    )
+    conn.executemany(
+        'INSERT INTO subject_performance (student_id, subject, date, score) VALUES (?, ?, ?, ?)',
+        [('S1', 'Math', f'2025-01-{i % 28 + 1:02d}', 80) for i in range(200)]
+    )
+    conn.commit()
+    conn.close()
+
+def run(label):
+    client = tutorly.app.test_client()
+    count = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION
+
+    def worker():
+        local = 0
+        while time.perf_counter() < deadline:
+            for route in ROUTES:
+                client.get(route)
+                local += 1
+        with lock:
+            count[0] += local
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    rps = count[0] / elapsed
+    print(f"{label:<10} {count[0]:>7} requests  {rps:>9.1f} req/s")
+    return rps
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        seed()
+
+        pooled_get = tutorly.get_db_connection
+        tutorly.get_db_connection = legacy_get_db_connection
+        legacy = run('legacy')
+        tutorly.get_db_connection = pooled_get
+        pooled = run('pooled')
+        tutorly.get_db_pool().close_all()
+
+    print(f"speedup    {pooled / legacy:.2f}x ({THREADS} threads, {DURATION:.0f}s each)")
+
+if __name__ == '__main__':
+    main()
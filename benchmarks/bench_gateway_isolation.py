@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Load test: /api/assignments latency while AI calls saturate a slow upstream.
+
+A fixed pool of BENCH_WORKERS threads stands in for the web server's
+workers (like gunicorn sync/gthread workers). AI requests go to a mock
+upstream that takes BENCH_UPSTREAM_MS per call. Without the gateway, every
+AI request pins a worker for the full upstream latency and the assignment
+route queues behind them. With the gateway, only a bounded number of
+workers wait on the upstream and the rest get the fallback at once.
+"""
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Admission control would shed this benchmark's repeated requests
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+from upstream import LLMGateway
+
+WORKERS = int(os.environ.get('BENCH_WORKERS', 8))
+DURATION = float(os.environ.get('BENCH_SECONDS', 5))
+UPSTREAM_MS = float(os.environ.get('BENCH_UPSTREAM_MS', 1500))
+AI_RPS = float(os.environ.get('BENCH_AI_RPS', 20))
+ASSIGNMENT_RPS = float(os.environ.get('BENCH_ASSIGNMENT_RPS', 20))
+
+def producer(jobs, kind, rps, deadline):
+    interval = 1.0 / rps
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        jobs.put((kind, time.perf_counter()))
+        next_at += interval
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+
+def run(label, gateway):
+    tutorly._llm_gateway = gateway
+    client = tutorly.app.test_client()
+    jobs = queue.Queue()
+    results = {'assignment': [], 'ai': []}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            kind, queued_at = job
+            if kind == 'ai':
+                client.post('/api/chat/S1/ai', json={'message': 'Explain photosynthesis'})
+            else:
+                client.get('/api/assignments/S1')
+            with lock:
+                results[kind].append((time.perf_counter() - queued_at) * 1000)
+
+    workers = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for t in workers:
+        t.start()
+    deadline = time.perf_counter() + DURATION
+    producers = [threading.Thread(target=producer, args=(jobs, kind, rps, deadline))
+                 for kind, rps in [('ai', AI_RPS), ('assignment', ASSIGNMENT_RPS)]]
+    for t in producers:
+        t.start()
+    for t in producers:
+        t.join()
+    for _ in workers:
+        jobs.put(None)
+    for t in workers:
+        t.join()
+
+    assignments = sorted(results['assignment'])
+    p95 = assignments[int(len(assignments) * 0.95)]
+    print(f"{label:<9} assignments p50 {statistics.median(assignments):>8.1f} ms  p95 {p95:>8.1f} ms  "
+          f"({len(assignments)} done, {len(results['ai'])} AI requests served)")
+    if gateway:
+        print(f"          gateway {gateway.stats()}")
+        gateway.shutdown()
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_ms=UPSTREAM_MS).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        os.environ['GEMINI_API_KEY'] = 'bench'
+        original_init = tutorly.GeminiService.__init__
+
+        def init(self, api_key, *args, **kwargs):
+            original_init(self, api_key, *args, **kwargs)
+            self.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+        tutorly.GeminiService.__init__ = init
+
+        print(f"{WORKERS} workers, upstream {UPSTREAM_MS:.0f} ms, {AI_RPS:.0f} AI req/s + "
+              f"{ASSIGNMENT_RPS:.0f} assignment req/s for {DURATION:.0f}s")
+        os.environ['GEMINI_GATEWAY_CONCURRENCY'] = '0'
+        run('direct', None)
+        run('gateway', LLMGateway(max_concurrency=2, max_queue=2, max_wait=UPSTREAM_MS / 1000 * 2))
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark: image preparation for /ai/image on 12 MP homework photos.
+
+Writes BENCH_IMAGES synthetic 4000x3000 JPEGs (a page with lines of
+"handwriting" and sensor noise) and prepares each one three ways:
+  - legacy   the previous process_image: full decode, LANCZOS thumbnail,
+             on the request threads
+  - inline   prepare_image (draft decode, filter by ratio) on the
+             request threads (IMAGE_WORKERS=0)
+  - pool:N   prepare_image on an ImagePool of N worker processes
+             (BENCH_WORKERS, e.g. "1,2,4")
+
+BENCH_CONCURRENCY request threads submit the images. Each case runs in
+its own process so that peak RSS is its own. The report gives:
+  - throughput, and throughput per core used
+  - peak RSS of the web process and of the largest worker
+  - p50/p95 lag of a 5 ms ticker thread in the web process, which shows how
+    long other requests wait for the GIL
+"""
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGES = int(os.environ.get('BENCH_IMAGES', 16))
+WORKERS = [int(n) for n in os.environ.get('BENCH_WORKERS', '1,2,4').split(',')]
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', 4))
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 2))
+
+
+def make_corpus(directory):
+    from PIL import Image, ImageDraw
+    rng = random.Random(11)
+    noise = Image.effect_noise((4000, 3000), 24).convert('RGB')
+    paths = []
+    for i in range(IMAGES):
+        page = Image.new('RGB', (4000, 3000), (rng.randint(215, 240), rng.randint(210, 235), rng.randint(190, 220)))
+        draw = ImageDraw.Draw(page)
+        for y in range(rng.randint(150, 300), 2900, 110):
+            x = rng.randint(150, 400)
+            while x < rng.randint(3000, 3800):
+                width = rng.randint(40, 260)
+                points = [(x + dx, y + rng.randint(-25, 25)) for dx in range(0, width, 12)]
+                draw.line(points, fill=(rng.randint(10, 60),) * 3, width=rng.randint(4, 8))
+                x += width + rng.randint(30, 70)
+        page = Image.blend(page, noise, 0.12).rotate(rng.uniform(-3, 3), fillcolor=(90, 80, 70))
+        path = os.path.join(directory, f'photo{i}.jpg')
+        page.save(path, 'JPEG', quality=92)
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb(pid='self'):
+    """VmHWM of a process. Unlike ru_maxrss it starts afresh at exec, so a case doesn't
+    inherit the corpus generator's peak."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if pid == 'self' else None
+
+
+def legacy_process(data):
+    """process_image before the image pool"""
+    import base64
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGB')
+    img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def run_case(case, directory):
+    """Run one case in this process and print its results as JSON"""
+    from image_pool import ImagePool, prepare_image
+    blobs = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            blobs.append(f.read())
+    if case == 'legacy':
+        prepare, pool, cores = legacy_process, None, 1
+    elif case == 'inline':
+        prepare, pool, cores = prepare_image, None, 1
+    else:
+        workers = int(case.split(':')[1])
+        pool = ImagePool(workers=workers, max_queue=CONCURRENCY, max_wait=60)
+        prepare, cores = pool.prepare, min(workers, os.cpu_count() or 1)
+        # Start every worker before timing, as a long-running server would have
+        warm = [threading.Thread(target=pool.prepare, args=(blobs[0],)) for _ in range(workers)]
+        for thread in warm:
+            thread.start()
+        for thread in warm:
+            thread.join()
+
+    jobs = list(range(len(blobs))) * ROUNDS
+    lock = threading.Lock()
+
+    def submit():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                i = jobs.pop()
+            prepare(blobs[i])
+
+    lags, ticking = [], threading.Event()
+    ticking.set()
+
+    def tick():
+        while ticking.is_set():
+            start = time.perf_counter()
+            time.sleep(0.005)
+            lags.append((time.perf_counter() - start - 0.005) * 1000)
+
+    ticker = threading.Thread(target=tick)
+    ticker.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=submit) for _ in range(CONCURRENCY)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ticking.clear()
+    ticker.join()
+    worker_rss = None
+    if pool is not None:
+        processes = pool._executor._processes or {}
+        worker_rss = max((peak_rss_mb(pid) or 0 for pid in processes), default=None)
+        pool.shutdown()
+
+    lags.sort()
+    print(json.dumps({
+        'images_per_s': len(blobs) * ROUNDS / elapsed,
+        'cores': cores,
+        'web_rss_mb': peak_rss_mb(),
+        'worker_rss_mb': worker_rss,
+        'lag_p95_ms': lags[int(len(lags) * 0.95)] if lags else 0.0,
+        'lag_p50_ms': statistics.median(lags) if lags else 0.0,
+    }))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        paths = make_corpus(tmp)
+        size = sum(os.path.getsize(path) for path in paths) / len(paths) / 1e6
+        print(f"corpus     {len(paths)} photos, 4000x3000, {size:.1f} MB each, made in {time.perf_counter() - start:.1f}s")
+        print(f"           {CONCURRENCY} request threads, {ROUNDS} rounds, {os.cpu_count()} CPUs\n")
+        print(f"{'case':<9} {'img/s':>7} {'img/s/core':>11} {'web RSS':>9} {'worker RSS':>11} "
+              f"{'tick lag p50/p95':>17}")
+        for case in ['legacy', 'inline'] + [f'pool:{n}' for n in WORKERS]:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', case, tmp],
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            worker = f"{r['worker_rss_mb']:.0f} MB" if r['worker_rss_mb'] else '-'
+            print(f"{case:<9} {r['images_per_s']:>7.2f} {r['images_per_s'] / r['cores']:>11.2f} "
+                  f"{r['web_rss_mb']:>6.0f} MB {worker:>11} {r['lag_p50_ms']:>7.1f}/{r['lag_p95_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--case':
+        run_case(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: prompt size over a long tutoring session, with and without
+rolling conversation summaries.
+
+Drives BENCH_TURNS turns of one student through POST /api/chat/<id>/ai
+against the mock upstream, which also stands in for the summarizer model.
+Reports the promptTokens of every request at a few points in the session
+and checks that the summary row advances.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['RATE_LIMIT_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['GEMINI_API_KEY'] = 'bench'
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+TURNS = int(os.environ.get('BENCH_TURNS', 200))
+CHECKPOINTS = [t for t in (5, 10, 25, 50, 100, 200, 500, 1000) if t <= TURNS]
+
+def session(server, summaries):
+    os.environ['CONVERSATION_SUMMARIES'] = 'on' if summaries else 'off'
+    client = tutorly.app.test_client()
+    student = f"S-{'sum' if summaries else 'raw'}"
+    tokens, latencies = {}, []
+    for turn in range(1, TURNS + 1):
+        start = time.perf_counter()
+        response = client.post(f'/api/chat/{student}/ai', json={
+            'message': f'Question {turn}: how does step {turn % 7} of the light reactions work?'
+        })
+        latencies.append((time.perf_counter() - start) * 1000)
+        tokens[turn] = response.get_json()['promptTokens']
+        summarizer = tutorly.get_conversation_summarizer()
+        if summarizer is not None:
+            # Let the background refresh land so every run sees the same state
+            summarizer.flush()
+    return student, tokens, latencies
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0)).start()
+    original_init = tutorly.GeminiService.__init__
+
+    def init(self, api_key, *args, **kwargs):
+        original_init(self, api_key, *args, **kwargs)
+        self.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+    tutorly.GeminiService.__init__ = init
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        print(f"{'summaries':<10} " + ' '.join(f"{'turn ' + str(t):>9}" for t in CHECKPOINTS)
+              + f" {'p50 ms':>7}")
+        for summaries in (False, True):
+            student, tokens, latencies = session(server, summaries)
+            latencies.sort()
+            print(f"{'on' if summaries else 'off':<10} "
+                  + ' '.join(f"{tokens[t]:>9}" for t in CHECKPOINTS)
+                  + f" {latencies[len(latencies) // 2]:>7.1f}")
+
+        conn = tutorly.get_db_connection()
+        row = conn.execute('SELECT summarized_through FROM conversation_summaries WHERE student_id = ?',
+                           (student,)).fetchone()
+        conn.close()
+        assert row is not None, 'no summary was written'
+        print(f"summarizer: {tutorly.get_conversation_summarizer().stats()}, "
+              f"summarized through message id {row['summarized_through']}")
+
+        tutorly.get_conversation_summarizer().stop()
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
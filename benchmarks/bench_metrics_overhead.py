@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cost of the latency instrumentation (METRICS=on vs off).
+
+Sends BENCH_ROUNDS rounds of GET /api/assignments/<id> and POST
+/api/chat/<id>/ai (against an instant mock upstream) through the Flask
+test client, alternating metrics off and on three times. Reports the
+best mean time per request for each, and finally prints a few lines of
+/api/metrics.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['RATE_LIMIT_BACKEND'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+os.environ['GEMINI_API_KEY'] = 'bench'
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 300))
+
+def reset():
+    """Drop the components that captured the metrics registry when they were built"""
+    if tutorly._db_pool is not None:
+        tutorly._db_pool.close_all()
+    tutorly._db_pool = None
+    if tutorly._chat_writer is not None:
+        tutorly._chat_writer.stop()
+    tutorly._chat_writer = None
+    tutorly._metrics = None
+
+def run(label):
+    client = tutorly.app.test_client()
+    client.post('/api/auth/login', json={'name': 'Bench', 'studentId': f'M-{label}'})
+    timings = {'assignments': 0.0, 'chat': 0.0}
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        client.get(f'/api/assignments/M-{label}')
+        timings['assignments'] += time.perf_counter() - start
+        start = time.perf_counter()
+        client.post(f'/api/chat/M-{label}/ai', json={'message': f'What is {i} + {i}?'})
+        timings['chat'] += time.perf_counter() - start
+    return {k: v / ROUNDS * 1e6 for k, v in timings.items()}
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0)).start()
+    os.environ['GEMINI_BASE_URL'] = f'{server.base_url}/v1beta'
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        results = {'off': {}, 'on': {}}
+        for attempt in range(3):
+            for setting in ('off', 'on'):
+                os.environ['METRICS'] = setting
+                reset()
+                for endpoint, us in run(f'{setting}{attempt}').items():
+                    results[setting][endpoint] = min(us, results[setting].get(endpoint, us))
+        for endpoint in ('assignments', 'chat'):
+            off, on = results['off'][endpoint], results['on'][endpoint]
+            print(f"{endpoint:<12} off {off:>8.1f}us   on {on:>8.1f}us   overhead {on - off:>+7.1f}us "
+                  f"({(on - off) / off:+.1%})")
+
+        text = tutorly.app.test_client().get('/api/metrics').get_data(as_text=True)
+        for line in text.splitlines():
+            if line.startswith(('tutorly_stage_seconds_count', 'tutorly_db_query_seconds_count{query="select')):
+                print(line)
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
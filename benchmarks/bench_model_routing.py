@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one model for every question vs. subject/complexity routing.
+
+Sends a mix of quick look-up questions, ordinary homework questions and
+multi-step proofs through GeminiService against the mock upstream, first
+with MODEL_ROUTING=off and then on. The mock serves models whose name
+contains "lite" in BENCH_LITE_SCALE of the time, generates at
+BENCH_TOKENS_PER_SECOND and cuts replies at maxOutputTokens. Prints
+latency and output tokens per complexity tier for both runs, and the
+router's per-route stats.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 90))
+WORKERS = int(os.environ.get('BENCH_WORKERS', 8))
+LITE_SCALE = float(os.environ.get('BENCH_LITE_SCALE', 0.4))
+TOKENS_PER_SECOND = float(os.environ.get('BENCH_TOKENS_PER_SECOND', 1500))
+
+QUESTIONS = {
+    'quick': ['What is a noun?', 'Define photosynthesis', 'What is 7 * 8?', 'Who was Isaac Newton?',
+              'What does DNA stand for?', 'Spell necessary'],
+    'standard': ['How do I find the slope of the line through (1, 2) and (3, 8)?',
+                 'Why do plants need sunlight to grow and what happens at night?',
+                 'Can you help me write a topic sentence for my paragraph about recycling?',
+                 'How does a chemical reaction release energy?'],
+    'deep': ['Prove that the sum of two odd numbers is always even, step by step',
+             'Derive the quadratic formula and explain why completing the square works',
+             'Compare and contrast mitosis and meiosis in detail',
+             'Analyze the theme of ambition in Macbeth and justify it with evidence from the play'],
+}
+
+# Labels every question with its tier, whether or not the run routes by it
+classifier = tutorly.ModelRouter(tutorly.detect_subject, default_model=None)
+
+def run(label, questions):
+    os.environ['MODEL_ROUTING'] = label
+    tutorly._model_router = None
+    router = tutorly.get_model_router()
+
+    def ask(question):
+        service = tutorly.GeminiService('bench')
+        start = time.perf_counter()
+        service.generate_response(question, [])
+        return classifier.tier(question), (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        results = list(pool.map(ask, questions))
+    print(f"\nMODEL_ROUTING={label}")
+    for tier in ('quick', 'standard', 'deep'):
+        latencies = sorted(ms for t, ms in results if t == tier)
+        if latencies:
+            print(f"  {tier:<9} n={len(latencies):<4} p50 {statistics.median(latencies):7.1f}ms   "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.1f}ms")
+    return router
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_ms=300, latency_dist='lognormal', latency_spread=0.3,
+                              tokens_per_second=TOKENS_PER_SECOND, reply_tokens=900,
+                              model_scale={'lite': LITE_SCALE}).start()
+    os.environ['GEMINI_BASE_URL'] = f'{server.base_url}/v1beta'
+    rng = random.Random(11)
+    pool = [q for qs in QUESTIONS.values() for q in qs]
+    questions = [rng.choice(pool) for _ in range(ROUNDS)]
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        run('off', questions)
+        router = run('on', questions)
+        print("\nPer-route stats (routing on):")
+        for name, stats in router.stats()['routes'].items():
+            print(f"  {name:<18} n={stats['requests']:<4} p50 {stats['latency_p50_ms']:7.1f}ms   "
+                  f"p95 {stats['latency_p95_ms']:7.1f}ms   out {stats['avg_output_tokens']:6.1f} tok   "
+                  f"capped {stats['hit_output_cap']}")
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
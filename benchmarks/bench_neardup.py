@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the near-duplicate question index (neardup.py).
+
+Builds a MinHashLSH index over BENCH_PAIRS synthetic stored questions
+(default 1M), then measures:
+  - recall on paraphrases of stored questions (case, spacing, Unicode
+    superscripts, stopword rewording, punctuation)
+  - false matches on near-misses (one number or one content word changed)
+  - lookup latency, build time and peak RSS
+"""
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neardup import MinHashLSH
+
+PAIRS = int(os.environ.get('BENCH_PAIRS', 1000000))
+QUERIES = int(os.environ.get('BENCH_QUERIES', 2000))
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.85))
+SUPERSCRIPT = {'2': '²', '3': '³'}
+
+rng = random.Random(42)
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pha', 'tro', 'gen', 'cel', 'dor', 'bus']
+VOCAB = sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(8000)})
+
+def make_question(r):
+    kind = r.random()
+    if kind < 0.4:
+        a, b, c = r.randint(1, 99), r.randint(1, 99), r.randint(1, 99)
+        return ('math', (a, b, c)), f"How do I solve {a}x^2+{b}x+{c}=0?"
+    words = r.sample(VOCAB, 3)
+    if kind < 0.7:
+        return ('explain', tuple(words)), f"Explain {words[0]} {words[1]} in {words[2]}"
+    return ('diff', tuple(words)), f"What is the difference between {words[0]} {words[1]} and {words[2]}?"
+
+def render(key):
+    kind, parts = key
+    if kind == 'math':
+        return f"How do I solve {parts[0]}x^2+{parts[1]}x+{parts[2]}=0?"
+    if kind == 'explain':
+        return f"Explain {parts[0]} {parts[1]} in {parts[2]}"
+    return f"What is the difference between {parts[0]} {parts[1]} and {parts[2]}?"
+
+def paraphrase(key, r):
+    kind, parts = key
+    if kind == 'math':
+        a, b, c = parts
+        square = 'x' + SUPERSCRIPT['2'] if r.random() < 0.5 else 'x^2'
+        lead = r.choice(['how to solve', 'How do i solve', 'can you help me solve', 'solve'])
+        return f"{lead} {a}{square} + {b}x + {c} = 0 {r.choice(['', '?', 'please'])}"
+    if kind == 'explain':
+        lead = r.choice(['can you explain', 'please explain', 'EXPLAIN', 'explain to me'])
+        return f"{lead} {parts[0]}  {parts[1]} in {parts[2]}{r.choice(['', '?', '.'])}"
+    return f"{r.choice(['whats', 'what is'])} the difference between {parts[0]} {parts[1]} and {parts[2]}"
+
+def near_miss(key, r):
+    kind, parts = key
+    if kind == 'math':
+        parts = list(parts)
+        i = r.randrange(3)
+        parts[i] = parts[i] % 99 + 1
+        return render((kind, tuple(parts)))
+    parts = list(parts)
+    parts[r.randrange(3)] = r.choice(VOCAB)
+    return render((kind, tuple(parts)))
+
+def main():
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = MinHashLSH(capacity=PAIRS)
+    keys = {}
+    start = time.perf_counter()
+    while len(keys) < PAIRS:
+        key, text = make_question(rng)
+        if key in keys:
+            continue
+        keys[key] = len(keys)
+        index.add(keys[key], text)
+    build = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    sample = rng.sample(list(keys), QUERIES)
+    latencies = []
+    found = 0
+    for key in sample:
+        query = paraphrase(key, rng)
+        t0 = time.perf_counter()
+        match = index.query(query, THRESHOLD)
+        latencies.append((time.perf_counter() - t0) * 1e6)
+        found += bool(match and match[0] == keys[key])
+
+    false_matches = 0
+    for key in sample:
+        match = index.query(near_miss(key, rng), THRESHOLD)
+        false_matches += bool(match and match[0] == keys[key])
+
+    latencies.sort()
+    print(f"indexed     {len(index):,} questions in {build:.1f}s ({build / PAIRS * 1e6:.1f} us/add)")
+    print(f"memory      ~{(rss_after - rss_before) / 1024:.0f} MB RSS growth "
+          f"(peak {rss_after / 1024:.0f} MB)")
+    print(f"recall      {found / QUERIES:.3f} on {QUERIES} paraphrases (threshold {THRESHOLD})")
+    print(f"false match {false_matches / QUERIES:.3f} on {QUERIES} near-misses")
+    print(f"lookup      p50 {statistics.median(latencies):.0f} us  "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.0f} us  "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.0f} us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Simulation: interactive chat latency on the LLM gateway under mixed load.
+
+Simulated upstream calls (sleeps, no HTTP) are run on LLMGateway:
+  - interactive: Poisson arrivals at BENCH_RPS from BENCH_STUDENTS students,
+    each call BENCH_CHAT_MS long. One "heavy" student sends 30% of them.
+  - background: BENCH_JOBS summary jobs of BENCH_JOB_MS each, all queued
+    at the start (a nightly batch, say).
+
+Three setups are compared:
+  - fifo: every call in one first-come-first-served queue (the old gateway)
+  - priority: interactive ahead of background, background capped at half
+    of the workers, fair queuing per student
+  - priority+quota: the same, plus a requests/min quota that background
+    work may only fill halfway, keeping the rest for interactive work
+
+For each, the run reports the interactive p50/p95/p99, the share meeting
+BENCH_SLO_MS, the light students' p95 and the background jobs finished.
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream import BACKGROUND, INTERACTIVE, LLMGateway, QuotaTracker
+
+WORKERS = int(os.environ.get('BENCH_WORKERS', 8))
+RPS = float(os.environ.get('BENCH_RPS', 20))
+STUDENTS = int(os.environ.get('BENCH_STUDENTS', 20))
+CHAT_MS = float(os.environ.get('BENCH_CHAT_MS', 150))
+JOBS = int(os.environ.get('BENCH_JOBS', 300))
+JOB_MS = float(os.environ.get('BENCH_JOB_MS', 400))
+DURATION = float(os.environ.get('BENCH_DURATION', 6))
+SLO_MS = float(os.environ.get('BENCH_SLO_MS', 500))
+
+def upstream_call(ms):
+    time.sleep(ms / 1000.0)
+    return True
+
+def run(label, prioritized, quota=None):
+    gateway = LLMGateway(max_concurrency=WORKERS, max_queue=10 ** 6, max_wait=60,
+                         background_queue=10 ** 6,
+                         background_concurrency=None if prioritized else WORKERS, quota=quota)
+    background = BACKGROUND if prioritized else INTERACTIVE
+    jobs_done = []
+    for i in range(JOBS):
+        future = gateway.submit(upstream_call, JOB_MS, priority=background,
+                                flow=f'job-{i}' if prioritized else None, cost=500)
+        future.add_done_callback(lambda f: jobs_done.append(1) if not f.cancelled() else None)
+
+    rng = random.Random(1)
+    latencies = {'heavy': [], 'light': []}
+    lock = threading.Lock()
+    waiters = []
+
+    def chat(student):
+        start = time.perf_counter()
+        future = gateway.submit(upstream_call, CHAT_MS, priority=INTERACTIVE,
+                                flow=student if prioritized else None, cost=800)
+        future.result()
+        with lock:
+            latencies['heavy' if student == 'heavy' else 'light'].append((time.perf_counter() - start) * 1000)
+
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        time.sleep(rng.expovariate(RPS))
+        student = 'heavy' if rng.random() < 0.3 else f'student-{rng.randrange(STUDENTS)}'
+        t = threading.Thread(target=chat, args=(student,))
+        t.start()
+        waiters.append(t)
+    for t in waiters:
+        t.join()
+    finished_jobs = len(jobs_done)
+    gateway.shutdown()
+
+    everything = sorted(latencies['heavy'] + latencies['light'])
+    light = sorted(latencies['light'])
+    p = lambda xs, q: xs[min(len(xs) - 1, int(len(xs) * q))]
+    within = sum(1 for x in everything if x <= SLO_MS) / len(everything)
+    print(f"{label:<15} {p(everything, 0.5):>7.0f} {p(everything, 0.95):>7.0f} {p(everything, 0.99):>7.0f} "
+          f"{within:>8.1%} {p(light, 0.95):>9.0f} {finished_jobs:>6}")
+
+def main():
+    print(f"{WORKERS} workers; chat {RPS:g}/s x {CHAT_MS:.0f} ms; {JOBS} background jobs x {JOB_MS:.0f} ms; "
+          f"SLO {SLO_MS:.0f} ms; {DURATION:g}s")
+    print(f"{'setup':<15} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'in SLO':>8} {'light p95':>9} {'jobs':>6}")
+    run('fifo', prioritized=False)
+    run('priority', prioritized=True)
+    # Sized so the run crosses the background share but interactive never reaches the limit
+    quota = QuotaTracker(requests_per_minute=int(RPS * DURATION * 1.5), background_share=0.5)
+    run('priority+quota', prioritized=True, quota=quota)
+    print(f"quota {quota.requests_per_minute}/min: {quota.stats(time.monotonic())['requests_last_minute']} "
+          f"requests used in the last minute")
+
+if __name__ == '__main__':
+    main()
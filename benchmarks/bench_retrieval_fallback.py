@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: BM25 retrieval fallback over past AI answers (RetrievalFallback).
+
+Fills chat_messages with BENCH_PAIRS synthetic question/answer pairs. Each
+question names a topic of three content words, and its answer explains
+that topic. Then it measures:
+  - full build time, index file size and time to map the file at startup
+  - incremental indexing of BENCH_NEW_PAIRS more pairs
+  - lookup latency, including fetching the answer from SQLite, and the
+    latency of misses whose words appear in every answer
+  - how often a reworded question gets its own topic's answer, and how
+    often unrelated questions or ones sharing a single word get any answer
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+from bm25 import BM25Index
+
+PAIRS = int(os.environ.get('BENCH_PAIRS', 50000))
+NEW_PAIRS = int(os.environ.get('BENCH_NEW_PAIRS', 1000))
+QUERIES = int(os.environ.get('BENCH_QUERIES', 500))
+
+rng = random.Random(3)
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pha', 'tro', 'gen', 'cel', 'dor', 'bus']
+VOCAB = sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(20000)})
+FILLER = ('first look at what the problem gives you then think about which idea applies here and try '
+          'the next step yourself before checking it against the example').split()
+
+def make_pair():
+    topic = rng.sample(VOCAB, 3)
+    question = f"How does {topic[0]} {topic[1]} work with {topic[2]}?"
+    words = [rng.choice(FILLER) for _ in range(rng.randint(60, 120))]
+    for i in range(6):
+        words[rng.randrange(len(words))] = topic[i % 3]
+    words += [rng.choice(VOCAB) for _ in range(5)]
+    return topic, question, ' '.join(words)
+
+def fill(conn, pairs):
+    rows = []
+    for topic, question, answer in pairs:
+        rows.append(('bench', 'user', question))
+        rows.append(('bench', 'ai', answer))
+    conn.executemany('INSERT INTO chat_messages (student_id, sender, message) VALUES (?, ?, ?)', rows)
+    conn.commit()
+
+def refresh(fallback):
+    fallback._refreshing.acquire()
+    start = time.perf_counter()
+    fallback._refresh()
+    return time.perf_counter() - start
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        conn = tutorly.get_db_connection()
+        pairs = [make_pair() for _ in range(PAIRS)]
+        fill(conn, pairs)
+
+        path = os.path.join(tmp, 'bench.db.bm25')
+        fallback = tutorly.RetrievalFallback(tutorly.DATABASE, path, merge_every=NEW_PAIRS,
+                                             refresh_seconds=1e9)
+        build = refresh(fallback)
+        print(f"build      {PAIRS} pairs in {build:.2f}s   file {os.path.getsize(path) / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        BM25Index(path).load()
+        print(f"startup    mapped in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        new_pairs = [make_pair() for _ in range(NEW_PAIRS)]
+        fill(conn, new_pairs)
+        print(f"increment  {NEW_PAIRS} new pairs indexed and merged in {refresh(fallback):.2f}s")
+        pairs += new_pairs
+
+        latencies, correct, answered = [], 0, 0
+        for topic, question, answer in rng.sample(pairs, QUERIES):
+            reworded = f"can you explain {topic[2]} and the {topic[1]} {topic[0]} to me"
+            start = time.perf_counter()
+            reply = fallback.lookup(reworded)
+            latencies.append((time.perf_counter() - start) * 1000)
+            answered += reply is not None
+            correct += reply == fallback.PREFIX + answer
+        latencies.sort()
+        print(f"lookup     p50 {statistics.median(latencies):.2f}ms   p95 {latencies[int(len(latencies) * 0.95)]:.2f}ms")
+        print(f"reworded   {correct / QUERIES:.1%} got their own answer, {answered / QUERIES:.1%} got one")
+
+        start = time.perf_counter()
+        unrelated = sum(fallback.lookup(f"what is {rng.choice(FILLER)} {word}zz about") is not None
+                        for word in rng.sample(VOCAB, QUERIES))
+        miss_ms = (time.perf_counter() - start) * 1000 / QUERIES
+        single = sum(fallback.lookup(f"tell me about {topic[0]} homework") is not None
+                     for topic, _, _ in rng.sample(pairs, QUERIES))
+        print(f"unrelated  {unrelated / QUERIES:.1%} answered   one shared word {single / QUERIES:.1%} answered   "
+              f"unrelated avg {miss_ms:.2f}ms")
+        print(f"stats      {fallback.stats()}")
+        conn.close()
+        tutorly.get_db_pool().close_all()
+
+if __name__ == '__main__':
+    main()
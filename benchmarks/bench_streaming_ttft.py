@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark: time-to-first-token for POST /api/chat/<id>/ai vs. /api/chat/<id>/ai/stream.
+
+The mock upstream waits BENCH_FIRST_TOKEN_MS before the first chunk and
+BENCH_CHUNK_MS between chunks, roughly like a real model generating text.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Admission control would shed this benchmark's repeated requests
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 10))
+FIRST_TOKEN_MS = float(os.environ.get('BENCH_FIRST_TOKEN_MS', 150))
+CHUNK_MS = float(os.environ.get('BENCH_CHUNK_MS', 40))
+REPLY = ' '.join(f'word{i}' for i in range(200))
+
+def measure(client, path):
+    """Return (ms until the first body bytes, ms until the body is complete)"""
+    start = time.perf_counter()
+    response = client.post(path, json={'message': 'Explain photosynthesis'}, buffered=False)
+    first = None
+    for _ in response.response:
+        if first is None:
+            first = time.perf_counter()
+    end = time.perf_counter()
+    response.close()
+    return (first - start) * 1000, (end - start) * 1000
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_ms=FIRST_TOKEN_MS,
+                              chunk_delay_ms=CHUNK_MS, reply=REPLY).start()
+    chunks = -(-len(REPLY.split(' ')) // server.words_per_chunk)
+    # Non-streaming replies arrive only once the whole text is "generated"
+    server_latency = FIRST_TOKEN_MS + CHUNK_MS * (chunks - 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        os.environ['GEMINI_API_KEY'] = 'bench'
+        original_init = tutorly.GeminiService.__init__
+
+        def init(self, api_key, *args, **kwargs):
+            original_init(self, api_key, *args, **kwargs)
+            self.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+        tutorly.GeminiService.__init__ = init
+
+        client = tutorly.app.test_client()
+        print(f"mock upstream: first token {FIRST_TOKEN_MS:.0f} ms, {chunks} chunks every {CHUNK_MS:.0f} ms")
+        print(f"{'route':<10} {'ttft p50':>9} {'total p50':>10}")
+        for label, path in [('blocking', '/api/chat/S1/ai'), ('stream', '/api/chat/S1/ai/stream')]:
+            server.latency_ms = server_latency if label == 'blocking' else FIRST_TOKEN_MS
+            samples = [measure(client, path) for _ in range(ROUNDS)]
+            ttft = statistics.median(s[0] for s in samples)
+            total = statistics.median(s[1] for s in samples)
+            print(f"{label:<10} {ttft:>7.1f}ms {total:>8.1f}ms")
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: detect_subject on short questions and long pasted essays.
+
+Compares the compiled, weighted classifier with the substring keyword
+scan it replaced (legacy_detect_subject in check_subject_classifier.py).
+Short questions are the labeled set; the essays are BENCH_ESSAY_WORDS
+words of prose drawn from about 800 distinct words, with and without
+subject keywords. The keyword-free case is the legacy scan's worst case,
+because it has to run every substring search. The legacy scan's cost
+grows with the number of terms, so the last case repeats the keyword-free
+essay with BENCH_EXTRA_SUBJECTS more subjects of 50 terms each (a scan of
+the same shape stands in for the legacy code).
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+from check_subject_classifier import LABELED, legacy_detect_subject
+from subject_classifier import DEFAULT_VOCABULARY, SubjectClassifier, merge_vocabulary
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 200))
+ESSAY_WORDS = int(os.environ.get('BENCH_ESSAY_WORDS', 2000))
+EXTRA_SUBJECTS = int(os.environ.get('BENCH_EXTRA_SUBJECTS', 6))
+
+rng = random.Random(5)
+LETTERS = 'etaoinshrdlucmfwyp'
+
+def pseudo_word(length):
+    return ''.join(rng.choice(LETTERS) for _ in range(length))
+
+COMMON = ('the of and to in that was his her it with for as on at by from they we our this had were '
+          'people city river summer years family walked remembered between during across towards').split()
+PROSE = COMMON * 10 + [pseudo_word(rng.randint(4, 9)) for _ in range(800)]
+
+def essay(keywords=()):
+    words = [rng.choice(PROSE) + rng.choice(('', '', '', ',', '.')) for _ in range(ESSAY_WORDS)]
+    for keyword in keywords:
+        words[rng.randrange(len(words))] = keyword
+    return ' '.join(words).capitalize() + '.'
+
+def best_us(classify, messages):
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for message in messages:
+                classify(message)
+        best = min(best, (time.perf_counter() - start) / (ROUNDS * len(messages)) * 1e6)
+    return best
+
+def scan(vocabulary):
+    """A legacy-style substring scan over any vocabulary"""
+    lists = [(subject, [term.rstrip('*') for term in terms]) for subject, terms in vocabulary.items()]
+
+    def classify(message):
+        message_lower = message.lower()
+        for subject, terms in lists:
+            if any(term in message_lower for term in terms):
+                return subject
+        return 'general'
+    return classify
+
+def main():
+    cases = {
+        'short questions': [message for message, _ in LABELED],
+        'essay, no keywords': [essay()],
+        'essay, 20 keywords': [essay(['theme', 'character', 'novel', 'author', 'energy'] * 4)],
+    }
+    tutorly.detect_subject('warm up')
+    for label, messages in cases.items():
+        new, old = best_us(tutorly.detect_subject, messages), best_us(legacy_detect_subject, messages)
+        print(f"{label:<22} classifier {new:>8.2f}us   legacy scan {old:>8.2f}us   ({new / old:.2f}x)")
+
+    extra = {f'subject{i}': {pseudo_word(10): 2 for _ in range(50)} for i in range(EXTRA_SUBJECTS)}
+    vocabulary = merge_vocabulary(DEFAULT_VOCABULARY, extra)
+    terms = sum(len(v) for v in vocabulary.values())
+    messages = cases['essay, no keywords']
+    new, old = best_us(SubjectClassifier(vocabulary).classify, messages), best_us(scan(vocabulary), messages)
+    print(f"{'essay, ' + str(terms) + ' terms':<22} classifier {new:>8.2f}us   legacy scan {old:>8.2f}us   "
+          f"({new / old:.2f}x)")
+
+if __name__ == '__main__':
+    main()
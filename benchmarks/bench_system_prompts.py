@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark: full system prompt vs. core + one subject section.
+
+Sends questions from every subject through GeminiService against the
+mock upstream, first with SYSTEM_PROMPT_MODULES=off and then on. The
+context cache is off, so the prompt travels inline. That is the usual
+case for a prompt this size, because Gemini won't cache one below its
+minimum cacheable size. The mock adds BENCH_MS_PER_KB of delay per KB of
+prompt, standing in for prefill time. Reports request bytes, prompt
+tokens and latency per request, per subject and overall.
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['GEMINI_CONTEXT_CACHE'] = 'off'
+os.environ['MODEL_ROUTING'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+
+import app as tutorly
+from check_subject_classifier import LABELED
+from context_builder import estimate_tokens
+from mock_gemini import MockGeminiServer
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 3))
+MS_PER_KB = float(os.environ.get('BENCH_MS_PER_KB', 10))
+
+def run(server, label):
+    os.environ['SYSTEM_PROMPT_MODULES'] = label
+    tutorly._system_prompts = None
+    rows = {}
+    for _ in range(ROUNDS):
+        for message, subject in LABELED:
+            service = tutorly.GeminiService('bench')
+            start = time.perf_counter()
+            service.generate_response(message, [])
+            elapsed = (time.perf_counter() - start) * 1000
+            payload = server.last_payload
+            rows.setdefault(subject, []).append(
+                (len(json.dumps(payload)), estimate_tokens(server.prompt_text(payload)), elapsed))
+    return rows
+
+def summarize(rows):
+    return tuple(statistics.mean(row[i] for row in rows) for i in range(3))
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_per_kb_ms=MS_PER_KB).start()
+    os.environ['GEMINI_BASE_URL'] = f'{server.base_url}/v1beta'
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        results = {label: run(server, label) for label in ('off', 'on')}
+        print(f"{'':<10} {'full prompt':>30}   {'core + subject section':>30}")
+        subjects = list(results['off']) + ['all']
+        for subject in subjects:
+            cells = []
+            for label in ('off', 'on'):
+                rows = results[label].get(subject) or [row for rows in results[label].values() for row in rows]
+                size, tokens, ms = summarize(rows)
+                cells.append(f"{size:>7.0f} B {tokens:>5.0f} tok {ms:>7.1f}ms")
+            print(f"{subject:<10} {cells[0]:>30}   {cells[1]:>30}")
+        print(f"\nsystemPrompt: {tutorly.get_system_prompts().stats()}")
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-call requests.post vs. the shared keep-alive UpstreamClient.
+
+Runs against a local mock Gemini server over TLS (self-signed cert via the
+openssl CLI) so each new connection pays a real TCP+TLS handshake. Falls
+back to plain HTTP when openssl is not available.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from mock_gemini import MockGeminiServer
+from upstream import UpstreamClient
+
+CALLS = int(os.environ.get('BENCH_CALLS', 300))
+THREADS = int(os.environ.get('BENCH_THREADS', 8))
+PAYLOAD = {'contents': [{'parts': [{'text': 'Explain photosynthesis'}]}]}
+
+def make_cert(directory):
+    if not shutil.which('openssl'):
+        return None, None
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', key, '-out', cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+def run(label, server, post):
+    url = f"{server.base_url}/v1beta/models/gemini-2.0-flash-exp:generateContent?key=bench"
+    connections_before = server.connections
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        for response in pool.map(lambda _: post(url, json=PAYLOAD), range(CALLS)):
+            assert response.status_code == 200
+    elapsed = time.perf_counter() - start
+    opened = server.connections - connections_before
+    print(f"{label:<8} {CALLS / elapsed:>9.1f} calls/s  {elapsed / CALLS * 1000 * THREADS:>7.2f} ms/call  "
+          f"{opened:>5} connections")
+    return elapsed
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_cert(tmp)
+        server = MockGeminiServer(('127.0.0.1', 0), certfile=cert, keyfile=key).start()
+        verify = cert if cert else True
+        print(f"mock upstream: {server.base_url} ({CALLS} calls, {THREADS} threads)")
+
+        legacy = run('legacy', server, lambda url, **kw: requests.post(url, timeout=30, verify=verify, **kw))
+        client = UpstreamClient(pool_size=THREADS, verify=verify)
+        pooled = run('pooled', server, client.post)
+        print(f"speedup  {legacy / pooled:.2f}x")
+        print(f"stats    {client.stats()}")
+
+        client.close()
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
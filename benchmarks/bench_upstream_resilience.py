@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: circuit breaker, retry budget and hedging against a misbehaving mock upstream.
+
+  outage    every call stalls past the read timeout. Without a breaker,
+            each request waits the full timeout. With one, requests fall
+            back in well under a millisecond once it opens.
+  flaky     BENCH_FAIL_RATE of calls return 503. Budgeted retries recover
+            most of them.
+  tail      BENCH_SLOW_RATE of calls stall BENCH_SLOW_MS. Hedging after the
+            p95 delay cuts the p99.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['GEMINI_CONTEXT_CACHE'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+from upstream import CircuitBreaker, RetryBudget, UpstreamClient, UpstreamPolicy
+
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', 200))
+FAIL_RATE = float(os.environ.get('BENCH_FAIL_RATE', 0.2))
+SLOW_RATE = float(os.environ.get('BENCH_SLOW_RATE', 0.03))
+SLOW_MS = float(os.environ.get('BENCH_SLOW_MS', 400))
+
+def run(server, client, policy, rounds):
+    service = tutorly.GeminiService('bench', client=client, policy=policy)
+    service.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+    latencies, ok = [], 0
+    for i in range(rounds):
+        start = time.perf_counter()
+        reply = service.generate_response(f"Explain idea {i}")
+        latencies.append((time.perf_counter() - start) * 1000)
+        ok += reply == server.reply
+    latencies.sort()
+    return ok, latencies
+
+def report(label, ok, latencies, extra=''):
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    print(f"{label:<26} ok {ok:>4}/{len(latencies):<4} p50 {p(0.5):>7.1f}ms p99 {p(0.99):>7.1f}ms "
+          f"mean {statistics.mean(latencies):>7.1f}ms {extra}")
+
+def no_policy():
+    return UpstreamPolicy(breaker=CircuitBreaker(min_requests=10 ** 9), max_attempts=1)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+
+        # Outage: the upstream hangs past a 0.5s read timeout
+        outage = MockGeminiServer(('127.0.0.1', 0), slow_rate=1.0, slow_ms=1000).start()
+        client = UpstreamClient(read_timeout=0.5)
+        report('outage, no breaker', *run(outage, client, no_policy(), 20))
+        policy = UpstreamPolicy(breaker=CircuitBreaker(min_requests=5, open_seconds=60))
+        report('outage, breaker', *run(outage, client, policy, ROUNDS),
+               f"transitions {policy.breaker.stats()['transitions']}")
+
+        # Flaky: a fraction of calls return 503
+        flaky = MockGeminiServer(('127.0.0.1', 0), fail_rate=FAIL_RATE).start()
+        client = UpstreamClient()
+        report(f'flaky {FAIL_RATE:.0%}, no retries', *run(flaky, client, no_policy(), ROUNDS))
+        policy = UpstreamPolicy(breaker=CircuitBreaker(failure_rate=0.9), budget=RetryBudget(ratio=0.5),
+                                backoff_base=0.01)
+        report(f'flaky {FAIL_RATE:.0%}, retries', *run(flaky, client, policy, ROUNDS),
+               f"retries {policy.retries}, budget exhausted {policy.budget.exhausted}")
+
+        # Tail: a few calls stall
+        tail = MockGeminiServer(('127.0.0.1', 0), latency_ms=10, slow_rate=SLOW_RATE, slow_ms=SLOW_MS).start()
+        report('tail, no hedging', *run(tail, client, no_policy(), ROUNDS))
+        policy = UpstreamPolicy(hedge=True, budget=RetryBudget(ratio=0.1))
+        report('tail, hedging', *run(tail, client, policy, ROUNDS),
+               f"hedges {policy.hedges}, wins {policy.hedge_wins}")
+        policy.shutdown()
+
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+        for server in (outage, flaky, tail):
+            server.shutdown()
+
+if __name__ == '__main__':
+    main()
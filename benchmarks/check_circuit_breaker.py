@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Recovery check for the upstream circuit breaker.
+
+Opens the breaker with failing calls, lets it go half-open, and makes the
+probe raise an exception that isn't a requests error (a ValueError, as a
+bad reply body or a bug in send() would). The breaker must reopen and,
+after open_seconds, let a new probe through that closes it again. Also
+runs the same probe through a successful call and a 503. Exits non-zero
+on failure.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream import CircuitBreaker, CircuitOpen, RetryBudget, UpstreamPolicy
+
+OPEN_SECONDS = 0.05
+
+
+class Reply:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+def raise_value_error():
+    raise ValueError('unreadable reply')
+
+
+def half_open_policy():
+    """A policy whose breaker is open and ready for its half-open probe"""
+    breaker = CircuitBreaker(min_requests=2, open_seconds=OPEN_SECONDS)
+    policy = UpstreamPolicy(breaker=breaker, budget=RetryBudget(ratio=0, min_per_second=0), max_attempts=1)
+    for _ in range(2):
+        policy.call(lambda: Reply(503))
+    assert breaker.state == CircuitBreaker.OPEN, breaker.state
+    time.sleep(OPEN_SECONDS * 1.5)
+    return policy
+
+
+def probe(policy, send):
+    try:
+        policy.call(send)
+    except (ValueError, CircuitOpen):
+        pass
+    return policy.breaker.state
+
+
+def main():
+    failures = 0
+    cases = [
+        ('ValueError', raise_value_error, CircuitBreaker.OPEN),
+        ('503', lambda: Reply(503), CircuitBreaker.OPEN),
+        ('200', lambda: Reply(200), CircuitBreaker.CLOSED),
+    ]
+    for label, send, expected in cases:
+        policy = half_open_policy()
+        after_probe = probe(policy, send)
+        # Whatever the probe did, the breaker must let a later probe through
+        time.sleep(OPEN_SECONDS * 1.5)
+        recovered = probe(policy, lambda: Reply(200))
+        ok = after_probe == expected and recovered == CircuitBreaker.CLOSED
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} probe {label:<10} -> {after_probe:<9} then a good probe -> {recovered}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Check that the per-student queries in app.py are served by the hot-path indexes.
+
+Runs EXPLAIN QUERY PLAN against a freshly migrated database and exits non-zero
+if a query falls back to a table scan or a temporary sort.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+
+# (query, index expected in the plan) - keep in sync with the routes in app.py
+QUERIES = [
+    ('SELECT * FROM assignments WHERE student_id = ? ORDER BY due_date DESC',
+     'idx_assignments_student_due'),
+    ('SELECT status, COUNT(*) as count FROM assignments WHERE student_id = ? GROUP BY status',
+     'idx_assignments_student_status'),
+    ('SELECT subject, AVG(CASE WHEN score IS NOT NULL THEN score ELSE 0 END) as avg_score, '
+     'COUNT(*) as total_assignments FROM assignments WHERE student_id = ? GROUP BY subject',
+     'idx_assignments_student_subject'),
+    ('SELECT sender, message FROM chat_messages WHERE student_id = ? ORDER BY id DESC LIMIT 10',
+     'idx_chat_messages_student_id'),
+    ('SELECT id, sender, message, timestamp FROM chat_messages WHERE student_id = ? AND id < 1000 '
+     'ORDER BY id DESC LIMIT 51',
+     'idx_chat_messages_student_id'),
+    ('SELECT id, sender, message, timestamp FROM chat_messages WHERE student_id = ? AND id > 1000 '
+     'ORDER BY id ASC LIMIT 51',
+     'idx_chat_messages_student_id'),
+    ('SELECT subject, date, score FROM subject_performance WHERE student_id = ? ORDER BY date ASC',
+     'idx_subject_performance_student_date'),
+]
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'plans.db')
+        tutorly.init_database()
+        conn = tutorly.get_db_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        assert version == tutorly.SCHEMA_VERSION, version
+
+        for query, index in QUERIES:
+            plan = ' | '.join(row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', ('S1',)))
+            ok = index in plan and 'TEMP B-TREE' not in plan
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {index:<40} {plan}")
+
+        conn.close()
+        tutorly.get_db_pool().close_all()
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
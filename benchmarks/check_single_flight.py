@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for single-flight coalescing of identical AI requests.
+
+BENCH_STUDENTS students post the same question at the same moment (with
+different casing and spacing) to /api/chat/<id>/ai, and then again to
+/api/chat/<id>/ai/stream. The mock upstream is slow enough that all of
+them overlap. The check asserts that each wave makes exactly one upstream
+call, that every student gets the full answer, and that every student's
+turn is saved separately. Exits non-zero on failure.
+"""
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+os.environ['RATE_LIMIT_BACKEND'] = 'off'
+os.environ['SIMILAR_ANSWERS'] = 'off'
+os.environ['GEMINI_CONTEXT_CACHE'] = 'off'
+os.environ['CONVERSATION_SUMMARIES'] = 'off'
+os.environ['GEMINI_API_KEY'] = 'bench'
+os.environ.setdefault('GEMINI_GATEWAY_CONCURRENCY', '64')
+os.environ.setdefault('GEMINI_GATEWAY_QUEUE', '64')
+
+import app as tutorly
+from mock_gemini import MockGeminiServer
+
+STUDENTS = int(os.environ.get('BENCH_STUDENTS', 30))
+QUESTIONS = ['Solve x^2 + 5x + 6 = 0', 'solve  x^2 + 5x + 6 = 0?', 'SOLVE x^2 + 5x + 6 = 0']
+
+def wave(server, path, stream):
+    client = tutorly.app.test_client()
+    barrier = threading.Barrier(STUDENTS)
+    answers = [None] * STUDENTS
+
+    def student(i):
+        barrier.wait()
+        response = client.post(f'/api/chat/{path}-{i}/ai' + ('/stream' if stream else ''),
+                               json={'message': QUESTIONS[i % len(QUESTIONS)]})
+        if stream:
+            body = response.get_data(as_text=True)
+            answers[i] = body.rsplit('event: done', 1)[1]
+        else:
+            answers[i] = response.get_json()['response']
+
+    before = server.requests
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(STUDENTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return server.requests - before, answers
+
+def main():
+    server = MockGeminiServer(('127.0.0.1', 0), latency_ms=300).start()
+    original_init = tutorly.GeminiService.__init__
+
+    def init(self, api_key, *args, **kwargs):
+        original_init(self, api_key, *args, **kwargs)
+        self.base_url = f"{server.base_url}/v1beta/models/mock:generateContent"
+    tutorly.GeminiService.__init__ = init
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        tutorly.DATABASE = os.path.join(tmp, 'bench.db')
+        tutorly.init_database()
+        for label, stream in (('blocking', False), ('stream', True)):
+            calls, answers = wave(server, label, stream)
+            full = sum(1 for a in answers if a and server.reply.split('\n')[0] in a)
+            conn = tutorly.get_db_connection()
+            saved = conn.execute(
+                "SELECT COUNT(DISTINCT student_id), COUNT(*) FROM chat_messages WHERE student_id LIKE ?",
+                (f'{label}-%',)
+            ).fetchone()
+            conn.close()
+            ok = calls == 1 and full == STUDENTS and tuple(saved) == (STUDENTS, 2 * STUDENTS)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {label:<9} {STUDENTS} students -> {calls} upstream call(s), "
+                  f"{full} full answers, {saved[1]} messages saved for {saved[0]} students")
+        if tutorly.get_single_flight() is not None:
+            print(f"single flight: {tutorly.get_single_flight().stats()}")
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+    server.shutdown()
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Accuracy check for detect_subject on a labeled set of student messages.
+
+Prints each message the classifier gets wrong, then the accuracy of both
+the classifier and the keyword scan it replaced. Exits non-zero if the
+classifier gets any of the known-trap cases wrong (substring hits such as
+"cell" in "excellent", upper-case terms such as DNA, and keyword order),
+or if its accuracy drops below MIN_ACCURACY.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as tutorly
+
+MIN_ACCURACY = 0.9
+
+LABELED = [
+    ('How do I solve 2x + 3 = 11?', 'math'),
+    ('Can you help me with my algebra homework?', 'math'),
+    ('What is the derivative of x^3?', 'math'),
+    ('How do I find the area of a triangle with base 6 and height 4?', 'math'),
+    ('What is the probability of rolling two sixes?', 'math'),
+    ('Simplify the fraction 18/24', 'math'),
+    ('How do I factor this polynomial: x^2 + 5x + 6', 'math'),
+    ('Explain the quadratic formula', 'math'),
+    ('What is the slope of the line y = 3x - 2?', 'math'),
+    ('How do I graph a linear equation?', 'math'),
+    ('Calculate 15 percent of 80', 'math'),
+    ('What does the Pythagorean theorem say?', 'math'),
+    ('How does photosynthesis work?', 'science'),
+    ('What is DNA made of?', 'science'),
+    ('Explain the structure of an atom', 'science'),
+    ('What is the difference between mitosis and meiosis?', 'science'),
+    ('Why does gravity pull things down?', 'science'),
+    ('What happens in a chemical reaction between an acid and a base?', 'science'),
+    ('How do I write a hypothesis for my experiment?', 'science'),
+    ('What organelles are in a plant cell?', 'science'),
+    ('Describe the parts of an ecosystem', 'science'),
+    ('What is the velocity of a falling object after 2 seconds?', 'science'),
+    ('Help me with my physics lab report on acceleration', 'science'),
+    ('How do I write a thesis statement?', 'english'),
+    ('Is this sentence grammatically correct: me and him went home', 'english'),
+    ('What is a metaphor?', 'english'),
+    ('Can you help me analyze this poem by Robert Frost?', 'english'),
+    ('What is the main theme of the novel To Kill a Mockingbird?', 'english'),
+    ('How should I structure the paragraphs of my essay?', 'english'),
+    ('What is the difference between a noun and a verb?', 'english'),
+    ('Help me understand this Shakespeare play', 'english'),
+    ('Where do commas go? I always get punctuation wrong', 'english'),
+    ('Who is the author of Pride and Prejudice?', 'english'),
+    ('What caused the French Revolution?', 'history'),
+    ('Why did the Roman Empire fall?', 'history'),
+    ('Explain the causes of World War I', 'history'),
+    ('What were the main ideas of the Renaissance?', 'history'),
+    ('How did the thirteen colonies win independence?', 'history'),
+    ('Make a timeline of the Ming dynasty', 'history'),
+    ('Hi, can you help me study?', 'general'),
+    ('I have a test tomorrow and I am nervous', 'general'),
+    ('What should I do first tonight?', 'general'),
+    ('Thanks, that was really helpful!', 'general'),
+    ('Can you make me a study schedule for next week?', 'general'),
+    ('Who won the war of 1812?', 'history'),
+]
+
+# Each of these tripped the old substring scan
+TRAPS = [
+    ('That was an excellent explanation, thanks!', 'general'),         # "cell" in "excellent"
+    ('Is DNA found in every living thing?', 'science'),                  # upper-case keyword
+    ('Can you check the grammar of my lab report sentence?', 'english'),
+    ('I need to write an essay about the energy crisis and its causes', 'english'),
+    ('Write a short story about a character who loves math', 'math'),  # subject name outweighs story terms
+    ('My homework is about the history of Rome', 'history'),            # "story" in "history"
+    ('What is the theme of the poem about atoms?', 'english'),
+    ('How do I draw the graph of velocity against time in my physics lab?', 'science'),
+]
+
+
+def legacy_detect_subject(message):
+    """The substring keyword scan that detect_subject used to run, for comparison"""
+    message_lower = message.lower()
+    math_keywords = ['math', 'algebra', 'geometry', 'calculus', 'equation', 'solve', 'calculate', 'formula',
+                     'graph', 'derivative', 'integral', 'statistics', 'probability', 'triangle', 'circle',
+                     'polynomial']
+    science_keywords = ['science', 'biology', 'chemistry', 'physics', 'molecule', 'atom', 'cell', 'experiment',
+                        'hypothesis', 'chemical', 'force', 'energy', 'DNA', 'evolution', 'photosynthesis']
+    english_keywords = ['english', 'literature', 'essay', 'grammar', 'writing', 'poem', 'story', 'character',
+                        'theme', 'analysis', 'paragraph', 'sentence', 'novel', 'author']
+    if any(keyword in message_lower for keyword in math_keywords):
+        return 'math'
+    elif any(keyword in message_lower for keyword in science_keywords):
+        return 'science'
+    elif any(keyword in message_lower for keyword in english_keywords):
+        return 'english'
+    return 'general'
+
+
+def accuracy(classify, cases):
+    return sum(classify(message) == expected for message, expected in cases) / len(cases)
+
+
+def main():
+    failures = 0
+    for message, expected in TRAPS + LABELED:
+        got = tutorly.detect_subject(message)
+        if got != expected:
+            trap = (message, expected) in TRAPS
+            failures += trap
+            print(f"{'FAIL' if trap else 'miss'} {expected:>8} -> {got:<8} {message}")
+
+    cases = LABELED + TRAPS
+    new, old = accuracy(tutorly.detect_subject, cases), accuracy(legacy_detect_subject, cases)
+    print(f"classifier  {new:.1%} of {len(cases)}   traps {accuracy(tutorly.detect_subject, TRAPS):.0%}")
+    print(f"legacy scan {old:.1%} of {len(cases)}   traps {accuracy(legacy_detect_subject, TRAPS):.0%}")
+    if new < MIN_ACCURACY:
+        print(f"FAIL accuracy below {MIN_ACCURACY:.0%}")
+        failures += 1
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: Tutorly's reference performance benchmark.
+
+Drives a mix of real HTTP requests at a target rate and reports
+p50/p95/p99 latency per endpoint:
+
+  login        POST /api/auth/login
+  assignments  GET  /api/assignments/<id>
+  chat         POST /api/chat/<id>/ai
+  chat_stream  POST /api/chat/<id>/ai/stream   (chat_stream_ttfb: first body byte)
+  chat_image   POST /api/chat/<id>/ai/image
+
+By default the script starts everything itself: a mock Gemini server
+(mock_gemini.py) and Tutorly on a temporary database, served by a threaded
+WSGI server and pointed at the mock through GEMINI_BASE_URL. With --url it
+loads an already running Tutorly instead (start that one with
+GEMINI_BASE_URL pointing at `python mock_gemini.py` to keep it offline).
+--record saves the upstream traffic of a run, and --replay serves a later
+run from that recording with its original timing (upstream_replay.py), so
+two builds can be compared against exactly the same upstream.
+
+    python benchmarks/loadtest.py --rps 10 --duration 30
+    python benchmarks/loadtest.py --mix chat=1 --latency-ms 800 --latency-dist lognormal
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --rps 50 --json results.json
+    python benchmarks/loadtest.py --record day.jsonl.gz && python benchmarks/loadtest.py --replay day.jsonl.gz
+
+Arrivals are open-loop (Poisson by default): each request is sent at its
+scheduled time whether or not earlier ones have finished, and latency is
+counted from that scheduled time. A slow server therefore shows up as
+latency instead of quietly lowering the offered load. Students are logged
+in before the measured run. Chat questions carry random numbers, so the
+response cache and near-duplicate matching mostly miss, as with real
+traffic. Admission control stays on unless the environment turns it off,
+and shed AI requests are counted separately from errors.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_gemini import LATENCY_DISTRIBUTIONS, MockGeminiServer
+
+ENDPOINTS = ('login', 'assignments', 'chat', 'chat_stream', 'chat_image')
+DEFAULT_MIX = 'login=1,assignments=4,chat=3,chat_stream=1,chat_image=1'
+QUESTIONS = [
+    'How do I solve {a}x + {b} = {c}?',
+    'Can you explain why the area of a {a} by {b} rectangle is {c}?',
+    'What is the next step to factor x^2 + {a}x + {b}?',
+    'Why does a {a} kg object fall at the same speed as a {b} kg one?',
+    'Help me outline an essay about event {a} of chapter {b}',
+]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def make_image():
+    """A small PNG for the image chat endpoint"""
+    from PIL import Image, ImageDraw
+    img = Image.new('RGB', (320, 240), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.line((20, 200, 300, 40), fill='black', width=3)
+    draw.text((30, 30), 'y = 2x + 1', fill='black')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+
+class LoadTest:
+    """Sends the request mix and collects per-endpoint results"""
+
+    def __init__(self, base_url, students, mix, seed=1):
+        self.base_url = base_url.rstrip('/')
+        self.students = [f'LT{i:05d}' for i in range(students)]
+        self.mix = mix
+        self.rng = random.Random(seed)
+        self.image = make_image() if 'chat_image' in mix else None
+        self.results = {name: [] for name in ENDPOINTS + ('chat_stream_ttfb',)}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.shed = {name: 0 for name in ENDPOINTS}
+        self.error_samples = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _question(self, rng):
+        return rng.choice(QUESTIONS).format(a=rng.randint(2, 99), b=rng.randint(2, 99), c=rng.randint(2, 999))
+
+    def login_all(self, workers=16):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for response in pool.map(self._login, self.students):
+                response.raise_for_status()
+
+    def _login(self, student):
+        return self._session().post(f'{self.base_url}/api/auth/login',
+                                    json={'name': f'Student {student}', 'studentId': student}, timeout=30)
+
+    def _send(self, endpoint, student, message):
+        """Send one request; returns (shed, ms to first byte or None)"""
+        session, url = self._session(), self.base_url
+        if endpoint == 'login':
+            response = self._login(student)
+        elif endpoint == 'assignments':
+            response = session.get(f'{url}/api/assignments/{student}', timeout=30)
+        elif endpoint == 'chat':
+            response = session.post(f'{url}/api/chat/{student}/ai', json={'message': message}, timeout=120)
+        elif endpoint == 'chat_image':
+            response = session.post(f'{url}/api/chat/{student}/ai/image', data={'message': message},
+                                    files={'image': ('graph.png', self.image, 'image/png')}, timeout=120)
+        else:
+            start = time.perf_counter()
+            response = session.post(f'{url}/api/chat/{student}/ai/stream', json={'message': message},
+                                    timeout=120, stream=True)
+            first, body = None, []
+            with response:
+                for chunk in response.iter_content(chunk_size=None):
+                    if first is None:
+                        first = (time.perf_counter() - start) * 1000
+                    body.append(chunk)
+            response.raise_for_status()
+            if b'event: error' in b''.join(body):
+                raise RuntimeError('stream interrupted')
+            done = b''.join(body).rsplit(b'event: done', 1)[-1]
+            return b'"shed"' in done, first
+        response.raise_for_status()
+        shed = endpoint != 'assignments' and endpoint != 'login' and 'shed' in response.json()
+        return shed, None
+
+    def _run_one(self, endpoint, student, message, scheduled):
+        # Latency counts from the scheduled start, so client-side queueing is included
+        lag = (time.perf_counter() - scheduled) * 1000
+        try:
+            shed, first = self._send(endpoint, student, message)
+        except Exception as e:
+            with self._lock:
+                self.errors[endpoint] += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(f'{endpoint}: {e}')
+            return
+        elapsed = (time.perf_counter() - scheduled) * 1000
+        with self._lock:
+            if shed:
+                self.shed[endpoint] += 1
+                return
+            self.results[endpoint].append(elapsed)
+            if first is not None:
+                self.results['chat_stream_ttfb'].append(lag + first)
+
+    def run(self, rps, duration, arrival='poisson', max_inflight=512):
+        names, weights = zip(*self.mix.items())
+        pool = ThreadPoolExecutor(max_workers=max_inflight)
+        start = time.perf_counter()
+        scheduled = start
+        sent = 0
+        while True:
+            scheduled += self.rng.expovariate(rps) if arrival == 'poisson' else 1.0 / rps
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = self.rng.choices(names, weights)[0]
+            pool.submit(self._run_one, endpoint, self.rng.choice(self.students),
+                        self._question(self.rng), scheduled)
+            sent += 1
+        pool.shutdown(wait=True)
+        return sent, time.perf_counter() - start
+
+    def report(self, sent, duration, elapsed):
+        rows = {}
+        for name, latencies in self.results.items():
+            base = 'chat_stream' if name == 'chat_stream_ttfb' else name
+            if base not in self.mix:
+                continue
+            latencies = sorted(latencies)
+            rows[name] = {
+                'ok': len(latencies),
+                'shed': self.shed.get(name, 0),
+                'errors': self.errors.get(name, 0),
+                'rps': len(latencies) / duration,
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': latencies[-1] if latencies else None,
+            }
+        return {'sent': sent, 'duration_s': duration, 'elapsed_s': elapsed, 'endpoints': rows}
+
+
+def print_report(summary):
+    fmt = lambda v: f'{v:>9.1f}' if v is not None else f"{'-':>9}"
+    print(f"{'endpoint':<17} {'ok':>6} {'shed':>5} {'errors':>6} {'rps':>6} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in summary['endpoints'].items():
+        print(f"{name:<17} {row['ok']:>6} {row['shed']:>5} {row['errors']:>6} {row['rps']:>6.1f} "
+              f"{fmt(row['p50_ms'])} {fmt(row['p95_ms'])} {fmt(row['p99_ms'])} {fmt(row['max_ms'])}")
+    print(f"sent {summary['sent']} requests in {summary['duration_s']:g}s "
+          f"({summary['sent'] / summary['duration_s']:.1f}/s offered); "
+          f"last reply after {summary['elapsed_s']:.1f}s")
+
+
+def start_local(args, tmp):
+    """Start the mock upstream (unless replaying) and an in-process Tutorly; returns (base_url, mock, shutdown)"""
+    mock = None
+    if args.replay:
+        os.environ['GEMINI_REPLAY'] = args.replay
+        os.environ['GEMINI_REPLAY_SPEED'] = str(args.replay_speed)
+    else:
+        mock = MockGeminiServer(('127.0.0.1', 0), latency_ms=args.latency_ms, latency_dist=args.latency_dist,
+                                latency_spread=args.latency_spread, tokens_per_second=args.tokens_per_second,
+                                reply_tokens=args.reply_tokens, fail_rate=args.fail_rate,
+                                rate_limit_rate=args.rate_limit_rate).start()
+        os.environ['GEMINI_BASE_URL'] = f'{mock.base_url}/v1beta'
+        if args.record:
+            os.environ['GEMINI_RECORD'] = args.record
+    os.environ.setdefault('GEMINI_API_KEY', 'loadtest')
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app as tutorly
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    tutorly.DATABASE = os.path.join(tmp, 'loadtest.db')
+    tutorly.init_database()
+    server = make_server('127.0.0.1', 0, tutorly.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def shutdown():
+        server.shutdown()
+        summarizer = tutorly.get_conversation_summarizer()
+        if summarizer is not None:
+            summarizer.stop()
+        tutorly.get_chat_writer().stop()
+        tutorly.get_db_pool().close_all()
+        tutorly.get_upstream_client().close()
+        if mock:
+            mock.shutdown()
+    return f'http://127.0.0.1:{server.server_port}', mock, shutdown
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tutorly end-to-end load test')
+    parser.add_argument('--url', help='load a running Tutorly at this URL instead of starting one')
+    parser.add_argument('--rps', type=float, default=10, help='offered requests per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of measured load')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'endpoint weights (default {DEFAULT_MIX})')
+    parser.add_argument('--arrival', choices=('poisson', 'constant'), default='poisson')
+    parser.add_argument('--max-inflight', type=int, default=512, help='client threads')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--record', help='record the upstream traffic to this file (.gz to compress)')
+    parser.add_argument('--replay', help='answer upstream calls from this recording instead of the mock')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help='replay timing multiplier (0 = no upstream delays)')
+    mock_args = parser.add_argument_group('mock upstream (ignored with --url or --replay)')
+    mock_args.add_argument('--latency-ms', type=float, default=400, help='time to first token')
+    mock_args.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='lognormal')
+    mock_args.add_argument('--latency-spread', type=float, default=0.5)
+    mock_args.add_argument('--tokens-per-second', type=float, default=200)
+    mock_args.add_argument('--reply-tokens', type=int, default=150)
+    mock_args.add_argument('--fail-rate', type=float, default=0.0, help='fraction answered with 503')
+    mock_args.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction answered with 429')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mock, shutdown = None, None
+        base_url = args.url
+        if base_url is None:
+            base_url, mock, shutdown = start_local(args, tmp)
+            if args.replay:
+                print(f"upstream: replaying {args.replay} at {args.replay_speed:g}x")
+            else:
+                print(f"mock upstream: {args.latency_ms:g} ms {args.latency_dist} to first token, "
+                      f"{args.tokens_per_second:g} tokens/s, {args.reply_tokens} token replies, "
+                      f"{args.fail_rate:.0%} 503 + {args.rate_limit_rate:.0%} 429")
+        print(f"target {base_url}: {args.rps:g} req/s {args.arrival} for {args.duration:g}s, "
+              f"{args.students} students, mix {args.mix}")
+
+        test = LoadTest(base_url, args.students, args.mix, seed=args.seed)
+        test.login_all()
+        upstream_before = mock.requests if mock else 0
+        sent, elapsed = test.run(args.rps, args.duration, args.arrival, args.max_inflight)
+        summary = test.report(sent, args.duration, elapsed)
+        print_report(summary)
+        if mock:
+            summary['upstream_requests'] = mock.requests - upstream_before
+            print(f"upstream requests: {summary['upstream_requests']} ({mock.failures} injected failures)")
+        if args.url is None:
+            import app as tutorly
+            client_stats = tutorly.get_upstream_client().stats()
+            for key in ('recording', 'replay'):
+                if key in client_stats:
+                    summary[key] = client_stats[key]
+                    print(f"{key}: {client_stats[key]}")
+        for sample in test.error_samples:
+            print(f"error: {sample}")
+        if args.json:
+            summary['config'] = {k: v for k, v in vars(args).items() if k != 'json'}
+            with open(args.json, 'w') as f:
+                json.dump(summary, f, indent=2)
+        if shutdown:
+            shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+BM25 full-text index with an on-disk, memory-mapped base segment.
+
+Documents are added to an in-memory delta segment. save() merges the
+delta into the base and writes it to one compact file. The file holds
+document ids and lengths plus one postings list of (document, term
+frequency) pairs per term, all as packed little-endian integers. It is
+written to a temporary file and renamed into place. At startup, load()
+memory-maps the file. Only the term dictionary is read into memory. The
+postings stay in the page cache and are read in place, so a large index
+opens in milliseconds and worker processes share the same pages.
+
+search() scores base and delta together with the usual BM25 formula.
+For every hit it also reports the share of the query's IDF weight that
+the document covers. Callers can then reject results that matched only
+the query's less specific words.
+
+add() and save() must be called from one thread at a time; search() is
+safe to call concurrently with either.
+"""
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+from neardup import STOPWORDS
+
+_MAGIC = b'TBM25v1\n'
+_WORD = re.compile(r'[^\W_]+')
+# The file is little-endian; arrays are swapped on big-endian hosts
+_SWAP = sys.byteorder != 'little'
+
+
+def tokenize(text):
+    """Casefolded word tokens without stopwords, with a plural 's' stripped"""
+    tokens = []
+    for token in _WORD.findall(unicodedata.normalize('NFKC', text or '').casefold()):
+        if token in STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _pad(size):
+    return -size % 8
+
+
+def _tf_in_flat(postings, doc):
+    """Term frequency of doc in a flat (doc, tf) postings sequence sorted by doc, or 0"""
+    lo, hi = 0, len(postings) // 2
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if postings[mid * 2] < doc:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(postings) // 2 and postings[lo * 2] == doc:
+        return postings[lo * 2 + 1]
+    return 0
+
+
+def _tf_in_pairs(pairs, doc):
+    """Term frequency of doc in a list of (doc, tf) tuples sorted by doc, or 0"""
+    i = bisect.bisect_left(pairs, (doc,))
+    if i < len(pairs) and pairs[i][0] == doc:
+        return pairs[i][1]
+    return 0
+
+
+class _Segment:
+    """Read-only base segment backed by a memory-mapped index file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mtime = os.stat(path).st_mtime_ns
+        view = memoryview(self._map)
+        if bytes(view[:len(_MAGIC)]) != _MAGIC:
+            raise ValueError(f"{path} is not a BM25 index file")
+        header_size, = struct.unpack_from('<I', view, len(_MAGIC))
+        offset = len(_MAGIC) + 4
+        self.meta = json.loads(bytes(view[offset:offset + header_size]))
+        offset += header_size + _pad(header_size + len(_MAGIC) + 4)
+        docs, terms = self.meta['docs'], self.meta['terms']
+
+        def section(typecode, count):
+            nonlocal offset
+            size = count * array(typecode).itemsize
+            data = view[offset:offset + size].cast(typecode)
+            offset += size + _pad(size)
+            if _SWAP:
+                # Big-endian hosts get a swapped copy instead of the mapping
+                copy = array(typecode, data)
+                copy.byteswap()
+                return copy
+            return data
+
+        self.doc_ids = section('q', docs)
+        self.doc_lens = section('I', docs)
+        self.starts = section('I', terms + 1)
+        self.postings = section('I', self.meta['postings'] * 2)
+        vocabulary = bytes(view[offset:offset + self.meta['vocabulary_bytes']]).decode('utf-8')
+        self.terms = {term: i for i, term in enumerate(vocabulary.split('\n'))} if terms else {}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def postings_for(self, term):
+        """(doc index, tf) pairs for a term, as a flat read-only sequence"""
+        i = self.terms.get(term)
+        if i is None:
+            return ()
+        return self.postings[self.starts[i] * 2:self.starts[i + 1] * 2]
+
+
+class BM25Index:
+    """BM25 over an mmap'd base segment plus an in-memory delta of recent documents"""
+
+    def __init__(self, path=None, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.last_id = 0
+        self._base = None
+        self._reset_delta()
+        self._lock = threading.Lock()
+
+    def _reset_delta(self):
+        self._delta_ids = []
+        self._delta_lens = []
+        self._delta_postings = {}
+        self._delta_length = 0
+
+    def __len__(self):
+        return (len(self._base) if self._base else 0) + len(self._delta_ids)
+
+    @property
+    def pending(self):
+        """Documents added since the last save()"""
+        return len(self._delta_ids)
+
+    def load(self):
+        """Map the index file if there is one; drops unsaved documents. Returns True if loaded."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        segment = _Segment(self.path)
+        with self._lock:
+            self._base = segment
+            self.last_id = segment.meta['last_id']
+            self._reset_delta()
+        return True
+
+    def stale(self):
+        """True if another process has written a newer index file than the one mapped"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        return self._base is None or os.stat(self.path).st_mtime_ns != self._base.mtime
+
+    def add(self, doc_id, text, last_id=None):
+        """Index text under an integer doc_id; last_id records how far the source has been read"""
+        tokens = tokenize(text)
+        if tokens:
+            counts = Counter(tokens)
+            with self._lock:
+                doc = len(self._delta_ids)
+                self._delta_ids.append(doc_id)
+                self._delta_lens.append(len(tokens))
+                self._delta_length += len(tokens)
+                for term, tf in counts.items():
+                    self._delta_postings.setdefault(term, []).append((doc, tf))
+        self.last_id = max(self.last_id, last_id if last_id is not None else doc_id)
+
+    def search(self, query, limit=1, min_coverage=0.0):
+        """Up to `limit` (doc_id, score, coverage) tuples, best first.
+
+        Documents whose coverage can't reach min_coverage are never scored.
+        Terms are visited rarest first; once the terms left can't add up to
+        min_coverage on their own, a common term only adds to documents
+        already found, looked up by binary search, instead of walking its
+        whole postings list.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            base, delta_ids, delta_lens = self._base, self._delta_ids, self._delta_lens
+            delta_postings = {term: list(self._delta_postings.get(term, ())) for term in terms}
+            delta_count = len(delta_ids)
+            delta_length = self._delta_length
+        count = (len(base) if base else 0) + delta_count
+        if not count:
+            return []
+        total_length = (base.meta['total_length'] if base else 0) + delta_length
+        avg_length = total_length / count
+        k1 = self.k1
+        # BM25 denominator: tf + k1 * (1 - b + b * length / avg_length) = tf + fixed + per_token * length
+        fixed, per_token = k1 * (1 - self.b), k1 * self.b / avg_length
+
+        weighted = []
+        query_weight = 0.0
+        for term in terms:
+            base_postings = base.postings_for(term) if base else ()
+            df = len(base_postings) // 2 + len(delta_postings[term])
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            query_weight += idf
+            if df:
+                weighted.append((idf, base_postings, delta_postings[term]))
+        weighted.sort(key=lambda item: -item[0])
+        remaining = sum(idf for idf, _, _ in weighted)
+        needed = min_coverage * query_weight
+
+        scores = {}
+        for idf, base_postings, term_delta in weighted:
+            open_ = remaining >= needed
+            remaining -= idf
+            if open_:
+                hits = [(('b', base_postings[i]), base_postings[i + 1]) for i in range(0, len(base_postings), 2)]
+                hits += [(('d', doc), tf) for doc, tf in term_delta]
+            else:
+                hits = []
+                for key in scores:
+                    tf = (_tf_in_flat(base_postings, key[1]) if key[0] == 'b'
+                          else _tf_in_pairs(term_delta, key[1]))
+                    if tf:
+                        hits.append((key, tf))
+            for key, tf in hits:
+                length = base.doc_lens[key[1]] if key[0] == 'b' else delta_lens[key[1]]
+                entry = scores.get(key)
+                if entry is None:
+                    entry = scores[key] = [0.0, 0.0]
+                entry[0] += idf * tf * (k1 + 1) / (tf + fixed + per_token * length)
+                entry[1] += idf
+        covered = (item for item in scores.items() if item[1][1] >= needed)
+        best = heapq.nlargest(limit, covered, key=lambda item: item[1][0])
+        return [(base.doc_ids[doc] if kind == 'b' else delta_ids[doc], score, matched / query_weight)
+                for (kind, doc), (score, matched) in best]
+
+    def save(self):
+        """Merge the delta into the base, write the index file atomically and map it"""
+        if not self.path:
+            return
+        base = self._base
+        doc_ids = array('q', base.doc_ids if base else ())
+        doc_lens = array('I', base.doc_lens if base else ())
+        offset = len(doc_ids)
+        doc_ids.extend(self._delta_ids)
+        doc_lens.extend(self._delta_lens)
+
+        base_terms = base.terms if base else {}
+        vocabulary = sorted(base_terms.keys() | self._delta_postings.keys())
+        starts = array('I', [0])
+        flat = array('I')
+        for term in vocabulary:
+            i = base_terms.get(term)
+            if i is not None:
+                chunk = base.postings[base.starts[i] * 2:base.starts[i + 1] * 2]
+                if isinstance(chunk, memoryview):
+                    flat.frombytes(chunk.tobytes())
+                else:
+                    flat.extend(chunk)
+            for doc, tf in self._delta_postings.get(term, ()):
+                flat.append(offset + doc)
+                flat.append(tf)
+            starts.append(len(flat) // 2)
+        vocabulary_bytes = '\n'.join(vocabulary).encode('utf-8')
+        header = json.dumps({
+            'docs': len(doc_ids), 'terms': len(vocabulary), 'postings': len(flat) // 2,
+            'total_length': sum(doc_lens), 'last_id': self.last_id,
+            'vocabulary_bytes': len(vocabulary_bytes),
+        }).encode('utf-8')
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<I', len(header)) + header)
+            f.write(bytes(_pad(len(_MAGIC) + 4 + len(header))))
+            for data in (doc_ids, doc_lens, starts, flat):
+                if _SWAP:
+                    data = array(data.typecode, data)
+                    data.byteswap()
+                raw = data.tobytes()
+                f.write(raw + bytes(_pad(len(raw))))
+            f.write(vocabulary_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        segment = _Segment(self.path)
+        with self._lock:
+            self._base = segment
+            self._reset_delta()
+
+    def stats(self):
+        base = self._base
+        return {
+            'documents': len(self),
+            'on_disk': len(base) if base else 0,
+            'pending': self.pending,
+            'terms': base.meta['terms'] if base else 0,
+            'file_bytes': len(base._map) if base else 0,
+            'last_id': self.last_id,
+        }
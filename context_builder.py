@@ -0,0 +1,127 @@
+"""
+Token-budgeted prompt assembly for tutoring turns.
+
+Instead of always sending the last N messages, the builder packs history
+newest-first until a token budget is used up. Very long messages (a
+pasted essay) are cut down to a per-message cap, keeping the start and
+the end, so one huge turn can't crowd out the rest of the conversation.
+A rolling conversation summary can be placed ahead of the history.
+Token counts are a local estimate. That is close enough for budgeting
+and avoids a countTokens round trip per request.
+"""
+import threading
+
+# Gemini bills an inline image of up to 384x384 px as a flat 258 tokens
+IMAGE_TOKENS = 258
+_TRUNCATION_MARK = "\n[...]\n"
+
+
+def estimate_tokens(text):
+    """Rough token count: about 4 bytes of UTF-8 per token"""
+    return (len((text or '').encode('utf-8')) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens, keeping its beginning and end"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Work in characters, scaled by this text's own bytes-per-character
+    ratio = len(text) / max(1, len(text.encode('utf-8')))
+    keep = max(0, int((max_tokens * 4 - len(_TRUNCATION_MARK)) * ratio))
+    head = keep * 2 // 3
+    tail = keep - head
+    return text[:head].rstrip() + _TRUNCATION_MARK + (text[-tail:].lstrip() if tail else '')
+
+
+class BuiltContext:
+    """The assembled conversation text plus how it was packed"""
+
+    __slots__ = ('text', 'prompt_tokens', 'history_turns', 'dropped_turns', 'truncated')
+
+    def __init__(self, text, prompt_tokens, history_turns, dropped_turns, truncated):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.history_turns = history_turns
+        self.dropped_turns = dropped_turns
+        self.truncated = truncated
+
+
+class ContextBuilder:
+    """Packs conversation history into a token budget, newest turns first"""
+
+    def __init__(self, budget_tokens=2000, max_message_tokens=400):
+        self.budget_tokens = budget_tokens
+        self.max_message_tokens = max_message_tokens
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.prompt_tokens_total = 0
+        self.prompt_tokens_max = 0
+        self.truncated_messages = 0
+        self.dropped_turns = 0
+
+    def build(self, message, history=None, image=False, summary=None):
+        """Assemble the contents text for one turn; history is oldest first.
+
+        A rolling conversation summary, if given, goes ahead of the history
+        and may use up to half of the budget.
+        """
+        truncated = 0
+        reserved = IMAGE_TOKENS if image else 0
+        # The student's own message always goes in, capped at the whole budget
+        current = truncate_to_tokens(message, max(1, self.budget_tokens - reserved))
+        if current is not message:
+            truncated += 1
+        tail = f"Student: {current}\n\nTutorly:"
+        used = reserved + estimate_tokens(tail)
+
+        preamble = ''
+        if summary:
+            summary = truncate_to_tokens(summary, self.budget_tokens // 2)
+            preamble = f"## Conversation Summary:\n{summary}\n\n"
+            used += estimate_tokens(preamble)
+
+        header = "## Previous Conversation:"
+        lines = []
+        history = history or []
+        if history:
+            used += estimate_tokens(header) + 1
+        for msg in reversed(history):
+            role = "Student" if msg['sender'] == 'user' else "Tutorly"
+            text = truncate_to_tokens(msg['message'], self.max_message_tokens)
+            line = f"{role}: {text}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.budget_tokens:
+                break
+            if text is not msg['message']:
+                truncated += 1
+            lines.append(line)
+            used += cost
+        dropped = len(history) - len(lines)
+
+        if lines:
+            lines.append(header)
+            lines.reverse()
+            text = preamble + "\n".join(lines) + "\n\n" + tail
+        else:
+            text = preamble + tail
+            used = reserved + estimate_tokens(text)
+
+        with self._lock:
+            self.builds += 1
+            self.prompt_tokens_total += used
+            self.prompt_tokens_max = max(self.prompt_tokens_max, used)
+            self.truncated_messages += truncated
+            self.dropped_turns += dropped
+        return BuiltContext(text, used, len(lines) - 1 if lines else 0, dropped, truncated)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget_tokens': self.budget_tokens,
+                'max_message_tokens': self.max_message_tokens,
+                'builds': self.builds,
+                'avg_prompt_tokens': self.prompt_tokens_total / self.builds if self.builds else 0.0,
+                'max_prompt_tokens': self.prompt_tokens_max,
+                'truncated_messages': self.truncated_messages,
+                'dropped_turns': self.dropped_turns,
+            }
@@ -0,0 +1,196 @@
+"""
+Image preparation for the image chat endpoint, off the request thread.
+
+prepare_image() turns an uploaded file into the base64 JPEG sent to
+Gemini. For a JPEG it first asks the decoder for a draft. libjpeg can
+decode at 1/2, 1/4 or 1/8 scale, and it picks the smallest scale that
+still covers the target size, so a 12 MP phone photo is decoded at about
+a quarter of its pixels. The resampling filter is chosen by how far the
+decoded image still has to shrink:
+
+- Up to LANCZOS_MAX_RATIO, which covers every drafted JPEG, it uses
+  LANCZOS. That is the sharpest filter, and it is cheap because the
+  source is small.
+- Beyond that ratio, for PNG, WebP and other formats that can't be
+  drafted, it box-reduces by an integer factor and finishes with BICUBIC.
+
+ImagePool runs prepare_image in worker processes, so decoding and
+resampling don't hold the web process's GIL while other requests wait.
+At most `workers + max_queue` images are in flight. A request that can't
+get a slot within `max_wait` seconds gets ImagePoolSaturated instead of
+queuing without bound, and one whose image isn't ready `max_seconds`
+after it was handed to the pool gets ImagePoolTimeout, a subclass, so a
+hung decode can't hold the request thread. With workers=0, images are prepared on the calling
+thread. Workers are started with 'spawn', so like any multiprocessing
+program the main module must keep its startup code under
+`if __name__ == '__main__':`.
+"""
+import base64
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+MAX_SIZE = (1024, 1024)
+JPEG_QUALITY = 85
+# Past this downscale ratio, box-reduce first and finish with BICUBIC instead of LANCZOS
+LANCZOS_MAX_RATIO = 2.5
+
+
+class ImagePoolSaturated(Exception):
+    """Every worker is busy and the queue stayed full for max_wait seconds"""
+
+
+class ImagePoolTimeout(ImagePoolSaturated):
+    """A worker didn't finish the image within max_seconds"""
+
+
+def prepare_image(data, max_size=MAX_SIZE, quality=JPEG_QUALITY):
+    """Decode, shrink to fit max_size and re-encode an image.
+
+    Returns (base64 JPEG, {'decode': s, 'resize': s, 'encode': s}).
+    Raises on data Pillow can't read.
+    """
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    ratio = max(width / max_size[0], height / max_size[1])
+    if ratio > 1:
+        # Only JPEG implements draft(); other formats ignore it
+        img.draft(None, (max(1, int(width / ratio)), max(1, int(height / ratio))))
+    img.load()
+    decoded = time.perf_counter()
+
+    # Convert to RGB if necessary (for PNG with transparency, etc.)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGB')
+    ratio = max(img.width / max_size[0], img.height / max_size[1])
+    if ratio > 1:
+        if ratio <= LANCZOS_MAX_RATIO:
+            img.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=None)
+        else:
+            img.thumbnail(max_size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    resized = time.perf_counter()
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    encoded = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return encoded, {
+        'decode': decoded - started,
+        'resize': resized - decoded,
+        'encode': time.perf_counter() - resized,
+    }
+
+
+class ImagePool:
+    """Bounded process pool for prepare_image, with backpressure"""
+
+    def __init__(self, workers=2, max_queue=4, max_wait=5.0, max_seconds=30.0, max_size=MAX_SIZE,
+                 quality=JPEG_QUALITY):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_seconds = max_seconds
+        self.max_size = max_size
+        self.quality = quality
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._restarts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the web process has threads and open sockets
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _restart(self, executor):
+        """Drop a pool whose worker died; the next call starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def prepare(self, data):
+        """(base64 JPEG, stage timings) for image bytes.
+
+        Raises ImagePoolSaturated when no slot frees up within max_wait,
+        ImagePoolTimeout when the worker takes longer than max_seconds, and
+        whatever prepare_image raised for unreadable data.
+        """
+        if not self.workers:
+            return self._track(prepare_image, data, self.max_size, self.quality)
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self._rejected += 1
+            raise ImagePoolSaturated()
+        try:
+            return self._track(self._run_in_pool, data)
+        finally:
+            self._slots.release()
+
+    def _run_in_pool(self, data):
+        executor = self._get_executor()
+        future = executor.submit(prepare_image, data, self.max_size, self.quality)
+        try:
+            return future.result(timeout=self.max_seconds)
+        except FutureTimeout:
+            # Dropped if it is still queued; a running decode finishes unobserved
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise ImagePoolTimeout() from None
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def _track(self, fn, *args):
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            result = fn(*args)
+        except BaseException:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self._completed += 1
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'restarts': self._restarts,
+            }
@@ -0,0 +1,199 @@
+"""
+In-process latency histograms and Prometheus text exposition.
+
+Hot paths time themselves with `registry.span(name, **labels)`, a context
+manager that costs two perf_counter() calls and one locked bucket
+increment. Histograms use fixed cumulative buckets, so memory stays
+constant however many observations are made. Collectors are callables
+that return nested stats dicts (the same ones /api/health shows). At
+scrape time their numeric leaves are exported as gauges.
+"""
+import bisect
+import re
+import threading
+import time
+
+# Seconds; spans range from sub-millisecond SQLite queries to multi-second upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["`\[]?(\w+)', re.IGNORECASE)
+_UNSAFE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _snake(name):
+    return _UNSAFE.sub('_', re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name)).lower()
+
+
+class Histogram:
+    """One labeled series: cumulative buckets plus sum and count"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # bisect_left: a value equal to a bound belongs in that bucket (le = "less or equal")
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullSpan:
+    """Stand-in for a span when metrics are off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """Named, labeled histograms and stats collectors, rendered in Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='tutorly'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._help = {}
+        self._series = {}
+        self._collectors = []
+        self._query_labels = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def histogram(self, name, **labels):
+        """The series for name and labels, created on first use"""
+        items = tuple(labels.items())
+        key = (name, items if len(items) < 2 else tuple(sorted(items)))
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, Histogram(self.buckets))
+        return series
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def span(self, name, **labels):
+        """Context manager that observes its own duration"""
+        return _Span(self.histogram(name, **labels))
+
+    def query_label(self, sql):
+        """Short, low-cardinality label for a SQL statement, e.g. 'select chat_messages'"""
+        label = self._query_labels.get(sql)
+        if label is None:
+            words = sql.split(None, 1)
+            verb = words[0].lower() if words else 'unknown'
+            match = _SQL_TABLE.search(sql)
+            label = f"{verb} {match.group(1)}" if match else verb
+            if len(self._query_labels) < 1000:
+                self._query_labels[sql] = label
+        return label
+
+    def observe_query(self, sql, seconds):
+        self.histogram(f'{self.prefix}_db_query_seconds', query=self.query_label(sql)).observe(seconds)
+
+    def add_collector(self, collect):
+        """collect() returns {component: stats dict}; numeric leaves become gauges at scrape time"""
+        self._collectors.append(collect)
+
+    def _flatten(self, name, value, out):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                self._flatten(f'{name}_{_snake(str(key))}', child, out)
+        elif isinstance(value, bool):
+            out.append((name, (), int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((name, (), value))
+        elif isinstance(value, str):
+            # Enumerations such as the breaker state: a 1-valued gauge labeled with the value
+            out.append((f'{name}_info', (('value', value),), 1))
+
+    def render(self):
+        """All series in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            series = sorted(self._series.items())
+        current = None
+        for (name, labels), histogram in series:
+            if name != current:
+                current = name
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", _format_value(bound)))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        gauges = []
+        for collect in self._collectors:
+            try:
+                stats = collect()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for component, values in stats.items():
+                if values is not None:
+                    self._flatten(f'{self.prefix}_{_snake(component)}', values, gauges)
+        seen = set()
+        for name, labels, value in gauges:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
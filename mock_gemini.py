@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini generateContent API, for offline testing and benchmarks.
+
+    python mock_gemini.py --port 8787 --latency-ms 800 --latency-dist lognormal \
+        --tokens-per-second 80 --fail-rate 0.01
+
+Run Tutorly with GEMINI_BASE_URL=http://127.0.0.1:8787/v1beta to use it
+(streamGenerateContent?alt=sse is served too, and so is a minimal
+cachedContents API: create, PATCH ttl, GET and DELETE).
+
+Latency is the time to the first token. It is fixed, or drawn from a
+uniform, exponential or lognormal distribution around --latency-ms. With
+--tokens-per-second, the reply is then generated at that rate, so long
+replies take longer and streamed chunks arrive paced like a real model.
+Replies are cut at the request's generationConfig.maxOutputTokens (with
+finishReason MAX_TOKENS), and --model-scale lite=0.4 makes every model
+whose name contains "lite" answer in 0.4x the time.
+"""
+import argparse
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_REPLY = (
+    "**Great question!** Let's work through it step by step.\n\n"
+    "- First, identify what you already know\n"
+    "- Then decide which idea applies here\n\n"
+    "What do you think the first step should be?"
+)
+
+FAULT_MESSAGES = {
+    429: 'Resource has been exhausted (e.g. check quota).',
+    503: 'The model is overloaded. Please try again later.',
+}
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+def estimate_tokens(text):
+    """About 4 bytes per token, like context_builder.estimate_tokens"""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+
+def make_reply(tokens):
+    """A reply of roughly `tokens` tokens, built from MOCK_REPLY"""
+    paragraphs = [MOCK_REPLY]
+    while estimate_tokens('\n\n'.join(paragraphs)) < tokens:
+        paragraphs.append(f"Step {len(paragraphs)}: check the result against what you know, "
+                          "then explain in your own words why it works.")
+    return '\n\n'.join(paragraphs)
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        return json.loads(raw or b'{}')
+
+    def do_POST(self):
+        server = self.server
+        payload = self._read_json()
+        server.record_request(self.path, payload)
+
+        if self.path.split('?', 1)[0].endswith('/cachedContents'):
+            self._create_cached_content(payload)
+            return
+        handle = payload.get('cachedContent')
+        if handle and handle not in server.cached_contents:
+            self._send_json(404, {'error': {'code': 404, 'message': f'{handle} not found'}})
+            return
+
+        status = server.inject_fault()
+        if status:
+            self._send_json(status, {'error': {'code': status, 'message': FAULT_MESSAGES[status]}})
+            return
+        server.input_delay(payload)
+        if ':streamGenerateContent' in self.path:
+            self._payload = payload
+            self._stream_sse()
+            return
+        if ':generateContent' not in self.path:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+
+        reply, finish_reason = server.reply_for(payload)
+        scale = server.model_speed(self.path)
+        time.sleep((server.sample_latency() + server.generation_time(reply)) * scale)
+        self._send_json(200, {
+            'candidates': [{
+                'content': {'parts': [{'text': reply}], 'role': 'model'},
+                'finishReason': finish_reason
+            }],
+            'usageMetadata': server.usage(payload, reply),
+        })
+
+    def _cached_content_name(self):
+        path = self.path.split('?', 1)[0]
+        return path[path.index('cachedContents/'):] if 'cachedContents/' in path else None
+
+    def _create_cached_content(self, payload):
+        server = self.server
+        if not server.context_cache:
+            self._send_json(400, {'error': {'code': 400, 'message': 'Cached content is too small'}})
+            return
+        with server._lock:
+            server.cached_content_seq += 1
+            name = f"cachedContents/mock-{server.cached_content_seq}"
+            server.cached_contents[name] = {
+                'name': name,
+                'model': payload.get('model'),
+                'systemInstruction': payload.get('systemInstruction'),
+                'ttl': payload.get('ttl'),
+            }
+        self._send_json(200, server.cached_contents[name])
+
+    def do_PATCH(self):
+        server = self.server
+        payload = self._read_json()
+        entry = server.cached_contents.get(self._cached_content_name())
+        if entry is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        entry['ttl'] = payload.get('ttl', entry['ttl'])
+        self._send_json(200, entry)
+
+    def do_GET(self):
+        entry = self.server.cached_contents.get(self._cached_content_name())
+        if entry is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        self._send_json(200, entry)
+
+    def do_DELETE(self):
+        if self.server.cached_contents.pop(self._cached_content_name(), None) is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        self._send_json(200, {})
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_sse(self):
+        """streamGenerateContent?alt=sse: one `data:` event per chunk of words"""
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        reply, finish_reason = server.reply_for(self._payload)
+        scale = server.model_speed(self.path)
+        time.sleep(server.sample_latency() * scale)
+        words = reply.split(' ')
+        for i in range(0, len(words), server.words_per_chunk):
+            text = ' '.join(words[i:i + server.words_per_chunk])
+            last = i + server.words_per_chunk >= len(words)
+            if not last:
+                text += ' '
+            if i and server.chunk_delay_ms:
+                time.sleep(server.chunk_delay_ms / 1000.0)
+            time.sleep(server.generation_time(text) * scale)
+            event = {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}]}
+            if last:
+                event['candidates'][0]['finishReason'] = finish_reason
+                event['usageMetadata'] = server.usage(self._payload, reply)
+            self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8'))
+        self._write_chunk(b'')
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    """Threaded mock server that counts requests and TCP connections"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0, reply=MOCK_REPLY, certfile=None, keyfile=None,
+                 chunk_delay_ms=0, words_per_chunk=4, context_cache=True, latency_per_kb_ms=0,
+                 fail_rate=0.0, slow_rate=0.0, slow_ms=0, latency_dist='fixed', latency_spread=0.5,
+                 rate_limit_rate=0.0, tokens_per_second=0, reply_tokens=None, model_scale=None):
+        super().__init__(address, MockGeminiHandler)
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_dist must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency_dist = latency_dist
+        self.latency_spread = latency_spread
+        self.tokens_per_second = tokens_per_second
+        # {substring of the model name: latency multiplier}, e.g. {'lite': 0.4}
+        self.model_scale = dict(model_scale or {})
+        self.fail_rate = fail_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.failures = 0
+        self.latency_ms = latency_ms
+        self.latency_per_kb_ms = latency_per_kb_ms
+        self.chunk_delay_ms = chunk_delay_ms
+        self.words_per_chunk = words_per_chunk
+        self.reply = make_reply(reply_tokens) if reply_tokens else reply
+        self.context_cache = context_cache
+        self.cached_contents = {}
+        self.cached_content_seq = 0
+        self.requests = 0
+        self.connections = 0
+        self.last_path = None
+        self.last_payload = None
+        self._lock = threading.Lock()
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"{self.scheme}://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # Clients that time out or lose a hedging race hang up early; that's expected
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def get_request(self):
+        conn = super().get_request()
+        with self._lock:
+            self.connections += 1
+        return conn
+
+    def record_request(self, path, payload):
+        with self._lock:
+            self.requests += 1
+            self.last_path = path
+            self.last_payload = payload
+
+    def inject_fault(self):
+        """Error status this request should fail with, if any; otherwise maybe stall it (tail latency)"""
+        roll = random.random()
+        if roll < self.fail_rate + self.rate_limit_rate:
+            with self._lock:
+                self.failures += 1
+            return 503 if roll < self.fail_rate else 429
+        if self.slow_rate and random.random() < self.slow_rate:
+            time.sleep(self.slow_ms / 1000.0)
+        return None
+
+    def sample_latency(self):
+        """Seconds until the first token, drawn from the configured distribution"""
+        base = self.latency_ms / 1000.0
+        if not base or self.latency_dist == 'fixed':
+            return base
+        if self.latency_dist == 'uniform':
+            return random.uniform(base * (1 - self.latency_spread), base * (1 + self.latency_spread))
+        if self.latency_dist == 'exponential':
+            return random.expovariate(1 / base)
+        # lognormal: median base, heavier right tail as the spread (sigma) grows
+        return base * random.lognormvariate(0, self.latency_spread)
+
+    def generation_time(self, text):
+        """Seconds to generate text at tokens_per_second (0 if unpaced)"""
+        return estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def model_speed(self, path):
+        """Latency multiplier for the model named in a request path"""
+        model = path.split('/models/', 1)[-1].split(':', 1)[0]
+        for fragment, scale in self.model_scale.items():
+            if fragment in model:
+                return scale
+        return 1.0
+
+    def reply_for(self, payload):
+        """The reply cut to generationConfig.maxOutputTokens, and its finishReason"""
+        limit = (payload.get('generationConfig') or {}).get('maxOutputTokens')
+        if not limit or estimate_tokens(self.reply) <= limit:
+            return self.reply, 'STOP'
+        return self.reply.encode('utf-8')[:limit * 4].decode('utf-8', 'ignore'), 'MAX_TOKENS'
+
+    @staticmethod
+    def prompt_text(payload):
+        """Prompt the model has to read: contents plus an inline systemInstruction (a cached one is preloaded)"""
+        return json.dumps([payload.get('systemInstruction'), payload.get('contents', [])])
+
+    def usage(self, payload, reply=None):
+        prompt = estimate_tokens(self.prompt_text(payload))
+        output = estimate_tokens(self.reply if reply is None else reply)
+        return {'promptTokenCount': prompt, 'candidatesTokenCount': output, 'totalTokenCount': prompt + output}
+
+    def input_delay(self, payload):
+        """Sleep in proportion to the prompt size, like prefill on a real model"""
+        if self.latency_per_kb_ms:
+            size = len(self.prompt_text(payload))
+            time.sleep(self.latency_per_kb_ms * size / 1024 / 1000.0)
+
+    def start(self):
+        """Serve on a background thread; returns self for chaining"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Gemini API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='delay before the response (or the first streamed chunk)')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed',
+                        help='distribution of that delay around --latency-ms')
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='uniform: +/- fraction of --latency-ms; lognormal: sigma')
+    parser.add_argument('--tokens-per-second', type=float, default=0,
+                        help='generation speed after the first token (0 = instant)')
+    parser.add_argument('--reply-tokens', type=int,
+                        help='reply length in tokens (default: a short canned reply)')
+    parser.add_argument('--model-scale', action='append', default=[], metavar='FRAGMENT=SCALE',
+                        help='latency multiplier for models whose name contains FRAGMENT (repeatable)')
+    parser.add_argument('--chunk-delay-ms', type=float, default=0,
+                        help='delay between streamed chunks')
+    parser.add_argument('--latency-per-kb-ms', type=float, default=0,
+                        help='extra delay per KB of prompt (contents and inline systemInstruction)')
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help='fraction of generate requests answered with 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0,
+                        help='fraction of generate requests answered with 429')
+    parser.add_argument('--slow-rate', type=float, default=0,
+                        help='fraction of generate requests delayed by --slow-ms')
+    parser.add_argument('--slow-ms', type=float, default=0)
+    parser.add_argument('--no-context-cache', action='store_true',
+                        help='reject cachedContents creation, like a prompt below the minimum size')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+    model_scale = {}
+    for item in args.model_scale:
+        fragment, _, scale = item.partition('=')
+        model_scale[fragment] = float(scale)
+
+    server = MockGeminiServer((args.host, args.port), latency_ms=args.latency_ms,
+                              chunk_delay_ms=args.chunk_delay_ms,
+                              context_cache=not args.no_context_cache,
+                              latency_per_kb_ms=args.latency_per_kb_ms,
+                              fail_rate=args.fail_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms,
+                              latency_dist=args.latency_dist, latency_spread=args.latency_spread,
+                              rate_limit_rate=args.rate_limit_rate,
+                              tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens,
+                              model_scale=model_scale,
+                              certfile=args.certfile, keyfile=args.keyfile)
+    print(f"Mock Gemini listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Per-request model and output-budget routing for tutoring turns.
+
+A fast local classifier scores each message for complexity and names a
+route, `<subject>.<tier>`. The subject comes from the app's subject
+detector, and the tier is `quick`, `standard` or `deep`. The routing
+table maps a route to a model and generation settings. Lookup tries the
+full route first, then the tier alone, then `standard`. So a table only
+needs entries where a subject should differ from the default. "What is
+a noun?" gets the fast model with a small output budget; a multi-step
+proof gets the full model and budget.
+
+Per-route latency, prompt and output tokens, and how often replies hit
+the output cap are kept for tuning the table.
+"""
+import json
+import re
+import threading
+from collections import deque
+
+from context_builder import estimate_tokens
+from response_cache import is_context_dependent
+
+TIERS = ('quick', 'standard', 'deep')
+
+# Requests for working, proof or comparison: each one pushes toward `deep`
+_DEEP_CUES = re.compile(
+    r'\b(prove|proof|derive|derivation|step[- ]by[- ]step|show (?:that|your work|all)|explain why|'
+    r'compare|contrast|analy[sz]e|evaluate|justify|integral|integrate|derivative|differentiate|'
+    r'limit|optimi[sz]e|system of equations|essay|multi[- ]step|in detail)\b', re.IGNORECASE)
+# Look-up style questions that a short answer settles
+_QUICK_CUES = re.compile(
+    r'^\s*(what(?: is|\'s| are| does)|who (?:is|was)|when (?:is|was|did)|where is|define|'
+    r'definition of|meaning of|spell|how do you spell|is it)\b', re.IGNORECASE)
+_MATH_SYMBOLS = re.compile(r'[=^√∫∑π≤≥±×÷]|\d+\s*[-+*/]\s*\d+')
+
+DEFAULT_ROUTES = {
+    'quick': {'model': None, 'maxOutputTokens': 512, 'temperature': 0.5},
+    'standard': {'model': None, 'maxOutputTokens': 1024},
+    'deep': {'model': None, 'maxOutputTokens': 2048},
+}
+
+
+class Route:
+    """A resolved routing decision: the route name plus its model and config overrides"""
+
+    __slots__ = ('name', 'subject', 'tier', 'model', 'generation_config')
+
+    def __init__(self, name, subject, tier, model, generation_config):
+        self.name = name
+        self.subject = subject
+        self.tier = tier
+        self.model = model
+        self.generation_config = generation_config
+
+    @property
+    def max_output_tokens(self):
+        return self.generation_config.get('maxOutputTokens')
+
+
+class _RouteStats:
+    __slots__ = ('requests', 'latencies', 'latency_total', 'prompt_tokens', 'output_tokens', 'capped')
+
+    def __init__(self, window):
+        self.requests = 0
+        self.latencies = deque(maxlen=window)
+        self.latency_total = 0.0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.capped = 0
+
+
+def load_routes(path):
+    """Read a routing table from a JSON file: {route: {model, maxOutputTokens, ...}}"""
+    with open(path, encoding='utf-8') as f:
+        routes = json.load(f)
+    if not isinstance(routes, dict) or not all(isinstance(v, dict) for v in routes.values()):
+        raise ValueError(f"{path}: expected an object mapping route names to settings")
+    return routes
+
+
+class ModelRouter:
+    """Picks a route per message and keeps per-route latency and token counters"""
+
+    def __init__(self, detect_subject, default_model, routes=None, fast_model=None, metrics=None,
+                 window=512):
+        self.detect_subject = detect_subject
+        self.default_model = default_model
+        self.routes = {name: dict(settings) for name, settings in DEFAULT_ROUTES.items()}
+        if fast_model:
+            self.routes['quick']['model'] = fast_model
+        for name, settings in (routes or {}).items():
+            self.routes[name] = dict(settings)
+        self.metrics = metrics
+        self.window = window
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def complexity(self, message, history=None, image=False):
+        """Heuristic complexity score; roughly 0 (look-up) to 6+ (multi-step working)"""
+        score = min(estimate_tokens(message) / 40.0, 3.0)
+        score += 1.5 * min(len(_DEEP_CUES.findall(message)), 3)
+        score += min(len(_MATH_SYMBOLS.findall(message)) / 3.0, 2.0)
+        score += 0.5 * max(0, message.count('?') - 1)
+        if image:
+            score += 1.0
+        if _QUICK_CUES.match(message):
+            score -= 1.0
+        return score
+
+    def tier(self, message, history=None, image=False):
+        score = self.complexity(message, history, image)
+        if score >= 3.0:
+            return 'deep'
+        # `quick` needs positive evidence: a look-up phrasing or a very short question.
+        # A short follow-up ("why?") is as hard as the conversation it continues,
+        # and image questions need at least the standard model.
+        looks_quick = _QUICK_CUES.match(message) or estimate_tokens(message) <= 8
+        if score < 1.0 and looks_quick and not image and not is_context_dependent(message, history):
+            return 'quick'
+        return 'standard'
+
+    def route(self, message, history=None, image=False, subject=None):
+        """The Route for a message; the first of <subject>.<tier>, <tier>, 'standard' in the table"""
+        subject = subject or self.detect_subject(message)
+        tier = self.tier(message, history, image)
+        name = f"{subject}.{tier}"
+        settings = self.routes.get(name) or self.routes.get(tier) or self.routes['standard']
+        config = {k: v for k, v in settings.items() if k != 'model'}
+        return Route(name, subject, tier, settings.get('model') or self.default_model, config)
+
+    def record(self, route, seconds, prompt_tokens=0, output_tokens=0, capped=False):
+        """Count one completed upstream call on a route"""
+        with self._lock:
+            stats = self._stats.get(route.name)
+            if stats is None:
+                stats = self._stats[route.name] = _RouteStats(self.window)
+            stats.requests += 1
+            stats.latencies.append(seconds)
+            stats.latency_total += seconds
+            stats.prompt_tokens += prompt_tokens or 0
+            stats.output_tokens += output_tokens or 0
+            stats.capped += bool(capped)
+        if self.metrics is not None:
+            self.metrics.observe('tutorly_route_seconds', seconds, route=route.name)
+
+    def stats(self):
+        with self._lock:
+            routes = {}
+            for name, stats in sorted(self._stats.items()):
+                latencies = sorted(stats.latencies)
+                pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 1)
+                routes[name] = {
+                    'requests': stats.requests,
+                    'latency_p50_ms': pick(0.50) if latencies else None,
+                    'latency_p95_ms': pick(0.95) if latencies else None,
+                    'latency_avg_ms': round(stats.latency_total / stats.requests * 1000, 1),
+                    'avg_prompt_tokens': round(stats.prompt_tokens / stats.requests, 1),
+                    'avg_output_tokens': round(stats.output_tokens / stats.requests, 1),
+                    'hit_output_cap': stats.capped,
+                }
+            return {
+                'table': {name: dict(settings, model=settings.get('model') or self.default_model)
+                          for name, settings in sorted(self.routes.items())},
+                'routes': routes,
+            }
@@ -0,0 +1,175 @@
+"""
+Near-duplicate question detection with MinHash LSH.
+
+Questions are reduced to a feature set: content words, character trigrams
+of those words (so small typos still overlap) and whole "formula" tokens
+such as x2+5x+6=0. A 32-bin one-permutation MinHash with densification
+summarizes each set, and LSH banding finds candidates in roughly constant
+time. Candidates must also pass two checks: the estimated Jaccard
+similarity must clear the threshold, and the formula tokens must match
+exactly. So "x^2+5x+6=0" never matches "x^2+7x+6=0".
+
+Memory is bounded: the index is a ring of `capacity` slots and the oldest
+entry is overwritten once it is full.
+"""
+import re
+import threading
+import unicodedata
+import zlib
+from array import array
+
+_OPERATOR_SPACING = re.compile(r'\s*([=+\-*/()<>])\s*')
+_NON_TEXT = re.compile(r"[^\w=+\-*/().<> ]")
+_WHITESPACE = re.compile(r'\s+')
+_TOKEN = re.compile(r'[\w=+\-*/().<>]+')
+
+STOPWORDS = frozenset('''
+    a an and are as at be but by can could do does did for from help how i if in
+    into is it its me my need of on or please should so that the their them then
+    there these this to understand was we what when where which who why will
+    with would you your tell show whats hows'''.split())
+
+_MAX_HASH = 0xFFFFFFFF
+_BUCKET_LIMIT = 16
+
+
+def normalize_question(text):
+    """Fold case and Unicode (x² -> x2), drop ^ and spacing around operators"""
+    text = unicodedata.normalize('NFKC', text or '').casefold().replace('^', '')
+    text = _OPERATOR_SPACING.sub(r'\1', text)
+    text = _NON_TEXT.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip(' .')
+
+
+def question_features(text):
+    """Return (feature set, formula fingerprint) for a question"""
+    features = set()
+    formulas = []
+    for token in _TOKEN.findall(normalize_question(text)):
+        if any(ch.isdigit() for ch in token) or any(ch in '=+-*/<>' for ch in token):
+            formulas.append(token.strip('.()'))
+            features.add('#' + formulas[-1])
+        elif token not in STOPWORDS and len(token) > 1:
+            if len(token) > 3 and token.endswith('s'):
+                token = token[:-1]
+            features.add(token)
+            padded = f'<{token}>'
+            features.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    fingerprint = zlib.crc32(' '.join(sorted(formulas)).encode('utf-8'))
+    return features, fingerprint
+
+
+class MinHashLSH:
+    """Bounded MinHash LSH index mapping question text to a caller-supplied ref"""
+
+    def __init__(self, capacity=100000, num_bins=32, bands=8):
+        if num_bins % bands:
+            raise ValueError('num_bins must be a multiple of bands')
+        self.capacity = capacity
+        self.num_bins = num_bins
+        self.bands = bands
+        self.rows = num_bins // bands
+        self._signatures = array('I', bytes(4 * capacity * num_bins))
+        self._fingerprints = array('I', bytes(4 * capacity))
+        self._refs = [None] * capacity
+        self._buckets = [dict() for _ in range(bands)]
+        self._next = 0
+        self._count = 0
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def signature(self, features):
+        """One-permutation MinHash over num_bins bins, densified by rotation"""
+        k = self.num_bins
+        bins = [_MAX_HASH] * k
+        for feature in features:
+            h = zlib.crc32(feature.encode('utf-8'))
+            # Scramble before splitting so bin and value use independent bits
+            h = (h * 0x9E3779B1) & _MAX_HASH
+            b = h % k
+            if h < bins[b]:
+                bins[b] = h
+        if all(v == _MAX_HASH for v in bins):
+            return None
+        # Empty bins borrow from the next non-empty bin, offset by distance
+        for i in range(k):
+            if bins[i] == _MAX_HASH:
+                j, distance = (i + 1) % k, 1
+                while bins[j] == _MAX_HASH:
+                    j, distance = (j + 1) % k, distance + 1
+                bins[i] = (bins[j] + distance * 0x3C6EF372) & (_MAX_HASH - 1)
+        return bins
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [hash(tuple(signature[b * rows:(b + 1) * rows])) for b in range(self.bands)]
+
+    def add(self, ref, text):
+        """Index text under ref; returns False if the text has no usable features"""
+        features, fingerprint = question_features(text)
+        signature = self.signature(features)
+        if signature is None:
+            return False
+        keys = self._band_keys(signature)
+        with self._lock:
+            slot = self._next
+            if self._refs[slot] is not None:
+                self._stale += 1
+            else:
+                self._count += 1
+            start = slot * self.num_bins
+            self._signatures[start:start + self.num_bins] = array('I', signature)
+            self._fingerprints[slot] = fingerprint
+            self._refs[slot] = ref
+            for band, key in enumerate(keys):
+                bucket = self._buckets[band].get(key)
+                if bucket is None:
+                    self._buckets[band][key] = [slot]
+                else:
+                    bucket.append(slot)
+                    if len(bucket) > _BUCKET_LIMIT:
+                        del bucket[0]
+            self._next = (slot + 1) % self.capacity
+            if self._stale >= self.capacity:
+                self._rebuild()
+        return True
+
+    def _rebuild(self):
+        """Drop bucket entries left behind by overwritten slots"""
+        buckets = [dict() for _ in range(self.bands)]
+        k = self.num_bins
+        for slot, ref in enumerate(self._refs):
+            if ref is None:
+                continue
+            signature = self._signatures[slot * k:(slot + 1) * k]
+            for band, key in enumerate(self._band_keys(signature)):
+                buckets[band].setdefault(key, []).append(slot)
+        self._buckets = buckets
+        self._stale = 0
+
+    def query(self, text, threshold=0.7):
+        """Return (ref, similarity) of the closest indexed question, or None"""
+        features, fingerprint = question_features(text)
+        signature = self.signature(features)
+        if signature is None:
+            return None
+        keys = self._band_keys(signature)
+        k = self.num_bins
+        best = None
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(keys):
+                bucket = self._buckets[band].get(key)
+                if bucket:
+                    candidates.update(bucket)
+            for slot in candidates:
+                if self._fingerprints[slot] != fingerprint:
+                    continue
+                stored = self._signatures[slot * k:(slot + 1) * k]
+                similarity = sum(a == b for a, b in zip(signature, stored)) / k
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (self._refs[slot], similarity)
+        return best
@@ -0,0 +1,245 @@
+"""
+Response cache for repeated tutoring prompts.
+
+Keys are built from a normalized form of (message, trimmed history,
+generation config). Values are the upstream reply text. Backends are
+pluggable: MemoryCacheBackend is an in-process LRU, and SQLiteCacheBackend
+is a file-backed store that several worker processes can share. The
+SQLite backend is a local stand-in for a shared cache service.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCT = re.compile(r'[\s?.!]+$')
+
+# Messages that only make sense together with the earlier conversation
+_FOLLOW_UP = re.compile(
+    r"^(and|but|so|also|why|how come|what about|then|ok|okay|yes|no|thanks?)\b"
+    r"|\b(that|this|it|those|these|above|previous|again|same|last one|step \d+)\b",
+    re.IGNORECASE
+)
+
+
+def normalize_text(text):
+    """Fold case, Unicode forms, whitespace and trailing punctuation"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _TRAILING_PUNCT.sub('', text)
+
+
+def make_cache_key(message, history, generation_config, summary=None, system_prompt=None):
+    """Stable key for a prompt; history should already be trimmed.
+
+    A conversation summary and the system prompt become part of the key
+    only when given, so keys made without them are unchanged.
+    """
+    material = {
+        'message': normalize_text(message),
+        'history': [(turn['sender'], normalize_text(turn['message'])) for turn in history or []],
+        'config': generation_config,
+    }
+    if summary:
+        material['summary'] = hashlib.sha256(summary.encode('utf-8')).hexdigest()
+    if system_prompt:
+        material['system_prompt'] = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def looks_like_follow_up(text):
+    """True for a message that only makes sense after earlier turns ("why?", "what about step 2")"""
+    normalized = normalize_text(text)
+    return len(normalized.split()) <= 3 or bool(_FOLLOW_UP.search(normalized))
+
+
+def is_context_dependent(message, history):
+    """True when the reply likely depends on this student's earlier turns"""
+    return bool(history) and looks_like_follow_up(message)
+
+
+class MemoryCacheBackend:
+    """In-process LRU with a TTL and a cap on total stored bytes"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value.encode('utf-8'))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= self._size(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class SQLiteCacheBackend:
+    """Cache shared by every worker process through one SQLite file.
+
+    Entries carry their size and last-access time. When the byte cap is
+    exceeded, the least recently used entries are deleted.
+    """
+
+    def __init__(self, path, max_bytes=32 * 1024 * 1024, ttl=3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache (accessed_at)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value):
+        size = len(key) + len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, value, size, now + self.ttl, now)
+            )
+            conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (now,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute(
+                    'SELECT key, size FROM response_cache ORDER BY accessed_at LIMIT 1'
+                ).fetchone()
+                conn.execute('DELETE FROM response_cache WHERE key = ?', (oldest[0],))
+                total -= oldest[1]
+                self.evictions += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        entries, total = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache'
+        ).fetchone()
+        return {'backend': 'sqlite', 'entries': entries, 'bytes': total,
+                'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class ResponseCache:
+    """Counts hits and misses in front of a cache backend"""
+
+    def __init__(self, backend, history_turns=0):
+        self.backend = backend
+        self.history_turns = history_turns
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def key_for(self, message, history, generation_config):
+        """Cache key for a prompt, or None when it should not be cached"""
+        if is_context_dependent(message, history):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        trimmed = history[-self.history_turns:] if history and self.history_turns else []
+        return make_cache_key(message, trimmed, generation_config)
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except sqlite3.Error as e:
+            print(f"Response cache read error: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value)
+        except sqlite3.Error as e:
+            print(f"Response cache write error: {e}")
+
+    def stats(self):
+        stats = self.backend.stats()
+        with self._lock:
+            stats.update({'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed})
+        return stats
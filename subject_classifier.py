@@ -0,0 +1,150 @@
+"""
+Weighted subject classification in one pass over the message.
+
+Every subject's vocabulary is compiled into a single lookup table from
+word to (subject, weight). A message is split on whitespace into a set of
+tokens, and the weights of the distinct terms found are summed per
+subject; the subject with the highest total wins. A term counts once
+however often it appears, so an essay that keeps saying "energy" isn't
+pulled into science by repetition alone. Because whole words are
+matched, "cell" no longer matches inside "excellent". Case doesn't
+matter, so "DNA" matches. A term also
+matches its plural ("equations"). A term ending in `*` matches as a
+prefix: "photosynth*" covers photosynthesis and photosynthetic. Token
+lookups are memoized and matched against the message with C set
+operations, so a long pasted essay costs little more than splitting it.
+
+Vocabularies are plain data: {subject: {term: weight}}, one word per term.
+A JSON file of the same shape adds terms or whole new subjects to the
+defaults.
+"""
+import json
+import re
+
+# Subject names and unambiguous terms weigh 3. Words that also turn up in
+# other subjects ("graph", "energy", "character") weigh 1.
+DEFAULT_VOCABULARY = {
+    'math': {
+        'math': 3, 'maths': 3, 'mathematics': 3, 'algebra*': 3, 'geometry': 3, 'calculus': 3,
+        'equation': 2, 'formula': 2, 'derivative': 3, 'integral': 3, 'statistics': 2, 'probability': 3,
+        'triangle': 2, 'circle': 1, 'polynomial': 3, 'fraction': 2, 'decimal': 2, 'percentage': 1,
+        'quadratic': 3, 'linear': 1, 'slope': 2, 'angle': 1, 'trigonometr*': 3, 'logarithm': 3,
+        'theorem': 2, 'calculat*': 1, 'solve': 1, 'graph': 1, 'multiply': 2, 'divide': 1,
+    },
+    'science': {
+        'science': 3, 'biology': 3, 'chemistry': 3, 'physics': 3, 'molecule': 3, 'atom': 3,
+        'cell': 2, 'experiment': 2, 'hypothesis': 2, 'chemical': 2, 'force': 1, 'energy': 1,
+        'dna': 3, 'evolution': 2, 'photosynth*': 3, 'organism': 3, 'ecosystem': 3, 'gravity': 2,
+        'velocity': 2, 'acceleration': 2, 'electron': 3, 'reaction': 1, 'mitosis': 3, 'meiosis': 3,
+        'gene': 2, 'protein': 2, 'element': 1, 'compound': 1,
+    },
+    'english': {
+        'english': 3, 'literature': 3, 'essay': 2, 'grammar': 3, 'writing': 2, 'poem': 3, 'poetry': 3,
+        'story': 1, 'character': 1, 'theme': 1, 'analysis': 1, 'paragraph': 2, 'sentence': 2,
+        'novel': 2, 'author': 2, 'noun': 3, 'verb': 3, 'adjective': 3, 'metaphor': 3, 'simile': 3,
+        'thesis': 2, 'punctuation': 3, 'spelling': 2, 'vocabulary': 2, 'shakespeare': 3,
+    },
+    'history': {
+        'history': 3, 'historical': 3, 'historian': 3, 'ancient': 2, 'medieval': 3, 'century': 2,
+        'war': 2, 'revolution': 2, 'empire': 3, 'civilization': 3, 'dynasty': 3, 'treaty': 3,
+        'colony': 2, 'colonies': 2, 'colonial*': 2, 'independence': 2, 'constitution': 2,
+        'president': 1, 'democracy': 1, 'monarchy': 3, 'timeline': 2, 'era': 1, 'battle': 2,
+        'slavery': 2, 'renaissance': 3, 'feudal*': 3, 'pharaoh': 3,
+    },
+}
+
+DEFAULT_SUBJECT = 'general'
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def load_vocabulary(path):
+    """Read {subject: {term: weight}} from a JSON file"""
+    with open(path, encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    if not isinstance(vocabulary, dict) or not all(isinstance(v, dict) for v in vocabulary.values()):
+        raise ValueError(f"{path}: expected an object mapping subjects to {{term: weight}}")
+    return vocabulary
+
+
+def merge_vocabulary(base, extra):
+    """Vocabulary with extra's terms added to (or overriding) base's; new subjects go last"""
+    merged = {subject: dict(terms) for subject, terms in base.items()}
+    for subject, terms in (extra or {}).items():
+        merged.setdefault(subject, {}).update(terms)
+    return merged
+
+
+class SubjectClassifier:
+    """Scores a message against every subject's weighted vocabulary in one pass"""
+
+    def __init__(self, vocabulary=None, default=DEFAULT_SUBJECT, min_score=1, memo_size=50000):
+        self.vocabulary = vocabulary or DEFAULT_VOCABULARY
+        self.subjects = list(self.vocabulary)
+        self.default = default
+        self.min_score = min_score
+        self.memo_size = memo_size
+        self._words = {}
+        self._prefixes = {}
+        for subject, terms in self.vocabulary.items():
+            for term, weight in terms.items():
+                word = term.lower()
+                table = self._prefixes if word.endswith('*') else self._words
+                word = word.rstrip('*')
+                if not _WORD.fullmatch(word):
+                    raise ValueError(f"Subject term must be a single word: {term!r}")
+                table[word] = (word, subject, weight)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes}, reverse=True)
+        # Token -> frozenset of (term, subject, weight) hits; _matching holds the tokens with any
+        self._memo = {}
+        self._matching = set()
+
+    def _lookup(self, word):
+        """(term, subject, weight) for a word, or None"""
+        hit = self._words.get(word)
+        if hit is None and word.endswith('s'):
+            hit = self._words.get(word[:-1])
+            if hit is None and word.endswith('es'):
+                hit = self._words.get(word[:-2])
+        if hit is None:
+            # Longest prefix first, so "photosynth*" wins over a shorter prefix of it
+            for length in self._prefix_lengths:
+                hit = self._prefixes.get(word[:length])
+                if hit is not None:
+                    break
+        return hit
+
+    def _learn(self, tokens):
+        """Memoize the hits of tokens not seen before; they may carry punctuation or hyphens"""
+        if len(self._memo) + len(tokens) > self.memo_size:
+            self._memo.clear()
+            self._matching.clear()
+        for token in tokens:
+            hits = frozenset(hit for hit in map(self._lookup, _WORD.findall(token)) if hit is not None)
+            self._memo[token] = hits
+            if hits:
+                self._matching.add(token)
+
+    def scores(self, message):
+        """{subject: summed weight of the distinct terms of that subject found in the message}"""
+        # Set operations run in C; only tokens never seen before reach Python code
+        tokens = set(message.lower().split())
+        unseen = tokens.difference(self._memo)
+        if unseen:
+            self._learn(unseen)
+        found = set()
+        for token in tokens & self._matching:
+            # .get: another thread may have just cleared the memo
+            found.update(self._memo.get(token, ()))
+        scores = dict.fromkeys(self.subjects, 0)
+        for term, subject, weight in found:
+            scores[subject] += weight
+        return scores
+
+    def classify(self, message):
+        """The highest-scoring subject; ties go to the subject listed first"""
+        scores = self.scores(message)
+        best = max(self.subjects, key=scores.__getitem__) if self.subjects else None
+        if best is None or scores[best] < self.min_score:
+            return self.default
+        return best
@@ -0,0 +1,846 @@
+"""
+Shared plumbing for Tutorly's upstream (Gemini) HTTP traffic
+"""
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamClient:
+    """Process-wide HTTP client with a pooled keep-alive session.
+
+    One requests.Session is shared by every request thread so TCP/TLS
+    connections to the upstream host are reused instead of being set up
+    for every tutoring turn. Connect and read timeouts are separate.
+    """
+
+    def __init__(self, pool_size=10, keep_alive=True, connect_timeout=5.0,
+                 read_timeout=30.0, verify=True):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._adapter = adapter
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._errors = 0
+
+    def post(self, url, **kwargs):
+        """POST through the shared session; raises requests exceptions like requests.post"""
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Send any request through the shared session with the client's timeouts"""
+        kwargs.setdefault('timeout', self.timeout)
+        # Passed per call: a Session-level verify is overridden by REQUESTS_CA_BUNDLE
+        kwargs.setdefault('verify', self.verify)
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        """Pool utilization counters"""
+        connections_opened = 0
+        idle_connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'keep_alive': self.keep_alive,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'requests': self._requests,
+                'errors': self._errors,
+                'connections_opened': connections_opened,
+                'idle_connections': idle_connections,
+                'utilization': self._in_flight / self.pool_size if self.pool_size else 0.0,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class GatewaySaturated(Exception):
+    """Raised when the LLM gateway has no free slot or queue space"""
+
+
+class StreamTruncated(Exception):
+    """Raised when a stream that has already produced output stops before it finished"""
+
+
+class StreamFinished:
+    """Last item of a stream that ran to completion, with the reason it ended"""
+
+    __slots__ = ('reason',)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+_STREAM_END = object()
+
+
+class _StreamError:
+    """An exception raised by a streamed generator, passed to the reading thread"""
+
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+# Priority classes for upstream work, most urgent first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = ('interactive', 'background')
+
+
+class QuotaTracker:
+    """Sliding one-minute window of upstream requests and estimated tokens.
+
+    Background work may only use `background_share` of either limit, so
+    interactive requests always keep some headroom. A limit of 0 means
+    unlimited. Not thread-safe on its own; the gateway calls it under its
+    lock.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, background_share=0.8):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.background_share = background_share
+        self._events = deque()
+        self._tokens = 0
+
+    def _trim(self, now):
+        while self._events and self._events[0][0] <= now - 60.0:
+            self._tokens -= self._events.popleft()[1]
+
+    def wait_time(self, cost, priority, now):
+        """Seconds until a call of `cost` tokens fits the quota (0 if it fits now)"""
+        self._trim(now)
+        if not self._events:
+            return 0.0
+        share = 1.0 if priority == INTERACTIVE else self.background_share
+        over = (self.requests_per_minute and len(self._events) + 1 > self.requests_per_minute * share) or \
+               (self.tokens_per_minute and self._tokens + cost > self.tokens_per_minute * share)
+        return max(0.001, self._events[0][0] + 60.0 - now) if over else 0.0
+
+    def record(self, cost, now):
+        self._events.append((now, cost))
+        self._tokens += cost
+
+    def stats(self, now):
+        self._trim(now)
+        return {'requests_per_minute': self.requests_per_minute,
+                'tokens_per_minute': self.tokens_per_minute,
+                'requests_last_minute': len(self._events),
+                'tokens_last_minute': self._tokens}
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'priority', 'cost', 'enqueued_at')
+
+    def __init__(self, fn, args, kwargs, priority, cost):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class LLMGateway:
+    """Bounded, prioritized scheduler that owns every upstream LLM call.
+
+    At most `max_concurrency` calls run at once. Waiting work is kept in
+    one queue per priority class, and interactive work is always started
+    before background work. Background work may never hold more than
+    `background_concurrency` workers, so a burst of summaries can't make
+    students wait for a free worker. Within a class, calls are ordered by
+    start-time fair queuing on their `flow` (the student), so one busy
+    student can't starve the others. With a QuotaTracker, calls are only
+    started while they fit the requests/min and tokens/min quota.
+
+    Each class queue holds at most its limit (`max_queue` interactive,
+    `background_queue` background). Beyond that, submissions are rejected
+    straight away. Callers wait at most `max_wait` seconds for a result
+    before falling back.
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=16, max_wait=35.0, background_queue=64,
+                 background_concurrency=None, quota=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.queue_limits = (max_queue, background_queue)
+        self.background_concurrency = (background_concurrency if background_concurrency is not None
+                                       else max(1, max_concurrency // 2))
+        self.quota = quota
+        self._cond = threading.Condition()
+        self._queues = ([], [])
+        self._vtime = [0.0, 0.0]
+        self._flow_finish = ({}, {})
+        self._seq = itertools.count()
+        self._running = [0, 0]
+        self._closed = False
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._waits = (deque(maxlen=512), deque(maxlen=512))
+        self._workers = [threading.Thread(target=self._work, name=f'llm-gateway-{i}', daemon=True)
+                         for i in range(max_concurrency)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args, priority=INTERACTIVE, flow=None, cost=1, **kwargs):
+        """Queue fn on the gateway; raises GatewaySaturated when its class queue is full"""
+        job = _Job(fn, args, kwargs, priority, cost)
+        with self._cond:
+            queue_ = self._queues[priority]
+            if self._closed or len(queue_) >= self.queue_limits[priority]:
+                self._rejected += 1
+                raise GatewaySaturated()
+            # Start-time fair queuing: a flow's next job starts where its last one finished
+            finish = self._flow_finish[priority]
+            start = self._vtime[priority] if flow is None else max(self._vtime[priority], finish.get(flow, 0.0))
+            if flow is not None:
+                finish[flow] = start + cost
+            heapq.heappush(queue_, (start, next(self._seq), job))
+            self._cond.notify()
+        return job.future
+
+    def _pick(self, now):
+        """Next job to start, or (None, seconds to wait; None = until notified)"""
+        wait_for = None
+        for priority in (INTERACTIVE, BACKGROUND):
+            queue_ = self._queues[priority]
+            while queue_ and queue_[0][2].future.cancelled():
+                heapq.heappop(queue_)
+            if not queue_:
+                continue
+            if priority == BACKGROUND and self._running[BACKGROUND] >= self.background_concurrency:
+                continue
+            start, _, job = queue_[0]
+            if self.quota is not None:
+                delay = self.quota.wait_time(job.cost, priority, now)
+                if delay:
+                    wait_for = delay if wait_for is None else min(wait_for, delay)
+                    if priority == INTERACTIVE:
+                        # Background work must not take quota an interactive call is waiting for
+                        break
+                    continue
+                self.quota.record(job.cost, now)
+            heapq.heappop(queue_)
+            self._vtime[priority] = start
+            finish = self._flow_finish[priority]
+            if len(finish) > 4096:
+                for flow in [f for f, t in finish.items() if t <= start]:
+                    del finish[flow]
+            self._waits[priority].append(now - job.enqueued_at)
+            return job, None
+        return None, wait_for
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    job, wait_for = self._pick(time.monotonic())
+                    if job is not None:
+                        break
+                    self._cond.wait(timeout=wait_for)
+                self._running[job.priority] += 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[job.priority] -= 1
+                    self._completed += 1
+                    # A finished background job may unblock the next one
+                    self._cond.notify()
+
+    def call(self, fn, *args, fallback, priority=INTERACTIVE, flow=None, cost=1, max_wait=None, **kwargs):
+        """Run fn on the gateway and wait for it; fallback() if saturated or too slow"""
+        try:
+            future = self.submit(fn, *args, priority=priority, flow=flow, cost=cost, **kwargs)
+        except GatewaySaturated:
+            return fallback()
+        try:
+            return future.result(timeout=self.max_wait if max_wait is None else max_wait)
+        except FutureTimeout:
+            # Dropped from the queue if it hasn't started yet
+            future.cancel()
+            with self._cond:
+                self._timeouts += 1
+            return fallback()
+        except CancelledError:
+            # Dropped by shutdown()
+            return fallback()
+
+    def stream(self, gen_fn, *args, fallback=None, priority=INTERACTIVE, flow=None, cost=1, **kwargs):
+        """Run a generator on the gateway and yield its items on the caller's thread.
+
+        max_wait is an idle timeout: it bounds the wait for each item, not
+        the whole stream. If the gateway is full, or the first item doesn't
+        arrive in time, yields fallback() once (or nothing when fallback is
+        None). If the stream stalls after it has produced items, raises
+        StreamTruncated, so callers can't mistake a partial stream for a
+        finished one. Errors from gen_fn are re-raised on the caller's thread.
+        """
+        items = queue.Queue()
+        abandoned = threading.Event()
+
+        def pump():
+            try:
+                for item in gen_fn(*args, **kwargs):
+                    if abandoned.is_set():
+                        # Nobody is reading any more; stop the upstream call
+                        break
+                    items.put(item)
+            except BaseException as e:
+                items.put(_StreamError(e))
+            finally:
+                items.put(_STREAM_END)
+
+        try:
+            future = self.submit(pump, priority=priority, flow=flow, cost=cost)
+        except GatewaySaturated:
+            if fallback is not None:
+                yield fallback()
+            return
+
+        produced = False
+        try:
+            while True:
+                try:
+                    item = items.get(timeout=self.max_wait)
+                except queue.Empty:
+                    future.cancel()
+                    with self._cond:
+                        self._timeouts += 1
+                    if produced:
+                        raise StreamTruncated(f"no stream output for {self.max_wait}s")
+                    if fallback is not None:
+                        yield fallback()
+                    return
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, _StreamError):
+                    raise item.error
+                produced = True
+                yield item
+        finally:
+            abandoned.set()
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'running': sum(self._running),
+                'queued': sum(len(q) for q in self._queues),
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+            }
+            for priority, name in enumerate(PRIORITY_NAMES):
+                waits = sorted(self._waits[priority])
+                stats[name] = {
+                    'running': self._running[priority],
+                    'queued': len(self._queues[priority]),
+                    'queue_wait_p95_ms': round(waits[int(len(waits) * 0.95) - 1] * 1000, 1) if waits else None,
+                }
+            if self.quota is not None:
+                stats['quota'] = self.quota.stats(time.monotonic())
+        return stats
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            for queue_ in self._queues:
+                for _, _, job in queue_:
+                    job.future.cancel()
+                queue_.clear()
+            self._cond.notify_all()
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Raised instead of calling the upstream while the circuit breaker is open.
+
+    A RequestException subclass, so callers that already handle network
+    errors fall back straight away.
+    """
+
+
+class CircuitBreaker:
+    """Fails fast while the upstream error rate is too high.
+
+    closed: calls go through and outcomes are tracked over a sliding
+    `window` of seconds. Once at least `min_requests` calls have been seen
+    and the failure rate reaches `failure_rate`, the breaker opens.
+    open: every call is refused for `open_seconds`.
+    half_open: up to `half_open_probes` trial calls go through. One success
+    closes the breaker again, and one failure reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate=0.5, min_requests=10, window=30.0, open_seconds=15.0,
+                 half_open_probes=1):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.transitions = {}
+        self.short_circuited = 0
+        self.last_transition = None
+
+    def _transition(self, state):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.last_transition = (key, time.time())
+        self.state = state
+        self._outcomes.clear()
+        self._failures = 0
+        self._probes = 0
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+
+    def allow(self):
+        """True if a call may go to the upstream now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.short_circuited += 1
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.short_circuited += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED if success else self.OPEN)
+                return
+            if self.state == self.OPEN:
+                return
+            now = time.monotonic()
+            self._outcomes.append((now, success))
+            if not success:
+                self._failures += 1
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                if not self._outcomes.popleft()[1]:
+                    self._failures -= 1
+            total = len(self._outcomes)
+            if total >= self.min_requests and self._failures / total >= self.failure_rate:
+                self._transition(self.OPEN)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'transitions': dict(self.transitions),
+                'last_transition': self.last_transition[0] if self.last_transition else None,
+                'last_transition_at': self.last_transition[1] if self.last_transition else None,
+                'short_circuited': self.short_circuited,
+                'window_requests': len(self._outcomes),
+                'window_failures': self._failures,
+            }
+
+
+class RetryBudget:
+    """Caps retries (and hedges) at a fraction of recent traffic.
+
+    Over the last `window` seconds, at most `ratio` x requests +
+    `min_per_second` x window extra attempts are allowed. Retries
+    therefore can't multiply the load on an upstream that is already
+    struggling.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, window=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _trim(self, now):
+        cutoff = now - self.window
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def deposit(self):
+        """Count one original request"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def withdraw(self):
+        """Take one retry from the budget; False if it is used up"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            allowed = self.ratio * len(self._requests) + self.min_per_second * self.window
+            if len(self._retries) + 1 > allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+
+class UpstreamPolicy:
+    """Circuit breaker, budgeted jittered retries and optional hedging around upstream calls.
+
+    call(send) invokes send() (which returns a requests Response) and
+    classifies the outcome. Connection errors, 429 and 5xx replies count as
+    failures and are retried with full-jitter exponential backoff while
+    the retry budget allows. Read timeouts are not retried; the caller has
+    already waited the full read timeout. With hedging on, a second
+    identical request is sent if the first hasn't answered within the
+    recent p95 latency, and whichever succeeds first is used.
+    """
+
+    RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, breaker=None, budget=None, max_attempts=3, backoff_base=0.2,
+                 backoff_max=2.0, hedge=False, hedge_min_delay=0.05, latency_samples=512):
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies = deque(maxlen=latency_samples)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-hedge') if hedge else None
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _failed(self, response):
+        return response.status_code in self.RETRYABLE_STATUS
+
+    def hedge_delay(self):
+        """p95 of recent successful latencies, or None until enough samples exist"""
+        with self._lock:
+            if len(self._latencies) < 20:
+                return None
+            ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    def _attempt(self, send):
+        """One guarded call; raises CircuitOpen or whatever send() raised"""
+        if not self.breaker.allow():
+            raise CircuitOpen('upstream circuit breaker is open')
+        start = time.monotonic()
+        try:
+            response = send()
+        except BaseException:
+            # Any exception must settle a half-open probe, or the breaker stays stuck
+            self.breaker.record(False)
+            raise
+        ok = not self._failed(response)
+        self.breaker.record(ok)
+        if ok:
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+        return response
+
+    def _hedged(self, send):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(send)
+        primary = self._hedge_executor.submit(self._attempt, send)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self.budget.withdraw():
+            return primary.result()
+        with self._lock:
+            self.hedges += 1
+        backup = self._hedge_executor.submit(self._attempt, send)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+                if self._failed(response) and pending:
+                    response.close()
+                    continue
+                # Close whichever response loses the race once it arrives
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                if future is backup:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return response
+        raise error
+
+    def call(self, send, hedge=True):
+        """Send through the breaker with retries; returns the last response or raises"""
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                if hedge and self.hedge:
+                    response = self._hedged(send)
+                else:
+                    response = self._attempt(send)
+                if not self._failed(response) or attempt >= self.max_attempts:
+                    return response
+            except (CircuitOpen, requests.exceptions.ReadTimeout):
+                raise
+            except requests.exceptions.RequestException:
+                if attempt >= self.max_attempts:
+                    raise
+                response = None
+            if not self.budget.withdraw():
+                if response is None:
+                    raise requests.exceptions.RetryError('upstream retry budget exhausted')
+                return response
+            if response is not None:
+                response.close()
+            with self._lock:
+                self.retries += 1
+            # Full jitter: sleep somewhere between 0 and the exponential cap
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))))
+            attempt += 1
+
+    def stats(self):
+        delay = self.hedge_delay()
+        with self._lock:
+            stats = {
+                'breaker': self.breaker.stats(),
+                'retries': self.retries,
+                'retry_budget_exhausted': self.budget.exhausted,
+                'hedging': self.hedge,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+            }
+        stats['hedge_delay_ms'] = round(delay * 1000, 1) if delay is not None else None
+        return stats
+
+    def shutdown(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _close_response(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+class _Flight:
+    __slots__ = ('cond', 'chunks', 'result', 'error', 'finished', 'sharers', 'readers', 'abandoned')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.finished = False
+        self.sharers = 0
+        self.readers = 0
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Coalesces identical concurrent upstream calls.
+
+    The first caller for a key (the leader) makes the call; callers that
+    arrive with the same key while it is in flight wait and receive the
+    same result. Once the call finishes the key is forgotten, so results
+    are never served after the fact (that's the response cache's job).
+    A follower waits at most `max_wait` seconds for the leader, so a stuck
+    call can't hold every coalesced request thread with it.
+    """
+
+    def __init__(self, max_wait=None):
+        self.max_wait = max_wait
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.max_sharers = 0
+        self.timeouts = 0
+        self.abandoned = 0
+
+    def _join(self, key, reader=False):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                flight.sharers += 1
+                self.followers += 1
+                self.max_sharers = max(self.max_sharers, flight.sharers)
+            if reader:
+                flight.readers += 1
+            return flight, leader
+
+    def _leave(self, key, flight):
+        """A stream reader is gone; the last one to go abandons an unfinished stream"""
+        with self._lock:
+            flight.readers -= 1
+            if flight.readers or flight.finished:
+                return
+            # Later callers start a fresh call instead of joining one that is being closed
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.abandoned = True
+            self.abandoned += 1
+
+    def _finish(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.finished = True
+            flight.cond.notify_all()
+
+    def do(self, key, fn, fallback):
+        """Return fn()'s result, sharing one call among concurrent callers with this key.
+
+        A follower gets fallback() if the leader hasn't finished within max_wait.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                self._finish(key, flight)
+        else:
+            with flight.cond:
+                finished = flight.cond.wait_for(lambda: flight.finished, self.max_wait)
+            if not finished:
+                with self._lock:
+                    self.timeouts += 1
+                return fallback()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key, gen_fn):
+        """Yield gen_fn()'s items, sharing one generator among concurrent callers.
+
+        The shared generator is driven on its own thread, so a leader whose
+        client disconnects doesn't cut the stream short for the others.
+        Callers that join late first receive the items produced so far.
+        Once every reader has gone, the generator is closed after its next
+        item instead of being drained for nobody.
+        """
+        flight, leader = self._join(key, reader=True)
+        if leader:
+            def pump():
+                gen = gen_fn()
+                try:
+                    for item in gen:
+                        if flight.abandoned:
+                            break
+                        with flight.cond:
+                            flight.chunks.append(item)
+                            flight.cond.notify_all()
+                except BaseException as e:
+                    flight.error = e
+                finally:
+                    gen.close()
+                    self._finish(key, flight)
+            threading.Thread(target=pump, name='single-flight-stream', daemon=True).start()
+
+        position = 0
+        try:
+            while True:
+                with flight.cond:
+                    flight.cond.wait_for(lambda: flight.finished or len(flight.chunks) > position)
+                    items = flight.chunks[position:]
+                    finished = flight.finished
+                for item in items:
+                    yield item
+                position += len(items)
+                if finished and position == len(flight.chunks):
+                    break
+        finally:
+            self._leave(key, flight)
+        if flight.error is not None:
+            raise flight.error
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'upstream_calls': self.leaders,
+                'coalesced': self.followers,
+                'max_sharers': self.max_sharers,
+                'timeouts': self.timeouts,
+                'abandoned_streams': self.abandoned,
+            }
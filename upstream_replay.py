@@ -0,0 +1,262 @@
+"""
+Record and replay of upstream (Gemini) traffic.
+
+With GEMINI_RECORD set, every upstream request is sent as usual and also
+written to a recording: its fingerprint, the status and body of the
+reply, the time until the reply arrived and, for streamed replies, when
+each chunk arrived. The file is JSON lines, gzip-compressed when the name
+ends in .gz.
+
+With GEMINI_REPLAY set, no upstream is contacted. Each request is answered
+from the recording, after the same delays as the original (scaled by
+GEMINI_REPLAY_SPEED; 0 answers at once). Connection errors and timeouts
+are replayed as the same exceptions. Recording a day's traffic and
+replaying it against a new build gives both builds the same upstream.
+
+A request is matched first by fingerprint: method, path without the API
+key, and body, canonically serialized. Repeats of one fingerprint are
+served in recorded order, and the last one is reused once they run out. A
+build that sends different prompts gets no exact matches. It is then
+served the recordings for the same method and path in recorded order.
+stats() shows how many requests matched exactly.
+"""
+import codecs
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.utils import stream_decode_response_unicode
+
+REPLAYED_ERRORS = {
+    'ConnectionError': requests.exceptions.ConnectionError,
+    'ConnectTimeout': requests.exceptions.ConnectTimeout,
+    'ReadTimeout': requests.exceptions.ReadTimeout,
+    'Timeout': requests.exceptions.Timeout,
+}
+
+
+def _endpoint(method, url):
+    """Method and path plus non-secret query parameters, e.g. 'POST /v1beta/models/m:generateContent'"""
+    parts = urlsplit(url)
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != 'key'])
+    return f"{method.upper()} {parts.path}" + (f"?{query}" if query else '')
+
+
+def fingerprint(method, url, body=None):
+    """Stable hash of a request, ignoring the API key and JSON key order"""
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':')) if body is not None else ''
+    digest = hashlib.sha256(f"{_endpoint(method, url)}\n{canonical}".encode('utf-8'))
+    return digest.hexdigest()[:24]
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class TrafficRecorder:
+    """Appends one JSON line per upstream exchange; safe to share between threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = _open(path, 'w')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.records = 0
+
+    def offset(self):
+        return time.monotonic() - self._started
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingClient:
+    """Wraps an UpstreamClient and records every exchange it makes"""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        record = {
+            't': round(self.recorder.offset(), 3),
+            'endpoint': _endpoint(method, url),
+            'fp': fingerprint(method, url, kwargs.get('json')),
+        }
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            record['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            record['error'] = type(e).__name__
+            self.recorder.write(record)
+            raise
+        record['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        record['status'] = response.status_code
+        record['content_type'] = response.headers.get('Content-Type', '')
+        if kwargs.get('stream'):
+            self._record_stream(response, record, time.perf_counter())
+        else:
+            record['body'] = response.text
+            self.recorder.write(record)
+        return response
+
+    def _record_stream(self, response, record, headers_at):
+        """Record chunks as the caller reads them; written once the body is done or dropped"""
+        iter_content, close = response.iter_content, response.close
+        chunks = record['chunks'] = []
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        written = []
+
+        def write():
+            if not written:
+                written.append(True)
+                self.recorder.write(record)
+
+        def recording_iter_content(chunk_size=1, decode_unicode=False):
+            try:
+                for chunk in iter_content(chunk_size=chunk_size, decode_unicode=decode_unicode):
+                    text = chunk if isinstance(chunk, str) else decoder.decode(chunk)
+                    chunks.append([round((time.perf_counter() - headers_at) * 1000, 1), text])
+                    yield chunk
+            finally:
+                write()
+
+        def recording_close():
+            write()
+            close()
+        # iter_lines() and .text read through iter_content, so one hook sees the whole body
+        response.iter_content = recording_iter_content
+        response.close = recording_close
+
+    def stats(self):
+        stats = self.client.stats()
+        stats['recording'] = {'path': self.recorder.path, 'records': self.recorder.records}
+        return stats
+
+    def close(self):
+        self.client.close()
+        self.recorder.close()
+
+
+class ReplayResponse(requests.Response):
+    """A requests.Response rebuilt from a recording, streaming chunks with their original timing"""
+
+    def __init__(self, record, url, speed):
+        super().__init__()
+        self.status_code = record.get('status', 200)
+        self.headers['Content-Type'] = record.get('content_type', 'application/json')
+        self.url = url
+        self.encoding = 'utf-8'
+        self.raw = io.BytesIO()
+        self._chunks = record.get('chunks')
+        self._speed = speed
+        if self._chunks is None:
+            self._content = record.get('body', '').encode('utf-8')
+            self._content_consumed = True
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        if self._chunks is None:
+            return super().iter_content(chunk_size, decode_unicode)
+
+        def chunks():
+            started = time.perf_counter()
+            for at_ms, text in self._chunks:
+                if self._speed:
+                    delay = at_ms / 1000.0 / self._speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                yield text.encode('utf-8')
+            self._content_consumed = True
+        return stream_decode_response_unicode(chunks(), self) if decode_unicode else chunks()
+
+
+class ReplayClient:
+    """Stands in for UpstreamClient and answers every request from a recording"""
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self._exact = {}
+        self._by_endpoint = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self.records = 0
+        self.exact_hits = 0
+        self.endpoint_hits = 0
+        self.misses = 0
+        with _open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._exact.setdefault(record['fp'], deque()).append(record)
+                self._by_endpoint.setdefault(record['endpoint'], []).append(record)
+                self.records += 1
+
+    def _find(self, method, url, body):
+        endpoint = _endpoint(method, url)
+        with self._lock:
+            repeats = self._exact.get(fingerprint(method, url, body))
+            if repeats:
+                self.exact_hits += 1
+                return repeats.popleft() if len(repeats) > 1 else repeats[0]
+            candidates = self._by_endpoint.get(endpoint)
+            if candidates:
+                self.endpoint_hits += 1
+                cursor = self._cursors.get(endpoint, 0)
+                self._cursors[endpoint] = cursor + 1
+                return candidates[cursor % len(candidates)]
+            self.misses += 1
+            return None
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        record = self._find(method, url, kwargs.get('json'))
+        if record is None:
+            record = {'status': 404, 'latency_ms': 0,
+                      'body': json.dumps({'error': {'code': 404, 'message': 'No recording for this request'}})}
+        if self.speed:
+            time.sleep(record.get('latency_ms', 0) / 1000.0 / self.speed)
+        if 'error' in record:
+            raise REPLAYED_ERRORS.get(record['error'], requests.exceptions.ConnectionError)(
+                f"Replayed {record['error']}")
+        return ReplayResponse(record, url, self.speed)
+
+    def stats(self):
+        with self._lock:
+            return {'replay': {
+                'path': self.path,
+                'speed': self.speed,
+                'records': self.records,
+                'exact_hits': self.exact_hits,
+                'endpoint_hits': self.endpoint_hits,
+                'misses': self.misses,
+            }}
+
+    def close(self):
+        pass